@@ -0,0 +1,114 @@
+"""Database size and restore latency with compressed, lazily loaded document texts
+
+Seeds two throwaway databases with the same scraped-page-sized documents, one storing texts as
+plain TEXT and one through the compressing field, then measures file size and load_tasks latency
+with and without reading every document text.
+
+Run from the repository root:
+    python -m _benchmarks.document_storage
+"""
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from db import db, configure_database
+from db.migrations import run_migrations
+from db.blobs import store_blob
+from db.models import DocumentBlobModel, DocumentModel, TaskModel, TaskActionModel, TaskActionDocumentModel
+from db.tasks import load_tasks
+
+TASKS = 20
+ACTIONS_PER_TASK = 10
+DOCUMENT_WORDS = 6000  # roughly a 40 KB scraped page
+REPEATS = 3
+
+random.seed(7)
+VOCABULARY = [
+    "".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(random.randint(3, 10)))
+    for _ in range(3000)
+]
+
+
+def scraped_page() -> str:
+    lines = []
+    for index in range(DOCUMENT_WORDS // 12):
+        if index % 15 == 0:
+            lines.append(f"\n## {' '.join(random.choices(VOCABULARY, k=4)).title()}\n")
+        lines.append(" ".join(random.choices(VOCABULARY, k=12)) + ".")
+    return "\n".join(lines)
+
+
+def seed(conversation_uuid: str) -> None:
+    with db.atomic():
+        for task_index in range(TASKS):
+            task = TaskModel.create(
+                uuid=str(uuid.uuid4()),
+                conversation_uuid=conversation_uuid,
+                name=f"Task {task_index}",
+                description="Benchmark task",
+                status="done"
+            )
+            for step in range(ACTIONS_PER_TASK):
+                action = TaskActionModel.create(
+                    uuid=str(uuid.uuid4()),
+                    task=task,
+                    name=f"Scrape {step}",
+                    tool_uuid="web",
+                    tool_action="scrape",
+                    step=step,
+                    status="completed"
+                )
+                document = DocumentModel.create(
+                    uuid=str(uuid.uuid4()),
+                    conversation_uuid=conversation_uuid,
+                    content_hash=store_blob(scraped_page()),
+                    metadata={"name": "WebScrapeResult", "mime_type": "text/markdown"}
+                )
+                TaskActionDocumentModel.create(task_action=action, document=document)
+
+
+def database_size_mb(path: str) -> float:
+    db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(path) / (1024 * 1024)
+
+
+def restore_ms(conversation_uuid: str, read_texts: bool) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        tasks = load_tasks(conversation_uuid)
+        if read_texts:
+            sum(len(document.text) for task in tasks for action in task.actions for document in action.output_documents)
+    return (time.perf_counter() - started) * 1000 / REPEATS
+
+
+def main():
+    default_threshold = DocumentBlobModel.text.compression_threshold
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, threshold in (("plain TEXT", 1 << 62), ("zlib above 4 KB", default_threshold)):
+            DocumentBlobModel.text.compression_threshold = threshold
+            path = os.path.join(directory, f"{threshold}.db")
+            configure_database(path)
+            run_migrations()
+
+            conversation_uuid = str(uuid.uuid4())
+            seed(conversation_uuid)
+            results.append((
+                name,
+                database_size_mb(path),
+                restore_ms(conversation_uuid, read_texts=False),
+                restore_ms(conversation_uuid, read_texts=True)
+            ))
+            db.close()
+    DocumentBlobModel.text.compression_threshold = default_threshold
+
+    print(f"{TASKS * ACTIONS_PER_TASK} documents of ~{DOCUMENT_WORDS} words")
+    print(f"{'storage':<18} {'db MB':>7} {'restore ms':>11} {'restore+texts ms':>17}")
+    for name, size_mb, metadata_ms, full_ms in results:
+        print(f"{name:<18} {size_mb:>7.1f} {metadata_ms:>11.1f} {full_ms:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
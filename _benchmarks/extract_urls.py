@@ -0,0 +1,203 @@
+"""Throughput and equivalence of utils.document.extract_images_and_urls
+
+Compares the single-pass scanner with the previous three-pass re.sub implementation (kept here only
+as a baseline) on multi-megabyte scraped markdown, then runs two randomized checks. On every
+generated input the previous version handled correctly (its placeholders restore to the original
+text), both versions must produce identical content, URL and image lists; the scanner must restore
+every input. On whitespace-separated images, links, bare URLs and linked images (which the previous
+version mishandled), the scanner must return exactly the expected image and URL lists.
+
+Run from the repository root:
+    python -m _benchmarks.extract_urls
+"""
+import random
+import re
+import time
+from typing import Any, Dict, List, Tuple
+
+from utils.document import extract_images_and_urls
+
+DOCUMENT_MEGABYTES = [1, 4]
+PROPERTY_CASES = 20000
+REPEATS = 3
+
+random.seed(11)
+WORDS = ["the", "report", "price", "table", "api", "docs", "(see", "note)", "item,", "end.", "[draft]", "a]b",
+         "quarterly", "results", "were", "announced", "with", "revenue", "growth", "across", "regions"]
+URL_TAILS = ["", "/", "/path", "/a/b?x=1&y=2", "/page.html", "/p,", "/x)", "/img.png", "#frag"]
+
+
+def extract_images_and_urls_three_pass(text: str) -> Dict[str, Any]:
+    """The previous implementation: one re.sub pass each for images, links and bare URLs"""
+    urls = []
+    images = []
+    url_index = 0
+    image_index = 0
+    content = text
+
+    def replace_images(match):
+        nonlocal image_index
+        alt_text, url = match.groups()
+        images.append(url)
+        placeholder = f"![{alt_text}]({{$img{image_index}}})"
+        image_index += 1
+        return placeholder
+
+    def replace_urls(match):
+        nonlocal url_index
+        link_text, url = match.groups()
+        if not url.startswith('{{$img'):
+            urls.append(url)
+            placeholder = f"[{link_text}]({{$url{url_index}}})"
+            url_index += 1
+            return placeholder
+        return match.group(0)
+
+    content = re.sub(r'!\[([^\]]*)\]\(([^)]+)\)', replace_images, content)
+    content = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', replace_urls, content)
+
+    def replace_bare_urls(match):
+        nonlocal url_index
+        url = match.group(0)
+        if not url.startswith('{{$'):
+            urls.append(url)
+            placeholder = f"{{$url{url_index}}}"
+            url_index += 1
+            return placeholder
+        return url
+
+    content = re.sub(r'(?<!\]\()(https?://[^\s<>"]+|www\.[^\s<>"]+)(?!\))', replace_bare_urls, content)
+
+    return {"content": content, "urls": urls, "images": images}
+
+
+def restore(extracted: Dict[str, Any]) -> str:
+    """Same result as utils.document.restore_placeholders"""
+    content = extracted["content"]
+    for index, image_url in enumerate(extracted["images"]):
+        content = content.replace(f"{{$img{index}}}", image_url)
+    for index, url in enumerate(extracted["urls"]):
+        content = content.replace(f"{{$url{index}}}", url)
+    return content
+
+
+def random_url() -> str:
+    host = random.choice(["https://example.com", "http://docs.example.org", "www.example.net"])
+    return host + random.choice(URL_TAILS)
+
+
+def random_image() -> str:
+    return f"![{random.choice(['', 'logo', 'chart 1'])}]({random_url()})"
+
+
+def random_fragment(reference_rate: float) -> str:
+    kind = random.random() / reference_rate
+    if kind < 0.25:
+        return random_image()
+    if kind < 0.35:
+        text = random.choice(["", "", "see ", "wow! "]) + random_image() + random.choice(["", " badge"])
+        return f"[{text}]({random_url()})"
+    if kind < 0.7:
+        return f"[{random.choice(WORDS)}]({random_url()})"
+    if kind < 1:
+        return random_url()
+    return random.choice(WORDS)
+
+
+def random_markdown(fragments: int, reference_rate: float = 0.25) -> str:
+    return "".join(
+        random_fragment(reference_rate) + random.choice([" ", " ", "\n", "", "\n\n## "]) for _ in range(fragments)
+    )
+
+
+def scraped_markdown(megabytes: int) -> str:
+    """Mostly prose with a link, image or bare URL about every 30 words, like a scraped article"""
+    paragraphs = []
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        paragraph = random_markdown(60, reference_rate=0.03)
+        paragraphs.append(paragraph)
+        size += len(paragraph)
+    return "\n\n".join(paragraphs)
+
+
+def measure_ms(function, text: str) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        function(text)
+    return (time.perf_counter() - started) * 1000 / REPEATS
+
+
+# Parts of the exactly checked inputs: no closing parenthesis in URLs, no brackets in link texts
+EXACT_URL_TAILS = [tail for tail in URL_TAILS if ")" not in tail]
+EXACT_WORDS = [word for word in WORDS if not set(word) & set("[]()")]
+
+
+def exact_markdown(fragments: int) -> Tuple[str, List[str], List[str]]:
+    """Whitespace-separated references, with the image and URL lists extraction has to return for them"""
+    parts, images, link_urls, bare_urls = [], [], [], []
+    for _ in range(fragments):
+        url = random.choice(["https://example.com", "www.example.net"]) + random.choice(EXACT_URL_TAILS)
+        kind = random.randrange(5)
+        if kind == 0:
+            parts.append(f"![{random.choice(['', 'logo'])}]({url})")
+            images.append(url)
+        elif kind == 1:
+            image_url = f"https://img.example.com/{len(images)}.png"
+            parts.append(f"[{random.choice(['', 'see '])}![badge]({image_url}){random.choice(['', ' here'])}]({url})")
+            images.append(image_url)
+            link_urls.append(url)
+        elif kind == 2:
+            parts.append(f"[{random.choice(EXACT_WORDS)}]({url})")
+            link_urls.append(url)
+        elif kind == 3:
+            parts.append(url)
+            bare_urls.append(url)
+        else:
+            parts.append(random.choice(EXACT_WORDS))
+    text = "".join(part + random.choice([" ", "\n", "\n\n## "]) for part in parts)
+    return text, images, link_urls + bare_urls
+
+
+def check_equivalence() -> int:
+    """Run the randomized equivalence check; returns the number of inputs compared with the baseline"""
+    assert extract_images_and_urls("[![alt](https://i.png)](https://a.com)") == {
+        "content": "[![alt]({$img0})]({$url0})", "urls": ["https://a.com"], "images": ["https://i.png"]
+    }
+
+    compared = 0
+    for _ in range(PROPERTY_CASES):
+        text = random_markdown(random.randint(0, 12))
+        extracted = extract_images_and_urls(text)
+        assert restore(extracted) == text, f"scanner does not restore {text!r}"
+
+        baseline = extract_images_and_urls_three_pass(text)
+        # The previous version let a bare URL run into a following image
+        if restore(baseline) == text and not any("![" in url for url in baseline["urls"]):
+            assert extracted == baseline, f"outputs differ for {text!r}:\n{extracted}\n{baseline}"
+            compared += 1
+
+        text, images, urls = exact_markdown(random.randint(0, 12))
+        extracted = extract_images_and_urls(text)
+        assert restore(extracted) == text, f"scanner does not restore {text!r}"
+        assert (extracted["images"], extracted["urls"]) == (images, urls), f"wrong references in {text!r}: {extracted}"
+    return compared
+
+
+def main():
+    print(f"{'size':>6} | {'three-pass ms':>13} | {'single-pass ms':>14} | {'speedup':>7}")
+    for megabytes in DOCUMENT_MEGABYTES:
+        text = scraped_markdown(megabytes)
+        assert extract_images_and_urls(text)["content"].count("{$") > 0
+        baseline_ms = measure_ms(extract_images_and_urls_three_pass, text)
+        scanner_ms = measure_ms(extract_images_and_urls, text)
+        print(f"{megabytes:>4}MB | {baseline_ms:>13.1f} | {scanner_ms:>14.1f} | {baseline_ms / scanner_ms:>6.1f}x")
+
+    compared = check_equivalence()
+    print(f"Equivalence: {PROPERTY_CASES} random inputs restore exactly, "
+          f"{compared} handled correctly by the three-pass version produce identical output, "
+          f"{PROPERTY_CASES} exactly checked inputs extract the expected references")
+
+
+if __name__ == "__main__":
+    main()
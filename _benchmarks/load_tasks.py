@@ -0,0 +1,111 @@
+"""Restore-time benchmark for db.tasks.load_tasks
+
+Seeds a throwaway database with a growing number of tasks and actions and compares the
+eager-loading path against the previous per-task / per-action query loop.
+
+Run from the repository root:
+    python -m _benchmarks.load_tasks
+"""
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+from db import db, configure_database
+from db.migrations import run_migrations
+from db.models import TaskModel, TaskActionModel, TaskActionDocumentModel, DocumentModel
+from db.tasks import load_tasks
+
+SIZES = [(10, 5), (50, 10), (100, 10), (200, 20)]  # (tasks, actions per task)
+REPEATS = 5
+
+
+class QueryCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def seed(conversation_uuid: str, task_count: int, actions_per_task: int) -> None:
+    with db.atomic():
+        for task_index in range(task_count):
+            task = TaskModel.create(
+                uuid=str(uuid.uuid4()),
+                conversation_uuid=conversation_uuid,
+                name=f"Task {task_index}",
+                description="Benchmark task",
+                status="pending"
+            )
+            for step in range(actions_per_task):
+                action = TaskActionModel.create(
+                    uuid=str(uuid.uuid4()),
+                    task=task,
+                    name=f"Action {step}",
+                    tool_uuid="web",
+                    tool_action="scrape",
+                    input_payload={"url": "https://example.com"},
+                    step=step,
+                    status="completed"
+                )
+                document = DocumentModel.create(
+                    uuid=str(uuid.uuid4()),
+                    conversation_uuid=conversation_uuid,
+                    text="lorem ipsum " * 50,
+                    metadata={"name": "WebScrapeResult"}
+                )
+                TaskActionDocumentModel.create(task_action=action, document=document)
+
+
+def load_tasks_per_row(conversation_uuid: str) -> int:
+    """The previous N+1+M loading strategy, kept here only as a baseline"""
+    loaded_documents = 0
+    for task_model in TaskModel.select().where(TaskModel.conversation_uuid == conversation_uuid):
+        action_models = TaskActionModel.select().where(TaskActionModel.task == task_model).order_by(TaskActionModel.step)
+        for action_model in action_models:
+            links = (TaskActionDocumentModel
+                     .select()
+                     .join(DocumentModel)
+                     .where(TaskActionDocumentModel.task_action == action_model))
+            loaded_documents += sum(1 for link in links if link.document.text)
+    return loaded_documents
+
+
+def measure(function, conversation_uuid: str, counter: QueryCounter):
+    counter.count = 0
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        function(conversation_uuid)
+    elapsed_ms = (time.perf_counter() - started) * 1000 / REPEATS
+    return elapsed_ms, counter.count // REPEATS
+
+
+def main():
+    counter = QueryCounter()
+    peewee_logger = logging.getLogger("peewee")
+    peewee_logger.addHandler(counter)
+    peewee_logger.setLevel(logging.DEBUG)
+    peewee_logger.propagate = False
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_database(os.path.join(directory, "benchmark.db"))
+        run_migrations()
+
+        print(f"{'tasks':>6} {'actions':>8} | {'per-row ms':>10} {'queries':>8} | {'eager ms':>9} {'queries':>8}")
+        for task_count, actions_per_task in SIZES:
+            conversation_uuid = str(uuid.uuid4())
+            seed(conversation_uuid, task_count, actions_per_task)
+
+            per_row_ms, per_row_queries = measure(load_tasks_per_row, conversation_uuid, counter)
+            eager_ms, eager_queries = measure(load_tasks, conversation_uuid, counter)
+            print(
+                f"{task_count:>6} {task_count * actions_per_task:>8} | "
+                f"{per_row_ms:>10.1f} {per_row_queries:>8} | {eager_ms:>9.1f} {eager_queries:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
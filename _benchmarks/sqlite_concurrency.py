@@ -0,0 +1,113 @@
+"""Concurrent read/write benchmark for the SQLite connection manager
+
+Compares the previous setup (rollback journal, default pragmas, a fresh sqlite3 connection per
+operation) with the shared WAL-mode database from db/__init__.py. Writer threads append messages,
+reader threads load the latest window of a conversation.
+
+Run from the repository root:
+    python -m _benchmarks.sqlite_concurrency
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from db import configure_database
+from db.migrations import run_migrations
+from db.message import find_latest_messages, save_message
+from models.message import Message
+
+DURATION_SECONDS = 3
+WRITER_THREADS = 2
+READER_THREADS = 4
+CONVERSATIONS = 20
+
+INSERT_MESSAGE = "INSERT INTO messages (uuid, conversation_uuid, content, role, created_at) VALUES (?, ?, ?, ?, ?)"
+SELECT_LATEST = "SELECT * FROM messages WHERE conversation_uuid = ? ORDER BY created_at DESC LIMIT 10"
+
+
+def legacy_write(path: str, conversation_uuid: str) -> None:
+    conn = sqlite3.connect(path, timeout=5)
+    try:
+        conn.execute(INSERT_MESSAGE, (str(uuid.uuid4()), conversation_uuid, "hello " * 40, "user", str(datetime.utcnow())))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def legacy_read(path: str, conversation_uuid: str) -> None:
+    conn = sqlite3.connect(path, timeout=5)
+    try:
+        conn.execute(SELECT_LATEST, (conversation_uuid,)).fetchall()
+    finally:
+        conn.close()
+
+
+def managed_write(path: str, conversation_uuid: str) -> None:
+    save_message(Message(
+        uuid=str(uuid.uuid4()),
+        conversation_uuid=conversation_uuid,
+        content="hello " * 40,
+        role="user"
+    ))
+
+
+def managed_read(path: str, conversation_uuid: str) -> None:
+    find_latest_messages(conversation_uuid, 10)
+
+
+def run_load(path: str, write, read) -> dict:
+    conversation_uuids = [str(uuid.uuid4()) for _ in range(CONVERSATIONS)]
+    counters = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + DURATION_SECONDS
+
+    def worker(operation, counter_name):
+        index = 0
+        while time.perf_counter() < deadline:
+            try:
+                operation(path, conversation_uuids[index % CONVERSATIONS])
+                counter = counter_name
+            except sqlite3.OperationalError:
+                counter = "errors"
+            with lock:
+                counters[counter] += 1
+            index += 1
+
+    threads = [threading.Thread(target=worker, args=(write, "writes")) for _ in range(WRITER_THREADS)]
+    threads += [threading.Thread(target=worker, args=(read, "reads")) for _ in range(READER_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {name: count / DURATION_SECONDS for name, count in counters.items()}
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        legacy_path = os.path.join(directory, "legacy.db")
+        configure_database(legacy_path)
+        run_migrations()
+        # Undo what the connection manager set up so the file behaves like before
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("PRAGMA journal_mode=delete")
+        conn.close()
+        legacy = run_load(legacy_path, legacy_write, legacy_read)
+
+        managed_path = os.path.join(directory, "managed.db")
+        configure_database(managed_path)
+        run_migrations()
+        managed = run_load(managed_path, managed_write, managed_read)
+
+    print(f"{WRITER_THREADS} writer / {READER_THREADS} reader threads, {DURATION_SECONDS}s each")
+    print(f"{'setup':<28} {'writes/s':>10} {'reads/s':>10} {'errors/s':>10}")
+    for name, result in (("per-op sqlite3, rollback", legacy), ("shared WAL connection", managed)):
+        print(f"{name:<28} {result['writes']:>10.0f} {result['reads']:>10.0f} {result['errors']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Restore-time benchmark: relational tables vs single-blob conversation snapshot
+
+Seeds a throwaway database with one conversation of growing size and compares restoring its
+messages, summary, tasks, actions and document references from the normalized tables with
+restoring them from the snapshot written at the end of a run.
+
+Run from the repository root:
+    python -m _benchmarks.state_restore
+"""
+import os
+import tempfile
+import time
+import uuid
+
+from agent.state import AgentState
+from db import configure_database
+from db.conversation import find_conversation_summary
+from db.message import find_messages_since
+from db.migrations import run_migrations
+from db.snapshots import load_conversation_snapshot, save_conversation_snapshot
+from db.tasks import load_tasks, save_task
+from db.writer import flush_writes
+from models.state import Task, TaskAction
+from utils.document import create_document
+
+SIZES = [(5, 4), (25, 8), (100, 10)]  # (tasks, actions per task)
+REPEATS = 20
+
+
+def seed(conversation_uuid: str, task_count: int, actions_per_task: int) -> AgentState:
+    state = AgentState.create_or_restore_state(conversation_uuid)
+    for index in range(20):
+        state = state.add_message(f"Message {index} " * 20, "user" if index % 2 == 0 else "assistant")
+    flush_writes()
+
+    tasks = []
+    for task_index in range(task_count):
+        task_uuid = str(uuid.uuid4())
+        tasks.append(Task(
+            uuid=task_uuid,
+            name=f"Task {task_index}",
+            description="Benchmark task " * 5,
+            status="done",
+            conversation_uuid=conversation_uuid,
+            actions=[
+                TaskAction(
+                    uuid=str(uuid.uuid4()),
+                    name=f"Action {step}",
+                    task_uuid=task_uuid,
+                    tool_uuid="web",
+                    tool_action="scrape",
+                    input_payload={"url": f"https://example.com/{task_index}/{step}"},
+                    output_documents=[create_document(f"Page {task_index}/{step} " * 200, {
+                        "conversation_uuid": conversation_uuid,
+                        "name": "WebScrapeResult",
+                    })],
+                    step=step,
+                    status="completed"
+                ) for step in range(actions_per_task)
+            ]
+        ))
+    for task in tasks:
+        save_task(task)
+    return state.copy(tasks=tasks)
+
+
+def restore_relational(conversation_uuid: str) -> None:
+    find_conversation_summary(conversation_uuid)
+    find_messages_since(conversation_uuid, cursor=None, limit=20)
+    load_tasks(conversation_uuid)
+
+
+def restore_snapshot(conversation_uuid: str) -> None:
+    load_conversation_snapshot(conversation_uuid)
+
+
+def measure_ms(restore, conversation_uuid: str) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        restore(conversation_uuid)
+    return (time.perf_counter() - started) * 1000 / REPEATS
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        configure_database(os.path.join(directory, "benchmark.db"))
+        run_migrations()
+
+        print(f"{'tasks':>6} {'actions':>8} | {'relational ms':>13} | {'snapshot ms':>11}")
+        for task_count, actions_per_task in SIZES:
+            conversation_uuid = str(uuid.uuid4())
+            state = seed(conversation_uuid, task_count, actions_per_task)
+            save_conversation_snapshot(state.to_snapshot())
+            assert load_conversation_snapshot(conversation_uuid) is not None
+
+            print(
+                f"{task_count:>6} {task_count * actions_per_task:>8} | "
+                f"{measure_ms(restore_relational, conversation_uuid):>13.2f} | "
+                f"{measure_ms(restore_snapshot, conversation_uuid):>11.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
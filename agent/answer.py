@@ -1,7 +1,10 @@
+import asyncio
+
 from llm import open_ai
-from llm.format import format_documents, format_tools, format_tasks
+from llm.format import format_documents, format_tools, format_tasks, format_conversation_memory
 from llm.prompts import get_prompt
 from llm.tracing import create_generation, end_generation
+from agent.context import find_semantic_chunks, select_answer_context
 from agent.state import AgentState, AgentPhase
 from tools.__init__ import get_tools
 
@@ -20,10 +23,15 @@ async def agent_answer(state: AgentState, parent_trace) -> AgentState:
     try:
         state = state.update_phase(AgentPhase.ANSWER)
 
-        messages = [
-            {"role": msg.role, "content": msg.content}
-            for msg in state.messages
-        ]
+        messages = format_conversation_memory(state)
+
+        # Only the parts of the conversation documents relevant to this turn fit the prompt
+        user_messages = [message.content for message in state.recent_messages if message.role == "user"]
+        query = " ".join([state.thoughts.user_intent or "", *user_messages[-1:]])
+        semantic_hits = []
+        if state.conversation_documents:
+            semantic_hits = await asyncio.to_thread(find_semantic_chunks, query, state.conversation_uuid)
+        documents = select_answer_context(state.conversation_documents, query, semantic_hits=semantic_hits)
 
         # Fetch prompt from repository
         prompt = get_prompt(
@@ -31,7 +39,7 @@ async def agent_answer(state: AgentState, parent_trace) -> AgentState:
             label="latest"
         )
         system_prompt = prompt.compile(
-            documents=format_documents(state.conversation_documents),
+            documents=format_documents(documents),
             tools=format_tools(get_tools()),
             query="",
             actions=format_tasks(state.tasks)
@@ -0,0 +1,197 @@
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Sequence, Tuple
+
+from db.vectors import VECTOR_INDEX_ENABLED, search_chunks
+from logger.logger import log_exception
+from models.document import Document
+from models.search import ChunkHit
+from utils.document import hash_content
+from utils.text import estimate_tokens, split_to_spans
+
+# Tokens of document text the answer prompt may carry
+ANSWER_CONTEXT_TOKENS = int(os.getenv("ANSWER_CONTEXT_TOKENS", "6000"))
+CONTEXT_CHUNK_CHARS = 1200
+BM25_K1 = 1.2
+BM25_B = 0.75
+CHUNK_CACHE_SIZE = 64
+# Vector index hits fused with the BM25 ranking, and the reciprocal rank fusion constant
+SEMANTIC_CHUNKS = int(os.getenv("ANSWER_SEMANTIC_CHUNKS", "8"))
+RRF_K = 60
+
+_WORD_PATTERN = re.compile(r"\w+")
+# Chunk spans and term counts by document content hash, so follow-up turns skip re-tokenizing
+_chunk_cache: "OrderedDict[str, Tuple]" = OrderedDict()
+_chunk_cache_lock = threading.Lock()
+
+
+def find_semantic_chunks(query: str, conversation_uuid: str, k: int = SEMANTIC_CHUNKS) -> List[ChunkHit]:
+    """
+    Chunks of a conversation's documents closest in meaning to a query, from the vector index
+
+    Blocks on the embeddings API for an uncached query, so async callers run it in a thread.
+
+    Args:
+        query: What the answer has to address
+        conversation_uuid: Conversation UUID
+        k: Maximum number of chunks
+
+    Returns:
+        Chunks best first; empty when the index is off or the search fails, leaving BM25 alone
+    """
+    if not VECTOR_INDEX_ENABLED or not query.strip():
+        return []
+    try:
+        return search_chunks(query, conversation_uuid, k)
+    except Exception as e:
+        log_exception("Vector search for the answer context failed, ranking with BM25 only", e)
+        return []
+
+
+def select_answer_context(
+        documents: List[Document],
+        query: str,
+        token_budget: int = ANSWER_CONTEXT_TOKENS,
+        semantic_hits: Sequence[ChunkHit] = ()
+) -> List[Document]:
+    """
+    Pick the parts of the conversation documents most relevant to a query, within a token budget
+
+    Documents are split into chunks which are ranked against the query with BM25. Given vector
+    index hits (see find_semantic_chunks), each chunk overlapping a hit is also ranked by its best
+    hit, and both rankings are merged by reciprocal rank fusion, so passages that match in meaning
+    but share no words with the query are found too. The best chunks are packed until the budget is
+    spent. Each document with selected chunks is returned once, its chunks in their original order,
+    separated by an ellipsis line.
+
+    Args:
+        documents: Conversation documents
+        query: What the answer has to address, e.g. the latest user message
+        token_budget: Maximum estimated tokens of selected text
+        semantic_hits: Vector index hits for the query, best first
+
+    Returns:
+        Copies of the relevant documents holding only the selected chunks, in input order
+    """
+    chunks = []  # (document index, start, end, term counts, length)
+    for document_index, document in enumerate(documents):
+        for start, end, term_counts, length in _document_chunks(document):
+            chunks.append((document_index, start, end, term_counts, length))
+    if not chunks:
+        return []
+
+    query_terms = set(_tokenize(query))
+    scores = _bm25_scores(query_terms, chunks)
+    ranked = sorted(range(len(chunks)), key=lambda index: (-scores[index], index))
+    if semantic_hits:
+        ranked = _fuse_semantic_ranks(ranked, scores, chunks, documents, semantic_hits)
+
+    selected = {}
+    remaining_tokens = token_budget
+    for index in ranked:
+        document_index, start, end, _, _ = chunks[index]
+        tokens = estimate_tokens(documents[document_index].text[start:end])
+        if tokens > remaining_tokens:
+            continue
+        selected.setdefault(document_index, []).append((start, end))
+        remaining_tokens -= tokens
+        if remaining_tokens <= 0:
+            break
+
+    selected_documents = []
+    for document_index, spans in sorted(selected.items()):
+        document = documents[document_index]
+        spans.sort()
+        covers_document = len(spans) == len(_document_chunks(document))
+        metadata = {**document.metadata, "content_type": "full" if covers_document else "chunk"}
+        if not covers_document:
+            # The hash describes the full body, not the excerpt this copy holds
+            metadata.pop("content_hash", None)
+        selected_documents.append(Document(
+            uuid=document.uuid,
+            conversation_uuid=document.conversation_uuid,
+            text=document.text if covers_document else "\n…\n".join(document.text[start:end] for start, end in spans),
+            metadata=metadata
+        ))
+    return selected_documents
+
+
+def _fuse_semantic_ranks(
+        ranked: List[int],
+        scores: List[float],
+        chunks: List[Tuple[int, int, int, Counter, int]],
+        documents: List[Document],
+        semantic_hits: Sequence[ChunkHit]
+) -> List[int]:
+    """Chunk indexes ordered by reciprocal rank fusion of the BM25 ranking and the vector hits
+
+    The vector index chunks documents by its own span size, so a hit ranks every context chunk its
+    character span overlaps. Chunks in neither ranking keep their BM25 order at the end.
+    """
+    fused: Dict[int, float] = {}
+    for rank, index in enumerate((index for index in ranked if scores[index] > 0), start=1):
+        fused[index] = 1.0 / (RRF_K + rank)
+
+    document_indexes = {str(document.uuid): document_index for document_index, document in enumerate(documents)}
+    semantic_ranks: Dict[int, int] = {}
+    for rank, hit in enumerate(semantic_hits, start=1):
+        document_index = document_indexes.get(hit.document_uuid)
+        if document_index is None:
+            continue
+        for index, (chunk_document, start, end, _, _) in enumerate(chunks):
+            if chunk_document == document_index and start < hit.end and hit.start < end:
+                semantic_ranks.setdefault(index, rank)
+    for index, rank in semantic_ranks.items():
+        fused[index] = fused.get(index, 0.0) + 1.0 / (RRF_K + rank)
+
+    order = {index: position for position, index in enumerate(ranked)}
+    return sorted(ranked, key=lambda index: (-fused.get(index, 0.0), order[index]))
+
+
+def _document_chunks(document: Document) -> Tuple[Tuple[int, int, Counter, int], ...]:
+    """Chunk spans of a document text with their term counts"""
+    content_hash = document.metadata.get("content_hash") or hash_content(document.text)
+    with _chunk_cache_lock:
+        if content_hash in _chunk_cache:
+            _chunk_cache.move_to_end(content_hash)
+            return _chunk_cache[content_hash]
+
+    # Tokenized outside the lock; concurrent misses on the same text compute identical chunks
+    chunks = []
+    for start, end in split_to_spans(document.text, CONTEXT_CHUNK_CHARS):
+        terms = _tokenize(document.text[start:end])
+        chunks.append((start, end, Counter(terms), len(terms)))
+    chunks = tuple(chunks)
+    with _chunk_cache_lock:
+        _chunk_cache[content_hash] = chunks
+        _chunk_cache.move_to_end(content_hash)
+        if len(_chunk_cache) > CHUNK_CACHE_SIZE:
+            _chunk_cache.popitem(last=False)
+    return chunks
+
+
+def _tokenize(text: str) -> List[str]:
+    return _WORD_PATTERN.findall(text.lower())
+
+
+def _bm25_scores(query_terms: set, chunks: List[Tuple[int, int, int, Counter, int]]) -> List[float]:
+    """Okapi BM25 of every chunk against the query terms, chunks acting as the corpus"""
+    average_length = sum(chunk[4] for chunk in chunks) / len(chunks) or 1.0
+    document_frequency = Counter(term for chunk in chunks for term in query_terms if term in chunk[3])
+
+    scores = []
+    for _, _, _, term_counts, length in chunks:
+        score = 0.0
+        for term in query_terms:
+            frequency = term_counts.get(term, 0)
+            if not frequency:
+                continue
+            idf = math.log(1 + (len(chunks) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * frequency * (BM25_K1 + 1) / (
+                frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+            )
+        scores.append(score)
+    return scores
@@ -1,9 +1,11 @@
+import asyncio
 import json
 from datetime import datetime
 
 from llm.tracing import create_span, end_span
 from logger.logger import log_info, log_error, log_tool_call
 from agent.state import AgentState
+from db.writer import flush_writes, raise_failed_writes
 from tools.__init__ import tool_handlers
 from utils.document import create_error_document
 
@@ -12,6 +14,11 @@ async def agent_execute(state: AgentState, trace) -> AgentState:
     Executes the given plan and updates the state accordingly.
     Creates a trace span for the execution process.
     """
+    # Tools read documents produced by earlier steps, so pending writes must land first. A dropped
+    # write fails the run instead of becoming a tool error the agent would work around.
+    await asyncio.to_thread(flush_writes)
+    raise_failed_writes(state.conversation_uuid)
+
     execution_span = create_span(
         trace=trace,
         name=f"execute_{state.current_tool}",
@@ -2,7 +2,7 @@ import json
 
 from agent.state import AgentState, Thoughts, AgentPhase
 from llm import open_ai
-from llm.format import format_facts, format_tools
+from llm.format import format_facts, format_tools, format_conversation_memory
 from llm.prompts import get_prompt
 from llm.tracing import create_generation, end_generation
 from models.state import ToolThought
@@ -43,10 +43,7 @@ async def agent_intent(state: AgentState, trace) -> AgentState:
         completion = await open_ai.completion(
             messages=[
                 {"role": "system", "content": system_prompt},
-                *[
-                    {"role": msg.role, "content": msg.content}
-                    for msg in state.messages
-                ]
+                *format_conversation_memory(state)
             ],
             model=prompt.config.get("model", "gpt-4o"),
             json_mode=True
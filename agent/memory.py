@@ -0,0 +1,112 @@
+from itertools import chain, takewhile
+from typing import Iterable, Iterator, List
+
+from agent.state import AgentState
+from db.message import iterate_messages_by_conversation
+from llm import open_ai
+from llm.format import format_messages
+from llm.prompts import get_prompt
+from llm.tracing import create_generation, end_generation
+from logger.logger import log_info
+from models.message import ConversationSummary, Message
+
+SUMMARY_PROMPT_FALLBACK = """
+You maintain a running summary of a conversation between the user and iAgent.
+Fold the new messages into the existing summary. Keep facts, decisions, names, dates,
+amounts and open requests; drop pleasantries. Answer with the updated summary only.
+
+<existing_summary>
+{{summary}}
+</existing_summary>
+"""
+
+# Messages folded into the summary per completion
+SUMMARY_PAGE_MESSAGES = 50
+
+
+async def agent_memory(state: AgentState, trace) -> AgentState:
+    """
+    Folds messages that slid out of the memory window into the conversation summary.
+    The summary is only recomputed when the window slides; otherwise the state is returned unchanged.
+
+    Restored states hold at most twice the memory window of unsummarized messages. Older ones that
+    are still unsummarized (a long thread from before summaries existed, or after failed summary
+    updates) are read back from the database and folded first, page by page, so the summary cursor
+    only ever moves past messages that were actually summarized.
+    """
+    evicted_messages = state.evicted_messages
+    if not evicted_messages:
+        return state
+
+    try:
+        pending = chain(_older_unsummarized_messages(state, evicted_messages[0]), evicted_messages)
+        for page in _pages(pending, SUMMARY_PAGE_MESSAGES):
+            log_info(f"🗂️ Folding {len(page)} message(s) into conversation summary")
+            state = await _fold_into_summary(state, page, trace)
+        return state
+
+    except Exception as e:
+        raise Exception(f"Error updating conversation memory: {str(e)}")
+
+
+async def _fold_into_summary(state: AgentState, messages: List[Message], trace) -> AgentState:
+    prompt = get_prompt(
+        name="conversation_summary",
+        label="latest",
+        fallback=SUMMARY_PROMPT_FALLBACK
+    )
+    system_prompt = prompt.compile(
+        summary=state.conversation_summary.summary if state.conversation_summary else ""
+    )
+    model = prompt.config.get("model", "gpt-4o-mini")
+
+    generation = create_generation(
+        trace=trace,
+        name="conversation_summary",
+        model=model,
+        input=system_prompt,
+        metadata={"conversation_id": state.conversation_uuid}
+    )
+
+    summary = await open_ai.completion(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": format_messages(messages)}
+        ],
+        model=model
+    )
+
+    end_generation(generation, output=summary)
+
+    return state.update_conversation_summary(
+        ConversationSummary(
+            conversation_uuid=state.conversation_uuid,
+            summary=summary,
+            summarized_until=messages[-1].created_at
+        )
+    )
+
+
+def _older_unsummarized_messages(state: AgentState, oldest_loaded: Message) -> Iterator[Message]:
+    """Stored messages after the summary cursor that precede the oldest message held in the state"""
+    stored = iterate_messages_by_conversation(
+        state.conversation_uuid,
+        after=state.conversation_summary.summarized_until if state.conversation_summary else None
+    )
+    return takewhile(
+        lambda message: (message.created_at, message.uuid) < (oldest_loaded.created_at, oldest_loaded.uuid),
+        stored
+    )
+
+
+def _pages(messages: Iterable[Message], size: int) -> Iterator[List[Message]]:
+    """Consecutive pages of about size messages, never splitting messages that share a timestamp,
+    since the summary cursor is a timestamp"""
+    page = []
+    for message in messages:
+        if len(page) >= size and message.created_at != page[-1].created_at:
+            yield page
+            page = []
+        page.append(message)
+    if page:
+        yield page
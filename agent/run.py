@@ -1,3 +1,4 @@
+import asyncio
 import os
 from typing import Dict
 
@@ -7,6 +8,10 @@ from agent.declare import agent_declare
 from agent.define import agent_define
 from agent.execute import agent_execute
 from agent.intent import agent_intent
+from agent.memory import agent_memory
+from db.tasks import take_step_rows_written
+from db.snapshots import SNAPSHOTS_ENABLED, save_conversation_snapshot
+from db.writer import enqueue_write, flush_writes, raise_failed_writes
 from llm.tracing import create_trace, end_trace
 from logger.logger import log_info, log_error
 from agent.state import AgentState
@@ -25,6 +30,12 @@ async def agent_run(initial_state: AgentState, metadata: Dict) -> AgentState:
     )
 
     try:
+        # The inbound user message is committed before the agent works on it
+        await asyncio.to_thread(flush_writes)
+        raise_failed_writes(state.conversation_uuid)
+
+        state = await agent_memory(state, trace)
+
         log_info("🧠 Starting brainstorming phase...")
         state = await agent_intent(state, trace)
 
@@ -45,9 +56,16 @@ async def agent_run(initial_state: AgentState, metadata: Dict) -> AgentState:
             state = await agent_define(state, trace)
             state = await agent_execute(state, trace)
             state = state.complete_thinking_step()
+            log_info(f"💾 Rows written in step: {take_step_rows_written()}")
 
         state = await agent_answer(state, trace)
 
+        if SNAPSHOTS_ENABLED:
+            enqueue_write(state.conversation_uuid, save_conversation_snapshot, state.to_snapshot())
+
+        await asyncio.to_thread(flush_writes)
+        raise_failed_writes(state.conversation_uuid)
+
         log_info("✅ Agent run completed")
         log_info(f"📊 Stats: {state.current_step} steps, {len(state.tasks)} tasks")
 
@@ -56,4 +74,7 @@ async def agent_run(initial_state: AgentState, metadata: Dict) -> AgentState:
         error_msg = f"❌ Error during agent run: {str(e)}"
         log_error(error_msg)
         raise
+    finally:
+        # Barrier: everything the run wrote is on disk before the next message restores state
+        await asyncio.to_thread(flush_writes)
     return state
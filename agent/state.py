@@ -2,23 +2,28 @@ from typing import List, Optional
 
 from pydantic import BaseModel, ConfigDict
 
-from db.message import find_messages_by_conversation, save_message
+from db.message import find_messages_since, save_message
+from db.snapshots import SNAPSHOTS_ENABLED, load_conversation_snapshot
+from db.writer import enqueue_write
+from agent.state_cache import cache_state, drop_caches_if_outdated, get_cached_state, get_state_cache_stats
 from logger.logger import log_info
 from models.document import Document
-from models.message import Message
-from models.state import Task, AgentPhase, Thoughts, TaskAction
+from models.message import Message, ConversationSummary
+from models.state import Task, AgentPhase, Thoughts, TaskAction, ConversationSnapshot
 from utils.message import create_message
 
 
 class AgentState(BaseModel):
     conversation_uuid: str
     messages: List[Message]
+    conversation_summary: Optional[ConversationSummary]
     tasks: List[Task]
     conversation_documents: List[Document]
 
     phase: AgentPhase
     current_step: int
     max_steps: int
+    memory_window: int
     thoughts: Thoughts
     current_task: Optional[Task]
     current_action: Optional[TaskAction]
@@ -29,14 +34,46 @@ class AgentState(BaseModel):
 
     @staticmethod
     def create_or_restore_state(conversation_uuid: str):
+        from db.conversation import find_conversation_summary, load_conversation_documents
         from db.tasks import load_tasks
+        memory_window = 10
+
+        drop_caches_if_outdated()
+        cached_state = get_cached_state(conversation_uuid)
+        if cached_state is not None:
+            restored_from = "cache"
+            conversation_summary = cached_state.conversation_summary
+            messages = _unsummarized_messages(cached_state.messages, conversation_summary, memory_window)
+            tasks = cached_state.tasks
+            conversation_documents = cached_state.conversation_documents
+        elif SNAPSHOTS_ENABLED and (snapshot := load_conversation_snapshot(conversation_uuid)) is not None:
+            restored_from = "snapshot"
+            conversation_summary = snapshot.conversation_summary
+            messages = _unsummarized_messages(snapshot.messages, conversation_summary, memory_window)
+            tasks = snapshot.tasks
+            conversation_documents = load_conversation_documents(conversation_uuid)
+        else:
+            restored_from = "db"
+            conversation_summary = find_conversation_summary(conversation_uuid)
+            # Only messages not folded into the summary yet, capped so restore cost stays constant;
+            # agent_memory folds older unsummarized ones from the database
+            messages = find_messages_since(
+                conversation_uuid,
+                cursor=conversation_summary.summarized_until if conversation_summary else None,
+                limit=memory_window * 2
+            )
+            tasks = load_tasks(conversation_uuid)
+            conversation_documents = load_conversation_documents(conversation_uuid)
+
         initial_state = AgentState(
             conversation_uuid=conversation_uuid,
-            messages=find_messages_by_conversation(conversation_uuid),
-            tasks=load_tasks(conversation_uuid),
-            conversation_documents=[],  # load_conversation_documents(conversation_uuid),
+            messages=messages,
+            conversation_summary=conversation_summary,
+            tasks=tasks,
+            conversation_documents=conversation_documents,
             current_step=0,
             max_steps=4,
+            memory_window=memory_window,
             phase=AgentPhase.INTENT,
             current_task=None,
             current_action=None,
@@ -45,11 +82,27 @@ class AgentState(BaseModel):
             current_tool=None,
             final_answer=None
         )
+        if cached_state is None:
+            cache_state(initial_state)
+
+        cache_stats = get_state_cache_stats()
         log_info(
-            f"Initial state - Tasks: {len(initial_state.tasks)}, Documents: {len(initial_state.conversation_documents)}, Messages: {len(initial_state.messages)}")
+            f"Initial state (restored from {restored_from}) - "
+            f"Tasks: {len(initial_state.tasks)}, Documents: {len(initial_state.conversation_documents)}, "
+            f"Messages: {len(initial_state.messages)}, "
+            f"State cache: {cache_stats['hit_rate']:.0%} hit rate, {cache_stats['bytes'] / 1024:.0f} KB")
 
         return initial_state
 
+    def to_snapshot(self) -> ConversationSnapshot:
+        """Persistent part of the state, in the shape restored by create_or_restore_state"""
+        return ConversationSnapshot(
+            conversation_uuid=self.conversation_uuid,
+            messages=_unsummarized_messages(self.messages, self.conversation_summary, self.memory_window),
+            conversation_summary=self.conversation_summary,
+            tasks=self.tasks
+        )
+
     def update_phase(self, new_phase: AgentPhase):
         return self.copy(phase=new_phase)
 
@@ -62,13 +115,22 @@ class AgentState(BaseModel):
     def update_current_tool(self, tool):
         return self.copy(current_tool=tool)
 
+    def update_conversation_summary(self, summary: ConversationSummary):
+        from db.conversation import save_conversation_summary
+        enqueue_write(self.conversation_uuid, save_conversation_summary, summary)
+        new_state = self.copy(conversation_summary=summary)
+        cache_state(new_state)
+        return new_state
+
     def update_final_answer(self, final_answer):
         return self.copy(final_answer=final_answer)
 
     def add_message(self, content, role):
         message = create_message(self.conversation_uuid, content, role)
-        save_message(message)
-        return self.copy(messages=[*self.messages, message])
+        enqueue_write(self.conversation_uuid, save_message, message)
+        new_state = self.copy(messages=[*self.messages, message])
+        cache_state(new_state)
+        return new_state
 
     def complete_thinking_step(self):
         return self.copy(
@@ -83,10 +145,12 @@ class AgentState(BaseModel):
         return self.current_step < self.max_steps
 
     def update_tasks(self, tasks: List[Task]):
+        from db.tasks import save_task
         for task in tasks:
-            from db.tasks import save_task
-            save_task(task)
-        return self.copy(tasks=tasks)
+            enqueue_write(self.conversation_uuid, save_task, task)
+        new_state = self.copy(tasks=tasks)
+        cache_state(new_state)
+        return new_state
 
     def update_current_task(self, task):
         return self.copy(current_task=task)
@@ -130,9 +194,10 @@ class AgentState(BaseModel):
                     updated_tasks.append(task.model_copy())
             new_state = new_state.copy(tasks=updated_tasks)
 
-            # Persist changes to database
+            # Persist changes to database on the writer thread
             from db.tasks import save_task
-            save_task(updated_task)
+            enqueue_write(self.conversation_uuid, save_task, updated_task)
+            cache_state(new_state)
 
         return new_state
 
@@ -149,7 +214,35 @@ class AgentState(BaseModel):
                 return message.content
         return ""
 
+    @property
+    def recent_messages(self) -> List[Message]:
+        """Returns the messages kept verbatim in the conversation memory window"""
+        return self.messages[-self.memory_window:]
+
+    @property
+    def evicted_messages(self) -> List[Message]:
+        """Returns messages that slid out of the window but are not folded into the summary yet"""
+        older_messages = self.messages[:-self.memory_window]
+        if self.conversation_summary is None:
+            return older_messages
+        return [
+            message for message in older_messages
+            if message.created_at > self.conversation_summary.summarized_until
+        ]
+
     model_config = ConfigDict(frozen=True)
 
     def copy(self, **kwargs) -> 'AgentState':
         return self.model_copy(update=kwargs)
+
+
+def _unsummarized_messages(
+        messages: List[Message],
+        conversation_summary: Optional[ConversationSummary],
+        memory_window: int
+) -> List[Message]:
+    """Messages not folded into the summary yet, capped at twice the memory window"""
+    return [
+        message for message in messages
+        if conversation_summary is None or message.created_at > conversation_summary.summarized_until
+    ][-memory_window * 2:]
@@ -0,0 +1,128 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from agent.state import AgentState
+
+# Upper bound on the estimated size of all cached conversations
+STATE_CACHE_MAX_BYTES = int(os.getenv("STATE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+_cached_states: "OrderedDict[str, AgentState]" = OrderedDict()
+_cached_sizes: Dict[str, int] = {}
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+# Cache generation of the database when the caches were last known to match it
+_cache_generation: Optional[int] = None
+
+
+def get_cached_state(conversation_uuid: str) -> Optional["AgentState"]:
+    """Return the last known state of a recently active conversation, marking it most recently used"""
+    with _cache_lock:
+        state = _cached_states.get(conversation_uuid)
+        if state is None:
+            _cache_stats["misses"] += 1
+            return None
+        _cached_states.move_to_end(conversation_uuid)
+        _cache_stats["hits"] += 1
+        return state
+
+
+def cache_state(state: "AgentState") -> None:
+    """
+    Write-through update: store the state a persistence call just wrote, evicting least recently
+    used conversations until the cache fits in STATE_CACHE_MAX_BYTES
+    """
+    size = _estimate_state_bytes(state)
+    evicted_uuids = []
+    with _cache_lock:
+        _forget(state.conversation_uuid)
+        if size <= STATE_CACHE_MAX_BYTES:
+            _cached_states[state.conversation_uuid] = state
+            _cached_sizes[state.conversation_uuid] = size
+            _cache_stats["bytes"] += size
+        else:
+            evicted_uuids.append(state.conversation_uuid)
+
+        while _cache_stats["bytes"] > STATE_CACHE_MAX_BYTES:
+            oldest_uuid = next(iter(_cached_states))
+            _forget(oldest_uuid)
+            evicted_uuids.append(oldest_uuid)
+            _cache_stats["evictions"] += 1
+
+    _forget_persisted_rows(evicted_uuids)
+
+
+def invalidate_cached_state(conversation_uuid: str) -> None:
+    """Drop a conversation after it was changed outside AgentState, e.g. new attachments"""
+    with _cache_lock:
+        _forget(conversation_uuid)
+    _forget_persisted_rows([conversation_uuid])
+
+
+def drop_caches_if_outdated() -> None:
+    """
+    Drop every cached conversation, document and task row snapshot once another process (the
+    retention job) deleted rows since the last call; costs one primary key lookup
+    """
+    from db.document import clear_cached_documents
+    from db.retention import find_cache_generation
+    from db.tasks import clear_persisted_rows
+
+    global _cache_generation
+    generation = find_cache_generation()
+    with _cache_lock:
+        if generation == _cache_generation:
+            return
+        outdated_uuids = list(_cached_states)
+        for conversation_uuid in outdated_uuids:
+            _forget(conversation_uuid)
+        _cache_generation = generation
+    clear_cached_documents()
+    clear_persisted_rows()
+
+
+def get_state_cache_stats() -> Dict[str, float]:
+    """Hit rate and memory use of the conversation state cache"""
+    with _cache_lock:
+        lookups = _cache_stats["hits"] + _cache_stats["misses"]
+        return {
+            **_cache_stats,
+            "entries": len(_cached_states),
+            "max_bytes": STATE_CACHE_MAX_BYTES,
+            "hit_rate": _cache_stats["hits"] / lookups if lookups else 0.0,
+        }
+
+
+def _forget_persisted_rows(conversation_uuids: List[str]) -> None:
+    """Evict the task row snapshots of conversations together with their cached state"""
+    from db.tasks import forget_persisted_conversation
+
+    for conversation_uuid in conversation_uuids:
+        forget_persisted_conversation(conversation_uuid)
+
+
+def _forget(conversation_uuid: str) -> None:
+    if conversation_uuid in _cached_states:
+        del _cached_states[conversation_uuid]
+        _cache_stats["bytes"] -= _cached_sizes.pop(conversation_uuid)
+
+
+def _estimate_state_bytes(state: "AgentState") -> int:
+    """Approximate retained size: message and summary text, task fields, payloads and loaded document text"""
+    size = sum(len(message.content) + 200 for message in state.messages)
+    if state.conversation_summary:
+        size += len(state.conversation_summary.summary)
+    documents = list(state.conversation_documents)
+    for task in state.tasks:
+        size += len(task.name) + len(task.description) + 200
+        for action in task.actions:
+            size += len(action.name) + len(json.dumps(action.input_payload, default=str)) + 200
+            documents.extend(action.output_documents)
+    for document in documents:
+        # Lazily loaded documents only count once their text was read
+        text = document.__dict__.get("_text", document.__dict__.get("text")) or ""
+        size += len(text) + len(json.dumps(document.metadata, default=str)) + 100
+    return size
@@ -8,6 +8,7 @@ from slack_bolt.adapter.socket_mode import SocketModeHandler
 
 from agent.run import agent_run
 from db.conversation import create_conversation_if_not_exists
+from db.migrations import run_migrations
 from llm.tracing import flush
 from logger.logger import log_exception
 from agent.state import AgentState
@@ -87,5 +88,6 @@ def handle_assistant_thread_started(body, ack):
 
 
 if __name__ == "__main__":
+    run_migrations()
     handler = SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"])
     handler.start()
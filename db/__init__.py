@@ -1,49 +1,41 @@
-import sqlite3
+import os
 from contextlib import contextmanager
 from typing import Optional, List, Tuple
 from peewee import SqliteDatabase
 
-db = SqliteDatabase('chat_history.db')
+DATABASE_PATH = os.getenv("CHAT_HISTORY_DB", "chat_history.db")
 
-def initialize_peewee_db():
-    """Initialize Peewee database and create all required tables"""
-    from .models import (
-        MessageModel, DocumentModel, TaskModel, TaskActionModel, TaskActionDocumentModel,
-        ConversationModel, ConversationDocumentModel
-    )
-    
-    db.connect()
-    db.create_tables([
-        MessageModel,
-        DocumentModel,
-        TaskModel,
-        TaskActionModel,
-        TaskActionDocumentModel,
-        ConversationModel,
-        ConversationDocumentModel
-    ])
-    db.close()
+# Applied to every connection peewee opens. WAL lets readers proceed while the writer thread
+# commits; synchronous=NORMAL is durable across application crashes in WAL mode. auto_vacuum only
+# takes effect on new files (existing ones need one VACUUM, see db/retention.py).
+DATABASE_PRAGMAS = {
+    'auto_vacuum': 'incremental',
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -64 * 1024,  # 64 MiB page cache per connection
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+    'foreign_keys': 1,
+    'busy_timeout': 5000,
+}
 
-# Initialize Peewee tables on module import
-initialize_peewee_db()
+# peewee keeps one connection per thread and reuses it for the lifetime of the thread
+db = SqliteDatabase(DATABASE_PATH, pragmas=DATABASE_PRAGMAS, check_same_thread=False)
 
+def configure_database(path: str) -> None:
+    """Point the shared database at another file, e.g. a throwaway copy for benchmarks"""
+    if not db.is_closed():
+        db.close()
+    db.init(path, pragmas=DATABASE_PRAGMAS, check_same_thread=False)
 
 @contextmanager
 def connection():
-    conn = None
-    try:
-        conn = sqlite3.connect('chat_history.db')
-        # Enable foreign key support
-        conn.execute("PRAGMA foreign_keys = ON")
-        yield conn
-        conn.commit()
-    except Exception as e:
-        if conn:
-            conn.rollback()
-        raise e
-    finally:
-        if conn:
-            conn.close()
+    """
+    Transaction scope on the calling thread's shared connection.
+    Commits on success and rolls back on error; nested blocks become savepoints.
+    """
+    with db.atomic():
+        yield db.connection()
 
 def execute(query: str, parameters: tuple = ()) -> Optional[List[Tuple]]:
     """
@@ -0,0 +1,223 @@
+"""Content-addressed storage of document bodies
+
+Identical texts are stored once in document_blobs under their sha256; every DocumentModel row keeps
+its own uuid, conversation and metadata and points at the shared body through content_hash.
+
+Bodies of EXTERNAL_BLOB_THRESHOLD_BYTES or more are not kept in SQLite at all: they are written as
+plain utf-8 files to a content-addressed directory next to the database and read back through mmap,
+so scans over the database never page them in and readers can stream slices of them.
+"""
+import codecs
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from peewee import fn
+
+from utils.document import hash_content
+from . import db
+from .models import DocumentBlobModel, DocumentModel
+
+EXTERNAL_BLOB_THRESHOLD_BYTES = 64 * 1024
+
+
+def store_blobs(texts: List[str]) -> List[str]:
+    """
+    Store document bodies, skipping ones that are already present
+
+    Args:
+        texts: Document texts
+
+    Returns:
+        Content hashes in the same order as the texts
+    """
+    rows = {}
+    for text in texts:
+        content_hash = hash_content(text)
+        if content_hash in rows:
+            continue
+        encoded = text.encode('utf-8')
+        if len(encoded) >= EXTERNAL_BLOB_THRESHOLD_BYTES:
+            rows[content_hash] = {'text': '', 'size': len(encoded), 'storage_path': _write_blob_file(content_hash, encoded)}
+        else:
+            rows[content_hash] = {'text': text, 'size': len(encoded), 'storage_path': None}
+
+    if rows:
+        DocumentBlobModel.insert_many(
+            [{'content_hash': content_hash, **row} for content_hash, row in rows.items()]
+        ).on_conflict_ignore().execute()
+
+    return [hash_content(text) for text in texts]
+
+
+def store_blob(text: str) -> str:
+    """Store a single document body and return its content hash"""
+    return store_blobs([text])[0]
+
+
+def load_blob_text(content_hash: str) -> str:
+    """Read a document body by content hash, empty if it is missing"""
+    row = _find_blob(content_hash)
+    if row is None:
+        return ""
+    if row.storage_path is None:
+        return row.text
+    with open_blob_view(content_hash) as view:
+        return str(view, 'utf-8')
+
+
+def load_blob_texts(content_hashes: List[str]) -> Dict[str, str]:
+    """
+    Read several document bodies with a single query
+
+    Args:
+        content_hashes: Content hashes of the bodies
+
+    Returns:
+        Text by content hash; missing bodies are left out
+    """
+    if not content_hashes:
+        return {}
+    rows = (DocumentBlobModel
+            .select(DocumentBlobModel.content_hash, DocumentBlobModel.text, DocumentBlobModel.storage_path)
+            .where(DocumentBlobModel.content_hash.in_(list(set(content_hashes)))))
+    texts = {}
+    for row in rows:
+        if row.storage_path is None:
+            texts[row.content_hash] = row.text
+        else:
+            with open(_blob_file_path(row.storage_path), 'rb') as blob_file:
+                texts[row.content_hash] = blob_file.read().decode('utf-8')
+    return texts
+
+
+@contextmanager
+def open_blob_view(content_hash: str) -> Iterator[memoryview]:
+    """
+    Expose a stored body as read-only utf-8 bytes without copying it into memory
+
+    File-backed bodies are memory-mapped; inline bodies are encoded once.
+
+    Args:
+        content_hash: Content hash of the body
+
+    Yields:
+        memoryview over the utf-8 bytes of the body, valid until the block exits
+    """
+    row = _find_blob(content_hash)
+    if row is None:
+        raise KeyError(f"Document blob not found: {content_hash}")
+
+    if row.storage_path is None:
+        yield memoryview(row.text.encode('utf-8'))
+        return
+
+    with open(_blob_file_path(row.storage_path), 'rb') as blob_file:
+        with mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+def iter_blob_text(content_hash: str, chunk_bytes: int = 64 * 1024) -> Iterator[str]:
+    """
+    Stream a stored body as text slices of about chunk_bytes, never splitting a character
+
+    Args:
+        content_hash: Content hash of the body
+        chunk_bytes: Bytes decoded per slice
+
+    Yields:
+        Consecutive text slices of the body
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with open_blob_view(content_hash) as view:
+        for start in range(0, len(view), chunk_bytes):
+            text = decoder.decode(view[start:start + chunk_bytes])
+            if text:
+                yield text
+    if tail := decoder.decode(b'', final=True):
+        yield tail
+
+
+def read_blob_slice(content_hash: str, start: int, end: int) -> str:
+    """Decode bytes [start, end) of a stored body; partial characters at the edges are dropped"""
+    with open_blob_view(content_hash) as view:
+        return bytes(view[start:end]).decode('utf-8', errors='ignore')
+
+
+def blob_store_directory() -> str:
+    """Directory holding file-backed bodies, next to the database file"""
+    return f"{db.database}.blobs"
+
+
+def _find_blob(content_hash: str) -> Optional[DocumentBlobModel]:
+    return (DocumentBlobModel
+            .select(DocumentBlobModel.text, DocumentBlobModel.storage_path)
+            .where(DocumentBlobModel.content_hash == content_hash)
+            .first())
+
+
+def _blob_file_path(storage_path: str) -> str:
+    return os.path.join(blob_store_directory(), storage_path)
+
+
+def _write_blob_file(content_hash: str, encoded: bytes) -> str:
+    """Write a body to the file store unless present; returns its path relative to the store"""
+    storage_path = os.path.join(content_hash[:2], content_hash)
+    file_path = _blob_file_path(storage_path)
+    if os.path.exists(file_path):
+        # Reuse counts as a write: the retention sweep never removes recently touched files
+        os.utime(file_path)
+        return storage_path
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    # Write to a temporary file and rename, so a crash never leaves a truncated blob behind
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(file_path))
+    with os.fdopen(file_descriptor, 'wb') as blob_file:
+        blob_file.write(encoded)
+        blob_file.flush()
+        os.fsync(blob_file.fileno())
+    os.replace(temporary_path, file_path)
+    return storage_path
+
+
+def get_dedup_stats() -> Dict[str, float]:
+    """
+    Report how much document storage content addressing saves
+
+    Returns:
+        documents: document rows pointing at a blob
+        blobs: distinct stored bodies
+        logical_bytes: bytes the bodies would take if every document stored its own copy
+        stored_bytes: bytes of distinct bodies actually stored (before compression)
+        dedup_ratio: logical_bytes / stored_bytes
+    """
+    documents, logical_bytes = (DocumentModel
+                                .select(fn.COUNT(DocumentModel.uuid), fn.COALESCE(fn.SUM(DocumentBlobModel.size), 0))
+                                .join(DocumentBlobModel, on=(DocumentModel.content_hash == DocumentBlobModel.content_hash))
+                                .scalar(as_tuple=True))
+    blobs, stored_bytes = (DocumentBlobModel
+                           .select(fn.COUNT(DocumentBlobModel.content_hash), fn.COALESCE(fn.SUM(DocumentBlobModel.size), 0))
+                           .scalar(as_tuple=True))
+
+    return {
+        'documents': documents,
+        'blobs': blobs,
+        'logical_bytes': logical_bytes,
+        'stored_bytes': stored_bytes,
+        'dedup_ratio': logical_bytes / stored_bytes if stored_bytes else 1.0,
+    }
+
+
+if __name__ == "__main__":
+    stats = get_dedup_stats()
+    print(
+        f"{stats['documents']} documents share {stats['blobs']} blobs: "
+        f"{stats['logical_bytes'] / 1024:.0f} KB logical, {stats['stored_bytes'] / 1024:.0f} KB stored, "
+        f"dedup ratio {stats['dedup_ratio']:.2f}x"
+    )
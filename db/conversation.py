@@ -1,8 +1,10 @@
-from typing import List
-from uuid import UUID
+from datetime import datetime
+from typing import List, Optional
 
 from models.document import Document
-from .models import ConversationModel, ConversationDocumentModel, DocumentModel
+from models.message import ConversationSummary
+from .document import to_lazy_document
+from .models import ConversationModel, ConversationDocumentModel, DocumentModel, ConversationSummaryModel
 
 
 def create_conversation_if_not_exists(uuid: str) -> None:
@@ -14,20 +16,37 @@ def create_conversation_if_not_exists(uuid: str) -> None:
 
 
 def load_conversation_documents(uuid: str) -> List[Document]:
-    """Load all documents associated with a conversation through conversation_documents table"""
+    """Load all documents associated with a conversation through conversation_documents table; texts load lazily"""
     query = (ConversationDocumentModel
-             .select(DocumentModel)
+             .select(ConversationDocumentModel, DocumentModel.uuid, DocumentModel.metadata)
              .join(DocumentModel)
              .where(ConversationDocumentModel.conversation_uuid == uuid))
     
-    documents = []
-    for conv_doc in query:
-        document = Document(
-            uuid=UUID(conv_doc.document.uuid),
-            text=conv_doc.document.text,
-            conversation_uuid=uuid,
-            metadata=conv_doc.document.metadata
-        )
-        documents.append(document)
-    
-    return documents
+    return [
+        to_lazy_document(conv_doc.document.uuid, uuid, conv_doc.document.metadata)
+        for conv_doc in query
+    ]
+
+
+def find_conversation_summary(uuid: str) -> Optional[ConversationSummary]:
+    """Load the rolling summary of older conversation turns, if one was stored"""
+    try:
+        summary_model = ConversationSummaryModel.get(ConversationSummaryModel.conversation_uuid == uuid)
+    except ConversationSummaryModel.DoesNotExist:
+        return None
+
+    return ConversationSummary(
+        conversation_uuid=summary_model.conversation_uuid,
+        summary=summary_model.summary,
+        summarized_until=summary_model.summarized_until
+    )
+
+
+def save_conversation_summary(summary: ConversationSummary) -> None:
+    """Insert or replace the rolling summary of a conversation"""
+    ConversationSummaryModel.replace(
+        conversation_uuid=summary.conversation_uuid,
+        summary=summary.summary,
+        summarized_until=summary.summarized_until,
+        updated_at=datetime.utcnow()
+    ).execute()
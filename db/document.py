@@ -1,7 +1,23 @@
-from typing import List, Optional, Dict, Any
+import copy
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Dict, Any
 from uuid import UUID
+from db import connection
+from db.blobs import load_blob_text, load_blob_texts, store_blob
 from db.models import DocumentModel
-from models.document import Document
+from db.search import index_documents
+from models.document import Document, DocumentMetadata, LazyDocument
+
+# Upper bound on the text, restored text and metadata size of all documents kept by find_documents_by_uuids
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+_cached_documents: "OrderedDict[str, Document]" = OrderedDict()
+_cached_sizes: Dict[str, int] = {}
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
 
 
 def save_document(document: Document | Dict[str, Any]) -> None:
@@ -35,7 +51,16 @@ def save_document(document: Document | Dict[str, Any]) -> None:
             )
         doc_dict['uuid'] = str(doc_dict['uuid'])
 
-    DocumentModel.create(**doc_dict)
+    from db.vectors import add_document_chunks
+
+    # The body is stored once per distinct content; the row only references it
+    with connection():
+        text = doc_dict.pop('text')
+        doc_dict['content_hash'] = store_blob(text)
+        DocumentModel.create(**doc_dict)
+        index_documents([(doc_dict['uuid'], doc_dict.get('metadata', {}).get('name', ''), text)])
+        add_document_chunks([(doc_dict['uuid'], doc_dict['conversation_uuid'], text)])
+    invalidate_cached_documents([doc_dict['uuid']])
 
 
 def find_document_by_uuid(document_uuid: UUID) -> Optional[Document]:
@@ -48,48 +73,175 @@ def find_document_by_uuid(document_uuid: UUID) -> Optional[Document]:
     Returns:
         Document dictionary if found, None otherwise
     """
-    try:
-        doc = DocumentModel.get(DocumentModel.uuid == str(document_uuid))
-        metadata = doc.metadata
-        
-        if parent_uuid := metadata.get('parent_document_uuid'):
-            metadata['parent_document_uuid'] = UUID(parent_uuid)
-            
-        return Document(
-            uuid=UUID(doc.uuid),
-            conversation_uuid=doc.conversation_uuid,
-            text=doc.text,
-            metadata=metadata
-        )
-    except DocumentModel.DoesNotExist:
-        return None
+    return find_documents_by_uuids([document_uuid]).get(str(document_uuid))
+
+
+def find_documents_by_uuids(document_uuids: Iterable[UUID | str]) -> Dict[str, Document]:
+    """
+    Retrieve several documents, reading the ones not cached in this process with one query per table
+
+    Returned documents are copies, so callers may change them without affecting the cache.
+
+    Args:
+        document_uuids: UUIDs of the documents to find
+
+    Returns:
+        Documents by UUID string; UUIDs without a stored document are left out
+    """
+    requested = list(dict.fromkeys(str(document_uuid) for document_uuid in document_uuids))
+    documents = {}
+    with _cache_lock:
+        for document_uuid in requested:
+            document = _cached_documents.get(document_uuid)
+            if document is None:
+                _cache_stats["misses"] += 1
+                continue
+            _cached_documents.move_to_end(document_uuid)
+            _cache_stats["hits"] += 1
+            documents[document_uuid] = document
+
+    missing = [document_uuid for document_uuid in requested if document_uuid not in documents]
+    if missing:
+        rows = list(DocumentModel.select().where(DocumentModel.uuid.in_(missing)))
+        texts = load_blob_texts([row.content_hash for row in rows if row.content_hash])
+        loaded = []
+        for row in rows:
+            metadata = row.metadata
+            if parent_uuid := metadata.get('parent_document_uuid'):
+                metadata['parent_document_uuid'] = UUID(parent_uuid)
+            loaded.append(Document(
+                uuid=UUID(row.uuid),
+                conversation_uuid=row.conversation_uuid,
+                text=texts.get(row.content_hash, "") if row.content_hash else row.text,
+                metadata=metadata
+            ))
+        _cache_documents(loaded)
+        documents.update((str(document.uuid), document) for document in loaded)
+
+    return {document_uuid: _copy_document(documents[document_uuid])
+            for document_uuid in requested if document_uuid in documents}
+
+
+def invalidate_cached_documents(document_uuids: Iterable[UUID | str]) -> None:
+    """Drop documents from the cache after their rows were written or deleted"""
+    with _cache_lock:
+        for document_uuid in document_uuids:
+            _forget(str(document_uuid))
+
+
+def clear_cached_documents() -> None:
+    """Drop every cached document, e.g. after another process deleted rows"""
+    with _cache_lock:
+        _cached_documents.clear()
+        _cached_sizes.clear()
+        _cache_stats["bytes"] = 0
+
+
+def get_document_cache_stats() -> Dict[str, float]:
+    """Hit rate and memory use of the document cache"""
+    with _cache_lock:
+        lookups = _cache_stats["hits"] + _cache_stats["misses"]
+        return {
+            **_cache_stats,
+            "entries": len(_cached_documents),
+            "max_bytes": DOCUMENT_CACHE_MAX_BYTES,
+            "hit_rate": _cache_stats["hits"] / lookups if lookups else 0.0,
+        }
 
 
 def find_documents_by_conversation(conversation_uuid: str) -> List[Document]:
     """
     Retrieve all documents for a given conversation
     
+    Only metadata is read here; each document's text is loaded on first access.
+
     Args:
         conversation_uuid: UUID of the conversation
             
     Returns:
-        List of document dictionaries
+        List of lazily loaded documents
     """
-    query = DocumentModel.select().where(DocumentModel.conversation_uuid == conversation_uuid)
-    
-    documents = []
-    for doc in query:
-        metadata = doc.metadata
-        if parent_uuid := metadata.get('parent_document_uuid'):
-            metadata['parent_document_uuid'] = UUID(parent_uuid)
-            
-        documents.append(Document(
-            uuid=UUID(doc.uuid),
-            conversation_uuid=doc.conversation_uuid,
-            text=doc.text,
-            metadata=metadata
-        ))
-    
-    return documents
+    query = DocumentModel.select(
+        DocumentModel.uuid,
+        DocumentModel.conversation_uuid,
+        DocumentModel.metadata
+    ).where(DocumentModel.conversation_uuid == conversation_uuid)
+
+    return [to_lazy_document(doc.uuid, doc.conversation_uuid, doc.metadata) for doc in query]
+
+
+def load_document_text(document_uuid: UUID | str) -> str:
+    """
+    Read and decompress the text of a single document
+
+    Args:
+        document_uuid: UUID of the document
+
+    Returns:
+        Document text, empty if the document no longer exists
+    """
+    row = (DocumentModel
+           .select(DocumentModel.text, DocumentModel.content_hash)
+           .where(DocumentModel.uuid == str(document_uuid))
+           .first())
+    if row is None:
+        return ""
+    return load_blob_text(row.content_hash) if row.content_hash else row.text
+
+
+def to_lazy_document(document_uuid: str, conversation_uuid: str, metadata: DocumentMetadata) -> LazyDocument:
+    """
+    Build a document from a metadata-only row; its text is fetched on first access
+
+    Args:
+        document_uuid: UUID of the document
+        conversation_uuid: UUID of the conversation the document belongs to
+        metadata: Decoded metadata column
+
+    Returns:
+        LazyDocument bound to the stored text
+    """
+    if parent_uuid := metadata.get('parent_document_uuid'):
+        metadata['parent_document_uuid'] = UUID(parent_uuid)
+
+    return LazyDocument(
+        uuid=UUID(document_uuid),
+        conversation_uuid=conversation_uuid,
+        metadata=metadata,
+        load_text=lambda: load_document_text(document_uuid)
+    )
+
+
+def _cache_documents(documents: List[Document]) -> None:
+    """Store loaded documents, evicting least recently used ones until the cache fits DOCUMENT_CACHE_MAX_BYTES"""
+    # Restored before caching, outside the lock, so every copy handed out shares the one view
+    restored_texts = [document.restored_text for document in documents]
+    with _cache_lock:
+        for document, restored_text in zip(documents, restored_texts):
+            document_uuid = str(document.uuid)
+            size = len(document.text) + len(json.dumps(document.metadata, default=str)) + 100
+            if restored_text is not document.text:
+                size += len(restored_text)
+            _forget(document_uuid)
+            if size > DOCUMENT_CACHE_MAX_BYTES:
+                continue
+            _cached_documents[document_uuid] = document
+            _cached_sizes[document_uuid] = size
+            _cache_stats["bytes"] += size
+
+        while _cache_stats["bytes"] > DOCUMENT_CACHE_MAX_BYTES:
+            _forget(next(iter(_cached_documents)))
+            _cache_stats["evictions"] += 1
+
+
+def _forget(document_uuid: str) -> None:
+    if document_uuid in _cached_documents:
+        del _cached_documents[document_uuid]
+        _cache_stats["bytes"] -= _cached_sizes.pop(document_uuid)
 
 
+def _copy_document(document: Document) -> Document:
+    """Shallow copy sharing the text and the restored view computed when it was cached, with its own metadata dict"""
+    copied = copy.copy(document)
+    copied.metadata = {**document.metadata}
+    return copied
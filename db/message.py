@@ -1,6 +1,5 @@
-import uuid
 from datetime import datetime
-from typing import List
+from typing import Iterator, List, Optional
 
 from db.models import MessageModel
 from models.message import Message
@@ -32,18 +31,117 @@ def find_messages_by_conversation(conversation_uuid: str) -> List[Message]:
     Returns:
         List of Message objects
     """
+    return list(iterate_messages_by_conversation(conversation_uuid))
+
+
+def find_latest_messages(conversation_uuid: str, limit: int) -> List[Message]:
+    """
+    Find the latest messages in a conversation
+
+    Args:
+        conversation_uuid: Conversation UUID
+        limit: Maximum number of messages to return
+
+    Returns:
+        List of at most `limit` Message objects in chronological order
+    """
+    return find_messages_since(conversation_uuid, cursor=None, limit=limit)
+
+
+def find_messages_since(
+        conversation_uuid: str,
+        cursor: Optional[datetime],
+        limit: Optional[int] = None
+) -> List[Message]:
+    """
+    Find messages created after a cursor
+
+    Args:
+        conversation_uuid: Conversation UUID
+        cursor: Only messages created strictly after this timestamp are returned; None means from the start
+        limit: Optional maximum number of messages; the newest ones are kept, ties on created_at
+            broken by uuid like the (created_at, uuid) cursor of iterate_messages_by_conversation
+
+    Returns:
+        List of Message objects in chronological order
+    """
+    query = MessageModel.select().where(MessageModel.conversation_uuid == conversation_uuid)
+    if cursor is not None:
+        query = query.where(MessageModel.created_at > cursor)
+
+    if limit is None:
+        return [_to_message(msg) for msg in query.order_by(MessageModel.created_at, MessageModel.uuid)]
+
+    newest_first = query.order_by(MessageModel.created_at.desc(), MessageModel.uuid.desc()).limit(limit)
+    return [_to_message(msg) for msg in reversed(list(newest_first))]
+
+
+def find_messages_page(conversation_uuid: str, page: int, page_size: int = 50) -> List[Message]:
+    """
+    Find one page of messages in a conversation
+
+    Args:
+        conversation_uuid: Conversation UUID
+        page: 1-based page number, oldest messages first
+        page_size: Number of messages per page
+
+    Returns:
+        List of Message objects in chronological order
+    """
     query = MessageModel.select().where(
         MessageModel.conversation_uuid == conversation_uuid
-    ).order_by(MessageModel.created_at)
-    
-    return [
-        Message(
-            uuid=msg.uuid,
-            conversation_uuid=msg.conversation_uuid,
-            content=msg.content,
-            role=msg.role,
-            created_at=msg.created_at
-        ) for msg in query
-    ]
+    ).order_by(MessageModel.created_at, MessageModel.uuid).paginate(page, page_size)
+
+    return [_to_message(msg) for msg in query]
 
 
+def iterate_messages_by_conversation(
+        conversation_uuid: str,
+        batch_size: int = 200,
+        after: Optional[datetime] = None
+) -> Iterator[Message]:
+    """
+    Lazily iterate over the full history of a conversation
+
+    Rows are fetched in batches using the (created_at, uuid) of the last yielded message as a
+    cursor, so only one batch is held in memory at a time and messages sharing a timestamp across
+    a batch boundary are neither skipped nor repeated.
+
+    Args:
+        conversation_uuid: Conversation UUID
+        batch_size: Number of rows fetched per query
+        after: Only messages created strictly after this timestamp; None means from the start
+
+    Yields:
+        Message objects in chronological order
+    """
+    cursor = None
+    while True:
+        query = MessageModel.select().where(MessageModel.conversation_uuid == conversation_uuid)
+        if cursor is not None:
+            created_at, uuid = cursor
+            # The >= bound keeps the scan on the (conversation_uuid, created_at) index
+            query = query.where(
+                (MessageModel.created_at >= created_at) &
+                ((MessageModel.created_at > created_at) | (MessageModel.uuid > uuid))
+            )
+        elif after is not None:
+            query = query.where(MessageModel.created_at > after)
+
+        batch = [_to_message(msg) for msg in
+                 query.order_by(MessageModel.created_at, MessageModel.uuid).limit(batch_size)]
+        yield from batch
+
+        if len(batch) < batch_size:
+            return
+        cursor = (batch[-1].created_at, batch[-1].uuid)
+
+
+def _to_message(msg: MessageModel) -> Message:
+    return Message(
+        uuid=msg.uuid,
+        conversation_uuid=msg.conversation_uuid,
+        content=msg.content,
+        role=msg.role,
+        created_at=msg.created_at
+    )
@@ -0,0 +1,220 @@
+"""Versioned schema migrations for chat_history.db
+
+The applied version is kept in SQLite's `PRAGMA user_version`. Migrations run in order, each in its
+own immediate transaction, so concurrent starters never apply the same step twice.
+
+Run once at deploy time (app.py also runs it on startup):
+    python -m db.migrations
+"""
+import time
+from typing import Callable, List, Tuple
+
+from playhouse.migrate import SqliteMigrator, migrate
+
+from logger.logger import log_info
+from . import db
+
+# (table, columns) of secondary indexes backing the per-request repository lookups
+SECONDARY_INDEXES = [
+    ('messages', ('conversation_uuid', 'created_at')),
+    ('documents', ('conversation_uuid',)),
+    ('tasks', ('conversation_uuid', 'created_at')),
+    ('task_actions', ('task_id', 'step')),
+]
+
+
+def create_initial_tables() -> None:
+    """Create the base tables; existing tables are left untouched"""
+    from .models import (
+        MessageModel, DocumentModel, TaskModel, TaskActionModel, TaskActionDocumentModel,
+        ConversationModel, ConversationDocumentModel, ConversationSummaryModel
+    )
+
+    db.create_tables([
+        MessageModel,
+        DocumentModel,
+        TaskModel,
+        TaskActionModel,
+        TaskActionDocumentModel,
+        ConversationModel,
+        ConversationDocumentModel,
+        ConversationSummaryModel
+    ])
+
+
+def add_secondary_indexes() -> None:
+    """Create the secondary indexes missing from an existing database"""
+    migrator = SqliteMigrator(db)
+    operations = []
+    for table, columns in SECONDARY_INDEXES:
+        index_name = f"{table}_{'_'.join(columns)}"
+        existing_indexes = {index.name for index in db.get_indexes(table)}
+        if index_name not in existing_indexes:
+            operations.append(migrator.add_index(table, columns, False))
+
+    if operations:
+        migrate(*operations)
+
+
+def compress_document_texts() -> None:
+    """Rewrite large plain-text document bodies through the compressing text field, in batches"""
+    from peewee import fn
+    from .models import DocumentModel
+
+    threshold = DocumentModel.text.compression_threshold
+    while True:
+        batch = list(DocumentModel
+                     .select(DocumentModel.uuid, DocumentModel.text)
+                     .where((fn.typeof(DocumentModel.text) == 'text') & (fn.length(DocumentModel.text) >= threshold))
+                     .limit(500))
+        if not batch:
+            return
+        for document in batch:
+            DocumentModel.update(text=document.text).where(DocumentModel.uuid == document.uuid).execute()
+
+
+def add_document_blobs() -> None:
+    """Move document bodies into the content-addressed document_blobs table"""
+    from .blobs import store_blobs
+    from .models import DocumentBlobModel, DocumentModel
+
+    db.create_tables([DocumentBlobModel])
+    migrator = SqliteMigrator(db)
+    if 'content_hash' not in {column.name for column in db.get_columns('documents')}:
+        migrate(migrator.add_column('documents', 'content_hash', DocumentModel.content_hash))
+    if 'documents_content_hash' not in {index.name for index in db.get_indexes('documents')}:
+        migrate(migrator.add_index('documents', ('content_hash',), False))
+
+    while True:
+        batch = list(DocumentModel
+                     .select(DocumentModel.uuid, DocumentModel.text)
+                     .where(DocumentModel.content_hash.is_null())
+                     .limit(500))
+        if not batch:
+            return
+        content_hashes = store_blobs([document.text for document in batch])
+        for document, content_hash in zip(batch, content_hashes):
+            (DocumentModel
+             .update(content_hash=content_hash, text='')
+             .where(DocumentModel.uuid == document.uuid)
+             .execute())
+
+
+def add_external_blob_store() -> None:
+    """Move large inline bodies out of SQLite into the memory-mapped file store"""
+    from .blobs import EXTERNAL_BLOB_THRESHOLD_BYTES, _write_blob_file
+    from .models import DocumentBlobModel
+
+    if 'storage_path' not in {column.name for column in db.get_columns('document_blobs')}:
+        migrate(SqliteMigrator(db).add_column('document_blobs', 'storage_path', DocumentBlobModel.storage_path))
+
+    while True:
+        batch = list(DocumentBlobModel
+                     .select(DocumentBlobModel.content_hash, DocumentBlobModel.text)
+                     .where(DocumentBlobModel.storage_path.is_null() &
+                            (DocumentBlobModel.size >= EXTERNAL_BLOB_THRESHOLD_BYTES))
+                     .limit(100))
+        if not batch:
+            return
+        for blob in batch:
+            storage_path = _write_blob_file(blob.content_hash, blob.text.encode('utf-8'))
+            (DocumentBlobModel
+             .update(storage_path=storage_path, text='')
+             .where(DocumentBlobModel.content_hash == blob.content_hash)
+             .execute())
+
+
+def add_conversation_snapshots() -> None:
+    """Create the table holding one serialized state blob per conversation"""
+    from .models import ConversationSnapshotModel
+
+    db.create_tables([ConversationSnapshotModel])
+
+
+def add_full_text_index() -> None:
+    """Create the FTS5 indexes over documents and messages and fill them from the existing rows"""
+    from .search import FTS_TABLES_SQL, rebuild_index
+
+    for statement in FTS_TABLES_SQL:
+        db.execute_sql(statement)
+    rebuild_index()
+
+
+def add_vector_index() -> None:
+    """Create the document chunk and embedding cache tables backing the vector index"""
+    from .models import DocumentChunkModel, EmbeddingModel
+
+    db.create_tables([DocumentChunkModel, EmbeddingModel])
+
+
+def add_summary_cache() -> None:
+    """Create the table mapping summarize inputs to the summary document computed from them"""
+    from .models import SummaryCacheModel
+
+    db.create_tables([SummaryCacheModel])
+
+
+def add_cache_generation() -> None:
+    """Create the counter signalling deletes made by other processes to the bot's caches"""
+    from .models import CacheGenerationModel
+
+    db.create_tables([CacheGenerationModel])
+
+
+def make_document_index_contentless() -> None:
+    """Re-create documents_fts without its own uncompressed copy of every document body"""
+    from .search import DOCUMENTS_FTS_SQL, rebuild_document_index
+
+    db.execute_sql("DROP TRIGGER IF EXISTS documents_fts_delete")
+    db.execute_sql("DROP TABLE IF EXISTS documents_fts")
+    db.execute_sql(DOCUMENTS_FTS_SQL)
+    rebuild_document_index()
+
+
+# Append only: the position of a migration is its schema version
+MIGRATIONS: List[Tuple[str, Callable[[], None]]] = [
+    ("create_initial_tables", create_initial_tables),
+    ("add_secondary_indexes", add_secondary_indexes),
+    ("compress_document_texts", compress_document_texts),
+    ("add_document_blobs", add_document_blobs),
+    ("add_external_blob_store", add_external_blob_store),
+    ("add_conversation_snapshots", add_conversation_snapshots),
+    ("add_full_text_index", add_full_text_index),
+    ("add_vector_index", add_vector_index),
+    ("add_summary_cache", add_summary_cache),
+    ("add_cache_generation", add_cache_generation),
+    ("make_document_index_contentless", make_document_index_contentless),
+]
+
+
+def get_schema_version() -> int:
+    """Schema version of the connected database, 0 for a new file"""
+    return db.execute_sql("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations() -> List[Tuple[int, str, float]]:
+    """
+    Apply all pending migrations
+
+    Returns:
+        List of (version, name, duration in ms) for each migration applied by this call
+    """
+    applied = []
+    for version, (name, migration) in enumerate(MIGRATIONS, start=1):
+        started = time.perf_counter()
+        with db.atomic(lock_type='IMMEDIATE'):
+            if get_schema_version() >= version:
+                continue
+            migration()
+            db.execute_sql(f"PRAGMA user_version = {version}")
+
+        duration_ms = (time.perf_counter() - started) * 1000
+        log_info(f"🗄️ Applied migration {version} ({name}) in {duration_ms:.1f} ms")
+        applied.append((version, name, duration_ms))
+
+    return applied
+
+
+if __name__ == "__main__":
+    applied_migrations = run_migrations()
+    log_info(f"Schema at version {get_schema_version()}, {len(applied_migrations)} migration(s) applied")
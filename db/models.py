@@ -1,5 +1,6 @@
 from datetime import datetime
 import json
+import zlib
 from peewee import *
 from . import db
 
@@ -15,6 +16,28 @@ class JSONField(TextField):
         return '{}'
 
 
+class CompressedTextField(TextField):
+    """Text stored zlib-compressed as a BLOB once it reaches the threshold; shorter values and
+    rows written before compression existed stay plain TEXT and are read back unchanged"""
+
+    def __init__(self, compression_threshold: int = 4096, *args, **kwargs):
+        self.compression_threshold = compression_threshold
+        super().__init__(*args, **kwargs)
+
+    def python_value(self, value):
+        if isinstance(value, bytes):
+            return zlib.decompress(value).decode('utf-8')
+        return value
+
+    def db_value(self, value):
+        if value is None:
+            return None
+        encoded = str(value).encode('utf-8')
+        if len(encoded) < self.compression_threshold:
+            return str(value)
+        return zlib.compress(encoded, 6)
+
+
 class BaseModel(Model):
     class Meta:
         database = db
@@ -27,6 +50,25 @@ class ConversationModel(BaseModel):
     class Meta:
         table_name = 'conversations'
 
+class ConversationSummaryModel(BaseModel):
+    conversation_uuid = CharField(primary_key=True)
+    summary = TextField()
+    summarized_until = DateTimeField()  # created_at of the newest message folded into the summary
+    updated_at = DateTimeField(default=datetime.utcnow)
+
+    class Meta:
+        table_name = 'conversation_summaries'
+
+class ConversationSnapshotModel(BaseModel):
+    conversation_uuid = CharField(primary_key=True)
+    format_version = IntegerField()
+    last_message_uuid = CharField(null=True)  # snapshot is stale once a newer message exists
+    payload = BlobField()  # zlib-compressed orjson document
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    class Meta:
+        table_name = 'conversation_snapshots'
+
 class MessageModel(BaseModel):
     uuid = CharField(primary_key=True)
     conversation_uuid = CharField()
@@ -37,15 +79,65 @@ class MessageModel(BaseModel):
     class Meta:
         table_name = 'messages'
 
+class DocumentBlobModel(BaseModel):
+    content_hash = CharField(primary_key=True)  # sha256 of the utf-8 text
+    text = CompressedTextField()  # empty when the body lives in the file store
+    size = IntegerField()  # utf-8 bytes of the uncompressed text
+    storage_path = CharField(null=True)  # path inside the blob file store for large bodies
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    class Meta:
+        table_name = 'document_blobs'
+
 class DocumentModel(BaseModel):
     uuid = CharField(primary_key=True)
     conversation_uuid = CharField()
-    text = TextField()
+    text = CompressedTextField(default='')  # only used by rows stored before content addressing
+    content_hash = CharField(null=True)  # body lives in document_blobs, shared by identical documents
     metadata = JSONField()
 
     class Meta:
         table_name = 'documents'
 
+class DocumentChunkModel(BaseModel):
+    id = AutoField()
+    document = ForeignKeyField(DocumentModel, backref='chunks', on_delete='CASCADE')
+    conversation_uuid = CharField()
+    chunk_index = IntegerField()
+    start = IntegerField()  # character offsets of the chunk in the document text
+    end = IntegerField()
+    content_hash = CharField()  # sha256 of the chunk text, key of its cached embedding
+    vector_row = IntegerField(null=True, index=True)  # row in the vector index file, null until embedded
+
+    class Meta:
+        table_name = 'document_chunks'
+
+class EmbeddingModel(BaseModel):
+    content_hash = CharField()
+    model = CharField()
+    vector = BlobField()  # float32, L2-normalized
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    class Meta:
+        table_name = 'embeddings'
+        primary_key = CompositeKey('content_hash', 'model')
+
+class SummaryCacheModel(BaseModel):
+    cache_key = CharField(primary_key=True)  # sha256 of the prompt version and the source content hashes
+    document_uuid = CharField()  # summary document, saved with its task action after the entry is written
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    class Meta:
+        table_name = 'summary_cache'
+
+class CacheGenerationModel(BaseModel):
+    id = IntegerField(primary_key=True)  # single row
+    generation = IntegerField(default=0)  # bumped with every delete made outside the bot process
+    updated_at = DateTimeField(default=datetime.utcnow)
+
+    class Meta:
+        table_name = 'cache_generation'
+
 class ConversationDocumentModel(BaseModel):
     conversation_uuid = CharField()
     document = ForeignKeyField(DocumentModel, backref='document_conversations')
@@ -0,0 +1,302 @@
+"""EXPLAIN QUERY PLAN regression check for the repository queries
+
+The repository functions are called against a small seeded database while every statement they send
+to SQLite is recorded; each recorded query is then explained. The check fails when SQLite plans any
+of them as a full table scan, which usually means an index went missing or a query stopped matching
+one. Checking the executed SQL keeps the check in step with the repositories as they change.
+
+Run from the repository root (seeds a throwaway database; a given database is copied into it first so
+its statistics and row counts apply):
+    python -m db.query_plan [path/to/database.db]
+"""
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Tuple
+
+# Read when db.vectors is imported: the seeded documents must not be sent to the embeddings API
+os.environ["VECTOR_INDEX"] = "0"
+
+from models.message import ConversationSummary, Message
+from models.state import ConversationSnapshot, Task, TaskAction
+from utils.document import create_document, hash_content
+from . import db, configure_database
+from .blobs import EXTERNAL_BLOB_THRESHOLD_BYTES, load_blob_text, load_blob_texts, read_blob_slice
+from .conversation import (
+    create_conversation_if_not_exists, find_conversation_summary, load_conversation_documents,
+    save_conversation_summary
+)
+from .document import (
+    find_document_by_uuid, find_documents_by_conversation, find_documents_by_uuids, invalidate_cached_documents,
+    load_document_text, save_document
+)
+from .message import (
+    find_latest_messages, find_messages_page, find_messages_since, iterate_messages_by_conversation, save_message
+)
+from .migrations import run_migrations
+from .models import ConversationDocumentModel, EmbeddingModel
+from .retention import (
+    _conversation_document_uuids, _delete_conversation, _export_conversation, _has_activity_since,
+    delete_unreferenced_blobs, find_cache_generation, find_expired_conversations
+)
+from .search import search_documents, search_messages
+from .snapshots import load_conversation_snapshot, save_conversation_snapshot
+from .summaries import cache_summary, delete_orphaned_summaries, find_cached_summary
+from .tasks import find_tasks_by_uuids, load_tasks, save_task, update_task_action, update_task_status
+from .vectors import EMBEDDING_MODEL, embed_pending_chunks, get_embeddings
+
+# FTS5 tables looked up through MATCH or rowid constraints show as "SCAN x VIRTUAL TABLE INDEX 0:M1" or "0:="
+FULL_SCAN_PATTERN = re.compile(
+    r"\bSCAN (?!CONSTANT ROW)(\w+)\b(?! USING (?:COVERING )?INDEX)(?! VIRTUAL TABLE INDEX \d+:\S*[M=])"
+)
+EXPLAINED_STATEMENTS = ("SELECT", "INSERT", "REPLACE", "UPDATE", "DELETE", "WITH")
+
+# Nightly retention sweeps visit every conversation or compare every row against the live references
+EXPECTED_FULL_SCANS = {
+    "retention.find_expired_conversations", "retention.delete_unreferenced_blobs",
+    "summaries.delete_orphaned_summaries",
+}
+
+
+class Fixture:
+    """Uuids of the rows seeded for the scenarios"""
+
+    def __init__(self):
+        self.conversation_uuid = str(uuid.uuid4())
+        self.expired_conversation_uuid = str(uuid.uuid4())
+        self.task_uuid = str(uuid.uuid4())
+        self.action_uuid = str(uuid.uuid4())
+        self.document_uuids: List[str] = []
+        self.content_hashes: List[str] = []
+        self.messages: List[Message] = []
+        self.cache_key = "0" * 64
+        self.query = "quarterly invoice"
+
+
+def seed(fixture: Fixture) -> None:
+    """Create one active and one expired conversation with every kind of row the repositories read"""
+    now = datetime.utcnow()
+    for conversation_uuid, created_at in ((fixture.conversation_uuid, now),
+                                          (fixture.expired_conversation_uuid, now - timedelta(days=365))):
+        create_conversation_if_not_exists(conversation_uuid)
+        for index in range(6):
+            message = Message(
+                uuid=str(uuid.uuid4()),
+                conversation_uuid=conversation_uuid,
+                content=f"Message {index} about the {fixture.query}",
+                role="user" if index % 2 == 0 else "assistant",
+                # Pairs of messages share a timestamp, like a reply saved in the same step
+                created_at=created_at + timedelta(seconds=index // 2)
+            )
+            save_message(message)
+            if conversation_uuid == fixture.conversation_uuid:
+                fixture.messages.append(message)
+
+    documents = [
+        create_document(f"The {fixture.query} is due next week. " * 10,
+                        {"conversation_uuid": fixture.conversation_uuid, "name": "Invoice"}),
+        create_document("x" * EXTERNAL_BLOB_THRESHOLD_BYTES,
+                        {"conversation_uuid": fixture.conversation_uuid, "name": "Large"}),
+    ]
+    for document in documents:
+        save_document(document)
+        ConversationDocumentModel.create(conversation_uuid=fixture.conversation_uuid, document=str(document.uuid))
+        fixture.document_uuids.append(str(document.uuid))
+        fixture.content_hashes.append(hash_content(document.text))
+
+    save_task(Task(
+        uuid=fixture.task_uuid,
+        name="Summarize",
+        description="Summarize the invoice",
+        status="pending",
+        conversation_uuid=fixture.conversation_uuid,
+        actions=[TaskAction(
+            uuid=fixture.action_uuid,
+            name="Summarize",
+            task_uuid=fixture.task_uuid,
+            tool_uuid="document_processor",
+            tool_action="summarize",
+            input_payload={"document_uuids": fixture.document_uuids[:1]},
+            output_documents=[create_document(f"Summary of the {fixture.query}",
+                                              {"conversation_uuid": fixture.conversation_uuid})],
+            step=1,
+            status="completed"
+        )]
+    ))
+    summary_uuid = str(load_tasks(fixture.conversation_uuid)[0].actions[0].output_documents[0].uuid)
+    cache_summary(fixture.cache_key, summary_uuid)
+    save_conversation_summary(ConversationSummary(
+        conversation_uuid=fixture.conversation_uuid,
+        summary="Earlier messages",
+        summarized_until=fixture.messages[1].created_at
+    ))
+    save_conversation_snapshot(ConversationSnapshot(
+        conversation_uuid=fixture.conversation_uuid,
+        messages=fixture.messages,
+        conversation_summary=find_conversation_summary(fixture.conversation_uuid),
+        tasks=load_tasks(fixture.conversation_uuid)
+    ))
+    EmbeddingModel.create(content_hash=hash_content(fixture.query), model=EMBEDDING_MODEL, vector=b"\0" * 16)
+
+
+def scenarios(fixture: Fixture) -> List[Tuple[str, Callable[[], object]]]:
+    """Repository calls to record, in order; later ones may depend on rows written by earlier ones"""
+    conversation_uuid = fixture.conversation_uuid
+    new_task_uuid = str(uuid.uuid4())
+
+    def new_task(status: str) -> Task:
+        return Task(
+            uuid=new_task_uuid,
+            name="Extract",
+            description="Extract the dates",
+            status=status,
+            conversation_uuid=conversation_uuid,
+            actions=[TaskAction(
+                uuid=str(uuid.uuid5(uuid.NAMESPACE_URL, new_task_uuid)),
+                name="Extract",
+                task_uuid=new_task_uuid,
+                tool_uuid="document_processor",
+                tool_action="extract",
+                input_payload={"document_uuids": fixture.document_uuids[:1]},
+                output_documents=[create_document(f"Dates in the {fixture.query} ({status})",
+                                                  {"conversation_uuid": conversation_uuid})],
+                step=1,
+                status=status
+            )]
+        )
+
+    def uncached(lookup: Callable[[], object]) -> Callable[[], object]:
+        # Document lookups are served from a per-process cache once seen
+        def call():
+            invalidate_cached_documents(fixture.document_uuids)
+            return lookup()
+        return call
+
+    return [
+        ("conversation.create_conversation_if_not_exists", lambda: create_conversation_if_not_exists(conversation_uuid)),
+        ("conversation.find_conversation_summary", lambda: find_conversation_summary(conversation_uuid)),
+        ("conversation.load_conversation_documents", lambda: load_conversation_documents(conversation_uuid)),
+        ("message.find_latest_messages", lambda: find_latest_messages(conversation_uuid, 3)),
+        ("message.find_messages_since", lambda: find_messages_since(conversation_uuid, fixture.messages[1].created_at)),
+        ("message.find_messages_page", lambda: find_messages_page(conversation_uuid, 2, 2)),
+        ("message.iterate_messages_by_conversation",
+         lambda: list(iterate_messages_by_conversation(conversation_uuid, batch_size=3))),
+        ("snapshots.load_conversation_snapshot", lambda: load_conversation_snapshot(conversation_uuid)),
+        ("document.find_document_by_uuid", uncached(lambda: find_document_by_uuid(fixture.document_uuids[0]))),
+        ("document.find_documents_by_uuids", uncached(lambda: find_documents_by_uuids(fixture.document_uuids))),
+        ("document.find_documents_by_conversation", lambda: find_documents_by_conversation(conversation_uuid)),
+        ("document.load_document_text", lambda: load_document_text(fixture.document_uuids[0])),
+        ("blobs.load_blob_text", lambda: [load_blob_text(content_hash) for content_hash in fixture.content_hashes]),
+        ("blobs.load_blob_texts", lambda: load_blob_texts(fixture.content_hashes)),
+        ("blobs.read_blob_slice", lambda: read_blob_slice(fixture.content_hashes[1], 0, 100)),
+        ("summaries.find_cached_summary", lambda: find_cached_summary(fixture.cache_key)),
+        ("tasks.load_tasks", lambda: load_tasks(conversation_uuid)),
+        ("tasks.find_tasks_by_uuids", lambda: find_tasks_by_uuids([fixture.task_uuid, new_task_uuid])),
+        ("tasks.save_task (new)", lambda: save_task(new_task("pending"))),
+        ("tasks.save_task (changed)", lambda: save_task(new_task("completed"))),
+        ("tasks.update_task_status", lambda: update_task_status(fixture.task_uuid, "done")),
+        ("tasks.update_task_action", lambda: update_task_action(fixture.task_uuid, fixture.action_uuid, {"status": "done"})),
+        ("search.search_documents", lambda: search_documents(fixture.query)),
+        ("search.search_documents (conversation)", lambda: search_documents(fixture.query, conversation_uuid)),
+        ("search.search_messages", lambda: search_messages(fixture.query)),
+        ("search.search_messages (conversation)", lambda: search_messages(fixture.query, conversation_uuid)),
+        ("vectors.get_embeddings", lambda: get_embeddings({hash_content(fixture.query): fixture.query})),
+        # Only the selection of pending chunks; embedding them needs the API
+        ("vectors.embed_pending_chunks", lambda: embed_pending_chunks(limit=0)),
+        ("retention.find_expired_conversations",
+         lambda: find_expired_conversations(datetime.utcnow() - timedelta(days=90))),
+        ("retention.find_cache_generation", find_cache_generation),
+        ("retention._has_activity_since",
+         lambda: _has_activity_since(conversation_uuid, datetime.utcnow() - timedelta(days=90))),
+        ("retention._export_conversation", lambda: _export_conversation(fixture.expired_conversation_uuid)),
+        ("retention._conversation_document_uuids",
+         lambda: _conversation_document_uuids(fixture.expired_conversation_uuid)),
+        ("retention._delete_conversation", lambda: _delete_conversation(fixture.expired_conversation_uuid)),
+        ("retention.delete_unreferenced_blobs", delete_unreferenced_blobs),
+        ("summaries.delete_orphaned_summaries", delete_orphaned_summaries),
+    ]
+
+
+@contextmanager
+def recording_statements() -> Iterator[List[Tuple[str, tuple]]]:
+    """Record the SQL and parameters of every statement the calling thread executes on the shared database"""
+    statements = []
+    thread_id = threading.get_ident()
+    execute_sql = db.execute_sql
+
+    def record(sql, params=None, *args, **kwargs):
+        # Background threads (e.g. the vector indexer) are left out
+        if threading.get_ident() == thread_id:
+            statements.append((sql, tuple(params or ())))
+        return execute_sql(sql, params, *args, **kwargs)
+
+    db.execute_sql = record
+    try:
+        yield statements
+    finally:
+        del db.execute_sql
+
+
+def repository_queries(fixture: Fixture) -> Dict[str, Tuple[str, tuple]]:
+    """Distinct queries issued by each scenario, named "<scenario> #<n>" in execution order"""
+    queries = {}
+    for name, call in scenarios(fixture):
+        with recording_statements() as statements:
+            call()
+        distinct = []
+        for sql, params in statements:
+            if sql.lstrip().upper().startswith(EXPLAINED_STATEMENTS) and sql not in (seen for seen, _ in distinct):
+                distinct.append((sql, params))
+        if not distinct:
+            raise RuntimeError(f"{name} did not execute any query, the fixture no longer exercises it")
+        for index, statement in enumerate(distinct, 1):
+            queries[f"{name} #{index}"] = statement
+    return queries
+
+
+def explain_query_plan(sql: str, params: tuple = ()) -> List[str]:
+    """Return the EXPLAIN QUERY PLAN detail lines of a SQL statement"""
+    return [row[-1] for row in db.execute_sql(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+
+
+def find_full_scans(queries: Dict[str, Tuple[str, tuple]]) -> Dict[str, List[str]]:
+    """Map of query name to SQL and plan lines for every query planned as an unexpected full table scan"""
+    full_scans = {}
+    for name, (sql, params) in queries.items():
+        if name.rsplit(" #", 1)[0] in EXPECTED_FULL_SCANS:
+            continue
+        plan = explain_query_plan(sql, params)
+        if any(FULL_SCAN_PATTERN.search(line) for line in plan):
+            full_scans[name] = [" ".join(sql.split())] + plan
+    return full_scans
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "query_plan.db")
+        if len(sys.argv) > 1:
+            # The fixture is written to a copy, never to the given database
+            with sqlite3.connect(sys.argv[1]) as source, sqlite3.connect(path) as target:
+                source.backup(target)
+        configure_database(path)
+        run_migrations()
+
+        fixture = Fixture()
+        seed(fixture)
+        queries = repository_queries(fixture)
+        full_scans = find_full_scans(queries)
+        for name, lines in full_scans.items():
+            print(f"FULL SCAN {name}:\n  " + "\n  ".join(lines))
+        print(f"{len(queries) - len(full_scans)}/{len(queries)} queries use an index")
+        db.close()
+    return 1 if full_scans else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+"""Retention and compaction of old conversations
+
+Conversations whose newest message (or creation, when they have none) is older than the retention
+age are written to a gzip-compressed JSON lines archive (one line per conversation, rows grouped by
+table, document texts included; state snapshots are left out as they are rebuilt from the other
+rows) and then deleted. Rows are removed a few conversations per transaction so the live writer
+thread is only ever blocked briefly; each of these transactions also bumps the cache generation, which
+tells the running bot to drop its in-memory caches. Afterwards unreferenced document bodies and
+summary cache entries are dropped, free pages are released with an incremental vacuum and the query
+planner statistics are refreshed.
+
+Run from the repository root, e.g. nightly:
+    python -m db.retention --days 90
+"""
+import argparse
+import gzip
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+import orjson
+from peewee import SQL, fn
+
+from logger.logger import log_info
+from . import db
+from .blobs import blob_store_directory, load_blob_text
+from .document import invalidate_cached_documents
+from .search import rebuild_index, unindex_documents
+from .summaries import delete_orphaned_summaries
+from .models import (
+    CacheGenerationModel, ConversationModel, ConversationDocumentModel, ConversationSummaryModel,
+    ConversationSnapshotModel, MessageModel, DocumentBlobModel, DocumentModel, TaskModel, TaskActionModel,
+    TaskActionDocumentModel
+)
+
+RETENTION_DAYS = int(os.getenv("CONVERSATION_RETENTION_DAYS", "90"))
+CONVERSATIONS_PER_TRANSACTION = 10
+VACUUM_PAGES_PER_STEP = 1000
+# Files written or reused more recently than this are never swept, see blobs._write_blob_file
+BLOB_FILE_GRACE_SECONDS = 15 * 60
+
+
+def find_expired_conversations(cutoff: datetime) -> List[str]:
+    """
+    Find conversations without any message at or after the cutoff
+
+    A conversation without messages is measured from its creation; messages of conversations that
+    have no conversations row are covered as well.
+
+    Args:
+        cutoff: Oldest activity time that is still retained
+
+    Returns:
+        Conversation UUIDs, least recently active first
+    """
+    newest_message = (MessageModel
+                      .select(fn.MAX(MessageModel.created_at))
+                      .where(MessageModel.conversation_uuid == ConversationModel.uuid))
+    conversation_activity = fn.COALESCE(newest_message, ConversationModel.created_at)
+    conversations = (ConversationModel
+                     .select(ConversationModel.uuid.alias('conversation_uuid'),
+                             conversation_activity.alias('last_activity'))
+                     .where(conversation_activity < cutoff))
+
+    message_activity = fn.MAX(MessageModel.created_at)
+    without_row = (MessageModel
+                   .select(MessageModel.conversation_uuid, message_activity.alias('last_activity'))
+                   .where(MessageModel.conversation_uuid.not_in(ConversationModel.select(ConversationModel.uuid)))
+                   .group_by(MessageModel.conversation_uuid)
+                   .having(message_activity < cutoff))
+
+    query = (conversations + without_row).order_by(SQL('last_activity'))
+    return [row.conversation_uuid for row in query.objects()]
+
+
+def archive_and_delete_conversations(conversation_uuids: List[str], cutoff: datetime, archive_path: str) -> Dict[str, int]:
+    """
+    Append conversations to the archive, then delete their rows in small transactions
+
+    A batch is only deleted after its archive lines are on disk. A conversation that received a
+    message after it was selected is skipped.
+
+    Args:
+        conversation_uuids: Conversations to remove
+        cutoff: Retention cutoff, re-checked inside each transaction
+        archive_path: gzip JSON lines file, appended to if it exists
+
+    Returns:
+        Number of archived conversations and deleted rows
+    """
+    from agent.state_cache import invalidate_cached_state
+
+    stats = {'conversations': 0, 'rows': 0}
+    os.makedirs(os.path.dirname(os.path.abspath(archive_path)), exist_ok=True)
+    with open(archive_path, 'ab') as raw_archive, gzip.GzipFile(fileobj=raw_archive, mode='ab') as archive:
+        for start in range(0, len(conversation_uuids), CONVERSATIONS_PER_TRANSACTION):
+            batch = conversation_uuids[start:start + CONVERSATIONS_PER_TRANSACTION]
+            with db.atomic(lock_type='IMMEDIATE'):
+                expired = [uuid for uuid in batch if not _has_activity_since(uuid, cutoff)]
+                for conversation_uuid in expired:
+                    archive.write(orjson.dumps(_export_conversation(conversation_uuid)) + b'\n')
+                archive.flush()
+                raw_archive.flush()
+                os.fsync(raw_archive.fileno())
+
+                deleted_documents = []
+                for conversation_uuid in expired:
+                    deleted_documents += _conversation_document_uuids(conversation_uuid)
+                    stats['rows'] += _delete_conversation(conversation_uuid)
+                stats['conversations'] += len(expired)
+                if expired:
+                    _bump_cache_generation()
+
+            # Only reaches the caches of this process; the bot picks up the new generation instead
+            for conversation_uuid in expired:
+                invalidate_cached_state(conversation_uuid)
+            invalidate_cached_documents(deleted_documents)
+
+    return stats
+
+
+def delete_unreferenced_blobs() -> int:
+    """
+    Drop document bodies no document points at any more, and sweep orphaned blob files
+
+    Returns:
+        Bytes of blob files removed from disk
+    """
+    referenced = DocumentModel.select(DocumentModel.content_hash).where(DocumentModel.content_hash.is_null(False))
+    with db.atomic(lock_type='IMMEDIATE'):
+        DocumentBlobModel.delete().where(DocumentBlobModel.content_hash.not_in(referenced)).execute()
+
+    directory = blob_store_directory()
+    if not os.path.isdir(directory):
+        return 0
+
+    removed_bytes = 0
+    grace_cutoff = time.time() - BLOB_FILE_GRACE_SECONDS
+    for prefix in os.scandir(directory):
+        if not prefix.is_dir():
+            continue
+        entries = {entry.name: entry for entry in os.scandir(prefix.path) if entry.is_file()}
+        stored = {row.content_hash for row in DocumentBlobModel
+                  .select(DocumentBlobModel.content_hash)
+                  .where(DocumentBlobModel.content_hash.in_(list(entries)))}
+        for name, entry in entries.items():
+            stat = entry.stat()
+            # Temporary files of interrupted writes are swept as well once they are old enough
+            if name not in stored and stat.st_mtime < grace_cutoff:
+                os.remove(entry.path)
+                removed_bytes += stat.st_size
+
+    return removed_bytes
+
+
+def compact_database(full_vacuum: bool = False) -> None:
+    """
+    Return free pages to the file system and refresh planner statistics
+
+    Databases created before incremental auto-vacuum was configured only reuse free pages
+    internally until a one-off full VACUUM converts them; that rewrite blocks writers for its
+    duration, so it only runs when asked for.
+
+    Args:
+        full_vacuum: Rewrite the whole file with VACUUM instead of releasing pages incrementally
+    """
+    db.execute_sql("PRAGMA wal_checkpoint(PASSIVE)")
+    if full_vacuum:
+        db.execute_sql("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute_sql("VACUUM")
+        # VACUUM may renumber implicit rowids, which the full-text indexes are keyed by
+        with db.atomic():
+            rebuild_index()
+    elif db.execute_sql("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        # Small steps, so each one holds the write lock only briefly
+        while db.execute_sql("PRAGMA freelist_count").fetchone()[0]:
+            db.execute_sql(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})").fetchall()
+    else:
+        log_info("Incremental vacuum is not enabled for this database; run once with --vacuum to convert it")
+
+    db.execute_sql("PRAGMA analysis_limit = 1000")
+    db.execute_sql("ANALYZE")
+    db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def run_retention(days: int = RETENTION_DAYS, archive_path: str = None, full_vacuum: bool = False) -> Dict[str, Any]:
+    """
+    Archive and delete conversations older than the retention age and compact the database
+
+    Args:
+        days: Retention age in days, measured from a conversation's newest message or its creation
+        archive_path: Archive file, defaults to a dated file next to the database
+        full_vacuum: Run a full VACUUM instead of an incremental one
+
+    Returns:
+        Archived conversations, deleted rows, archive path and reclaimed bytes
+    """
+    started = time.perf_counter()
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    archive_path = archive_path or f"{db.database}.archive/{datetime.utcnow():%Y%m%d-%H%M%S}.jsonl.gz"
+    size_before = _database_bytes()
+
+    expired = find_expired_conversations(cutoff)
+    stats = archive_and_delete_conversations(expired, cutoff, archive_path) if expired else {'conversations': 0, 'rows': 0}
+    blob_file_bytes = delete_unreferenced_blobs()
+    with db.atomic(lock_type='IMMEDIATE'):
+        delete_orphaned_summaries()
+    compact_database(full_vacuum)
+
+    report = {
+        **stats,
+        'archive_path': archive_path if expired else None,
+        'reclaimed_bytes': size_before - _database_bytes() + blob_file_bytes,
+        'duration_ms': (time.perf_counter() - started) * 1000,
+    }
+    log_info(
+        f"🧹 Archived {report['conversations']} conversation(s) older than {days} days, deleted {report['rows']} rows, "
+        f"reclaimed {report['reclaimed_bytes'] / (1024 * 1024):.1f} MB in {report['duration_ms']:.0f} ms"
+    )
+    return report
+
+
+def find_cache_generation() -> int:
+    """Number of retention transactions that deleted conversations so far, see agent.state_cache"""
+    row = CacheGenerationModel.get_or_none(CacheGenerationModel.id == 1)
+    return row.generation if row else 0
+
+
+def _bump_cache_generation() -> None:
+    now = datetime.utcnow()
+    (CacheGenerationModel
+     .insert(id=1, generation=1, updated_at=now)
+     .on_conflict(
+         conflict_target=[CacheGenerationModel.id],
+         update={CacheGenerationModel.generation: CacheGenerationModel.generation + 1,
+                 CacheGenerationModel.updated_at: now})
+     .execute())
+
+
+def _database_bytes() -> int:
+    page_count = db.execute_sql("PRAGMA page_count").fetchone()[0]
+    page_size = db.execute_sql("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def _has_activity_since(conversation_uuid: str, cutoff: datetime) -> bool:
+    return (MessageModel
+            .select()
+            .where((MessageModel.conversation_uuid == conversation_uuid) & (MessageModel.created_at >= cutoff))
+            .exists())
+
+
+def _conversation_queries(conversation_uuid: str) -> Dict[str, Any]:
+    """Row selections of a conversation per table, in foreign key order (referencing tables last)"""
+    tasks = TaskModel.select(TaskModel.uuid).where(TaskModel.conversation_uuid == conversation_uuid)
+    actions = TaskActionModel.select(TaskActionModel.uuid).where(TaskActionModel.task.in_(tasks))
+    owned = DocumentModel.select(DocumentModel.uuid).where(DocumentModel.conversation_uuid == conversation_uuid)
+    # Cached summaries can be linked from other conversations' actions; those documents are kept
+    shared = (TaskActionDocumentModel
+              .select(TaskActionDocumentModel.document)
+              .where(TaskActionDocumentModel.document.in_(owned) & TaskActionDocumentModel.task_action.not_in(actions)))
+    documents = owned.where(DocumentModel.uuid.not_in(shared))
+    return {
+        ConversationModel: ConversationModel.uuid == conversation_uuid,
+        ConversationSummaryModel: ConversationSummaryModel.conversation_uuid == conversation_uuid,
+        ConversationSnapshotModel: ConversationSnapshotModel.conversation_uuid == conversation_uuid,
+        MessageModel: MessageModel.conversation_uuid == conversation_uuid,
+        DocumentModel: DocumentModel.uuid.in_(documents),
+        ConversationDocumentModel: ((ConversationDocumentModel.conversation_uuid == conversation_uuid) |
+                                    ConversationDocumentModel.document.in_(documents)),
+        TaskModel: TaskModel.conversation_uuid == conversation_uuid,
+        TaskActionModel: TaskActionModel.task.in_(tasks),
+        TaskActionDocumentModel: TaskActionDocumentModel.task_action.in_(actions),
+    }
+
+
+def _export_conversation(conversation_uuid: str) -> Dict[str, Any]:
+    """All rows of a conversation keyed by table name, with document bodies inlined"""
+    export = {'conversation_uuid': conversation_uuid, 'archived_at': datetime.utcnow()}
+    for model, condition in _conversation_queries(conversation_uuid).items():
+        # A snapshot only duplicates the other rows in binary form and is rebuilt from them
+        if model is ConversationSnapshotModel:
+            continue
+        rows = list(model.select().where(condition).dicts())
+        if model is DocumentModel:
+            for row in rows:
+                row['text'] = load_blob_text(row['content_hash']) if row['content_hash'] else row['text']
+        export[model._meta.table_name] = rows
+    return export
+
+
+def _conversation_document_uuids(conversation_uuid: str) -> List[str]:
+    condition = _conversation_queries(conversation_uuid)[DocumentModel]
+    return [row.uuid for row in DocumentModel.select(DocumentModel.uuid).where(condition)]
+
+
+def _delete_conversation(conversation_uuid: str) -> int:
+    unindex_documents(_conversation_document_uuids(conversation_uuid))
+    deleted = 0
+    for model, condition in reversed(_conversation_queries(conversation_uuid).items()):
+        deleted += model.delete().where(condition).execute()
+    return deleted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive and delete old conversations, then compact the database")
+    parser.add_argument("--days", type=int, default=RETENTION_DAYS, help="retention age in days")
+    parser.add_argument("--archive", help="archive file (gzip JSON lines), appended to if it exists")
+    parser.add_argument("--vacuum", action="store_true", help="one-off full VACUUM, enables incremental vacuum")
+    arguments = parser.parse_args()
+
+    result = run_retention(arguments.days, arguments.archive, arguments.vacuum)
+    print(f"{result['conversations']} conversations archived to {result['archive_path']}, "
+          f"{result['rows']} rows deleted, {result['reclaimed_bytes'] / (1024 * 1024):.1f} MB reclaimed")
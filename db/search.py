@@ -0,0 +1,269 @@
+"""SQLite FTS5 full-text index over documents and messages
+
+messages_fts is an external-content index over the messages table and is kept in sync by triggers.
+Document bodies live compressed and deduplicated in document_blobs or the blob file store, where
+triggers cannot read them, so documents_fts is contentless: it holds only the token index, written by
+the document repositories next to every new document row. A contentless entry can only be removed
+with the values it was indexed with, so unindex_documents reads them back before retention deletes
+the document rows, and document snippets are cut from the stored body. Both indexes share the rowid
+of the row they index.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from models.search import SearchHit
+from . import db
+
+DOCUMENTS_FTS_SQL = """CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts
+       USING fts5(name, text, content = '', tokenize = 'porter unicode61')"""
+
+FTS_TABLES_SQL = [
+    DOCUMENTS_FTS_SQL,
+    """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+       USING fts5(content, content = 'messages', content_rowid = 'rowid', tokenize = 'porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+           INSERT INTO messages_fts(rowid, content) VALUES (new.rowid, new.content);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+           INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+           INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+           INSERT INTO messages_fts(rowid, content) VALUES (new.rowid, new.content);
+       END""",
+]
+
+SNIPPET_TOKENS = 24
+
+
+def index_documents(documents: List[Tuple[str, str, str]]) -> None:
+    """
+    Add documents to the full-text index, skipping ones that are already indexed
+
+    Must run after the document rows were inserted, in the same transaction.
+
+    Args:
+        documents: (document uuid, name, text) tuples
+    """
+    for document_uuid, name, text in documents:
+        db.execute_sql(
+            """INSERT INTO documents_fts(rowid, name, text)
+               SELECT d.rowid, ?, ? FROM documents d
+               WHERE d.uuid = ? AND NOT EXISTS (SELECT 1 FROM documents_fts f WHERE f.rowid = d.rowid)""",
+            (name or "", text, document_uuid)
+        )
+
+
+def unindex_documents(document_uuids: List[str]) -> None:
+    """
+    Remove documents from the full-text index
+
+    Must run before the document rows are deleted, in the same transaction. Documents that are not
+    indexed are skipped.
+
+    Args:
+        document_uuids: UUIDs of the documents about to be deleted
+    """
+    from .models import DocumentModel
+
+    if not document_uuids:
+        return
+    placeholders = ", ".join("?" * len(document_uuids))
+    rowids = dict(db.execute_sql(
+        f"""SELECT d.uuid, d.rowid FROM documents d
+            WHERE d.uuid IN ({placeholders}) AND EXISTS (SELECT 1 FROM documents_fts f WHERE f.rowid = d.rowid)""",
+        list(document_uuids)
+    ).fetchall())
+    if not rowids:
+        return
+    documents = list(DocumentModel
+                     .select(DocumentModel.uuid, DocumentModel.text, DocumentModel.content_hash, DocumentModel.metadata)
+                     .where(DocumentModel.uuid.in_(list(rowids))))
+    texts = _document_texts(documents)
+    for document in documents:
+        db.execute_sql(
+            "INSERT INTO documents_fts(documents_fts, rowid, name, text) VALUES ('delete', ?, ?, ?)",
+            (rowids[document.uuid], document.metadata.get('name', '') or "", texts[document.uuid])
+        )
+
+
+def search_documents(query: str, conversation_uuid: Optional[str] = None, limit: int = 10) -> List[SearchHit]:
+    """
+    Rank stored documents against a free-text query
+
+    Args:
+        query: Free-text query; any word matches, documents matching more of them rank higher
+        conversation_uuid: Only search this conversation's documents
+        limit: Maximum number of hits
+
+    Returns:
+        Hits ordered by relevance, best first
+    """
+    match = to_match_expression(query)
+    if not match:
+        return []
+
+    from .models import DocumentModel
+
+    sql = """SELECT d.uuid, bm25(documents_fts, 5.0, 1.0)
+             FROM documents_fts JOIN documents d ON d.rowid = documents_fts.rowid
+             WHERE documents_fts MATCH ?"""
+    params = [match]
+    if conversation_uuid:
+        sql += " AND d.conversation_uuid = ?"
+        params.append(conversation_uuid)
+    sql += " ORDER BY 2 LIMIT ?"
+    params.append(limit)
+    ranked = db.execute_sql(sql, params).fetchall()
+    if not ranked:
+        return []
+
+    # The index keeps no text, so names and snippets come from the document rows and their bodies
+    documents = {document.uuid: document for document in DocumentModel
+                 .select(DocumentModel.uuid, DocumentModel.conversation_uuid, DocumentModel.text,
+                         DocumentModel.content_hash, DocumentModel.metadata)
+                 .where(DocumentModel.uuid.in_([uuid for uuid, _ in ranked]))}
+    texts = _document_texts(list(documents.values()))
+    words = list(dict.fromkeys(re.findall(r"\w+", query.lower())))
+    return [
+        SearchHit(source="document", uuid=uuid, conversation_uuid=documents[uuid].conversation_uuid,
+                  name=documents[uuid].metadata.get('name', '') or "",
+                  snippet=make_snippet(texts[uuid], words), score=-rank)
+        for uuid, rank in ranked
+    ]
+
+
+def search_messages(query: str, conversation_uuid: Optional[str] = None, limit: int = 10) -> List[SearchHit]:
+    """
+    Rank stored messages against a free-text query
+
+    Args:
+        query: Free-text query; any word matches, messages matching more of them rank higher
+        conversation_uuid: Only search this conversation's messages
+        limit: Maximum number of hits
+
+    Returns:
+        Hits ordered by relevance, best first
+    """
+    match = to_match_expression(query)
+    if not match:
+        return []
+
+    sql = f"""SELECT m.uuid, m.conversation_uuid, m.role,
+                     snippet(messages_fts, 0, '**', '**', '…', {SNIPPET_TOKENS}),
+                     bm25(messages_fts)
+              FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid
+              WHERE messages_fts MATCH ?"""
+    params = [match]
+    if conversation_uuid:
+        sql += " AND m.conversation_uuid = ?"
+        params.append(conversation_uuid)
+    sql += " ORDER BY 5 LIMIT ?"
+    params.append(limit)
+
+    return [
+        SearchHit(source="message", uuid=uuid, conversation_uuid=conversation, name=role,
+                  snippet=snippet, score=-rank)
+        for uuid, conversation, role, snippet, rank in db.execute_sql(sql, params).fetchall()
+    ]
+
+
+def make_snippet(text: str, words: List[str], tokens: int = SNIPPET_TOKENS) -> str:
+    """
+    Excerpt of about tokens words around the densest run of query words, matches wrapped in ** **
+
+    Stands in for the FTS5 snippet() of a contentless index. A word matches when it starts with a query
+    word, ignoring plural and common verb endings, which approximates the porter stemmer of the index.
+
+    Args:
+        text: Document body
+        words: Lowercased query words
+        tokens: Approximate length of the excerpt in words
+
+    Returns:
+        Excerpt with '…' where the text was cut
+    """
+    stems = sorted({_stem(word) for word in words}, key=len, reverse=True)
+    pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, stems)) + r")\w*", re.IGNORECASE) if stems else None
+    matches = list(pattern.finditer(text)) if pattern else []
+
+    span_chars = tokens * 6  # about the length of tokens English words with their spaces
+    if matches:
+        # Start at the match followed by the most distinct query words within one excerpt
+        best, best_score = 0, -1
+        for index, match in enumerate(matches):
+            window = [m for m in matches[index:index + tokens] if m.start() - match.start() < span_chars]
+            score = len({m.group().lower() for m in window}) * tokens + len(window)
+            if score > best_score:
+                best, best_score = index, score
+        start = max(0, matches[best].start() - span_chars // 8)
+    else:
+        start = 0
+
+    words_in_text = list(re.finditer(r"\S+", text[start:start + span_chars * 2]))
+    if not words_in_text:
+        return ""
+    if start > 0 and not text[start - 1].isspace():
+        words_in_text = words_in_text[1:] or words_in_text  # drop the word cut by the start offset
+    excerpt_words = words_in_text[:tokens]
+    excerpt_start = start + excerpt_words[0].start()
+    excerpt_end = start + excerpt_words[-1].end()
+    excerpt = " ".join(text[excerpt_start:excerpt_end].split())
+    if pattern:
+        excerpt = pattern.sub(lambda match: f"**{match.group()}**", excerpt)
+    return ("…" if excerpt_start > 0 else "") + excerpt + ("…" if text[excerpt_end:].strip() else "")
+
+
+def to_match_expression(query: str) -> str:
+    """Turn free text into an FTS5 expression: each word quoted (so punctuation is never syntax), OR-ed"""
+    words = re.findall(r"\w+", query.lower())
+    return " OR ".join(f'"{word}"' for word in dict.fromkeys(words))
+
+
+def rebuild_index() -> None:
+    """Re-create both indexes from the stored messages and document bodies"""
+    db.execute_sql("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+    rebuild_document_index()
+
+
+def rebuild_document_index() -> None:
+    """Re-create the document index from the stored document bodies"""
+    from .models import DocumentModel
+
+    db.execute_sql("INSERT INTO documents_fts(documents_fts) VALUES ('delete-all')")
+    last_uuid = ""
+    while True:
+        batch = list(DocumentModel
+                     .select(DocumentModel.uuid, DocumentModel.text, DocumentModel.content_hash, DocumentModel.metadata)
+                     .where(DocumentModel.uuid > last_uuid)
+                     .order_by(DocumentModel.uuid)
+                     .limit(200))
+        if not batch:
+            return
+        texts = _document_texts(batch)
+        index_documents([
+            (document.uuid, document.metadata.get('name', ''), texts[document.uuid]) for document in batch
+        ])
+        last_uuid = batch[-1].uuid
+
+
+def _document_texts(documents) -> Dict[str, str]:
+    """Indexed text of document rows by uuid: the blob body, or the inline text of legacy rows"""
+    from .blobs import load_blob_texts
+
+    blobs = load_blob_texts([document.content_hash for document in documents if document.content_hash])
+    return {
+        document.uuid: blobs.get(document.content_hash, "") if document.content_hash else document.text
+        for document in documents
+    }
+
+
+def _stem(word: str) -> str:
+    stem = re.sub(r"(?:ies|es|s|ing|ed)$", "", word)
+    return stem if len(stem) >= 3 else word
+
+
+if __name__ == "__main__":
+    with db.atomic():
+        rebuild_index()
+    print("Full-text index rebuilt")
@@ -0,0 +1,120 @@
+"""Single-row snapshots of a conversation's state for restore without joining five tables
+
+The normalized tables stay the source of truth. A snapshot is written after each run and is only
+trusted while the newest stored message is still the one it recorded.
+"""
+import os
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+import orjson
+
+from models.document import LazyDocument
+from models.message import ConversationSummary, Message
+from models.state import ConversationSnapshot, Task, TaskAction
+from .document import load_document_text
+from .message import find_latest_messages
+from .models import ConversationSnapshotModel
+
+SNAPSHOTS_ENABLED = os.getenv("CONVERSATION_SNAPSHOTS", "1") == "1"
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def save_conversation_snapshot(snapshot: ConversationSnapshot) -> None:
+    """
+    Serialize a conversation into one compressed blob, replacing the previous snapshot
+
+    Document texts are not included; restored documents load them lazily.
+
+    Args:
+        snapshot: Messages, summary and tasks of the conversation
+    """
+    payload = {
+        "messages": [message.model_dump() for message in snapshot.messages],
+        "conversation_summary": snapshot.conversation_summary.model_dump() if snapshot.conversation_summary else None,
+        "tasks": [_task_payload(task) for task in snapshot.tasks],
+    }
+
+    ConversationSnapshotModel.replace(
+        conversation_uuid=snapshot.conversation_uuid,
+        format_version=SNAPSHOT_FORMAT_VERSION,
+        last_message_uuid=snapshot.messages[-1].uuid if snapshot.messages else None,
+        payload=zlib.compress(orjson.dumps(payload), 6),
+        created_at=datetime.utcnow()
+    ).execute()
+
+
+def load_conversation_snapshot(conversation_uuid: str) -> Optional[ConversationSnapshot]:
+    """
+    Restore a conversation from its snapshot
+
+    Args:
+        conversation_uuid: Conversation UUID
+
+    Returns:
+        The snapshot, or None when there is none, its format is outdated, or newer messages exist
+    """
+    row = ConversationSnapshotModel.get_or_none(ConversationSnapshotModel.conversation_uuid == conversation_uuid)
+    if row is None or row.format_version != SNAPSHOT_FORMAT_VERSION:
+        return None
+
+    latest_messages = find_latest_messages(conversation_uuid, 1)
+    latest_message_uuid = latest_messages[0].uuid if latest_messages else None
+    if latest_message_uuid != row.last_message_uuid:
+        return None
+
+    payload = orjson.loads(zlib.decompress(row.payload))
+    summary = payload["conversation_summary"]
+    return ConversationSnapshot(
+        conversation_uuid=conversation_uuid,
+        messages=[Message(**message) for message in payload["messages"]],
+        conversation_summary=ConversationSummary(**summary) if summary else None,
+        tasks=[_task_from_payload(task) for task in payload["tasks"]],
+    )
+
+
+def delete_conversation_snapshot(conversation_uuid: str) -> None:
+    """Remove the snapshot of a conversation"""
+    ConversationSnapshotModel.delete().where(
+        ConversationSnapshotModel.conversation_uuid == conversation_uuid
+    ).execute()
+
+
+def _task_payload(task: Task) -> Dict[str, Any]:
+    return {
+        **task.model_dump(exclude={"actions"}),
+        "actions": [
+            {
+                **action.model_dump(exclude={"output_documents"}),
+                # Metadata only: reading .text here would load lazy documents
+                "output_documents": [
+                    {
+                        "uuid": str(document.uuid),
+                        "conversation_uuid": document.conversation_uuid,
+                        "metadata": document.metadata,
+                    } for document in action.output_documents
+                ],
+            } for action in task.actions
+        ],
+    }
+
+
+def _task_from_payload(payload: Dict[str, Any]) -> Task:
+    actions = []
+    for action in payload["actions"]:
+        documents = []
+        for document in action["output_documents"]:
+            metadata = document["metadata"]
+            if parent_uuid := metadata.get("parent_document_uuid"):
+                metadata["parent_document_uuid"] = UUID(parent_uuid)
+            documents.append(LazyDocument(
+                uuid=UUID(document["uuid"]),
+                conversation_uuid=document["conversation_uuid"],
+                metadata=metadata,
+                load_text=lambda document_uuid=document["uuid"]: load_document_text(document_uuid)
+            ))
+        actions.append(TaskAction(**{**action, "output_documents": documents}))
+
+    return Task(**{**payload, "actions": actions})
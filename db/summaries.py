@@ -0,0 +1,69 @@
+"""Cache of summarize results keyed by what they were computed from
+
+An entry maps the content hashes of the source documents, in order, together with the version of
+the summarize prompt to the document holding the summary. Repeating a summarize action over the
+same texts, in any conversation, links that document again instead of running the LLM pipeline.
+"""
+import hashlib
+from datetime import datetime
+from typing import List, Optional
+
+from models.document import Document
+from .document import find_document_by_uuid
+from .models import DocumentModel, SummaryCacheModel
+
+
+def summary_cache_key(content_hashes: List[str], prompt_version: Optional[int]) -> str:
+    """
+    Derive the cache key of a summary
+
+    Args:
+        content_hashes: sha256 hashes of the restored source texts (URLs and images in place), in the order they are summarized
+        prompt_version: Version of the summarize prompt
+
+    Returns:
+        sha256 hex digest identifying the inputs
+    """
+    return hashlib.sha256(f"{prompt_version}:{','.join(content_hashes)}".encode("utf-8")).hexdigest()
+
+
+def find_cached_summary(cache_key: str) -> Optional[Document]:
+    """
+    Look up the summary document computed from the same inputs
+
+    Args:
+        cache_key: Key from summary_cache_key
+
+    Returns:
+        The summary document, or None when there is no entry or its document no longer exists
+    """
+    row = SummaryCacheModel.get_or_none(SummaryCacheModel.cache_key == cache_key)
+    if row is None:
+        return None
+    return find_document_by_uuid(row.document_uuid)
+
+
+def cache_summary(cache_key: str, document_uuid: str) -> None:
+    """
+    Remember the summary document of a set of inputs, replacing an earlier entry
+
+    Args:
+        cache_key: Key from summary_cache_key
+        document_uuid: UUID of the summary document
+    """
+    SummaryCacheModel.replace(
+        cache_key=cache_key,
+        document_uuid=str(document_uuid),
+        created_at=datetime.utcnow()
+    ).execute()
+
+
+def delete_orphaned_summaries() -> int:
+    """
+    Drop entries whose summary document was deleted
+
+    Returns:
+        Number of entries removed
+    """
+    documents = DocumentModel.select(DocumentModel.uuid)
+    return SummaryCacheModel.delete().where(SummaryCacheModel.document_uuid.not_in(documents)).execute()
@@ -1,177 +1,304 @@
-from typing import List, Optional, Dict, Any
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Dict, Any, Set
+
+from peewee import prefetch
 
 from agent.state import Task, TaskAction
 from models.document import Document
+from .blobs import store_blobs
+from .search import index_documents
+from .vectors import add_document_chunks
+from .document import to_lazy_document
 from .models import TaskModel, TaskActionModel, TaskActionDocumentModel, DocumentModel
-from . import connection
+from . import connection, db
+from .writer import register_rollback_handler
 
-def save_task(task: Task) -> None:
-    """Save or update a task and its actions"""
-    with connection():
-        # Save/update task
-        task_model, created = TaskModel.get_or_create(
-            uuid=task.uuid,
-            defaults={
-                'conversation_uuid': task.conversation_uuid,
-                'name': task.name,
-                'description': task.description,
-                'status': task.status
-            }
-        )
-        
-        if not created:
-            # Update existing task
-            task_model.name = task.name
-            task_model.description = task.description
-            task_model.status = task.status
-            task_model.save()
-
-        # Handle actions
-        existing_actions = {action.uuid: action for action in TaskActionModel.select().where(TaskActionModel.task == task_model)}
-        
+# Column values last written (or loaded) per task and action uuid. save_task diffs against
+# these snapshots so only rows that actually changed are sent to SQLite. They are kept for the
+# most recently saved or loaded conversations only; a task without a snapshot is reloaded.
+# Rows deleted by another process (retention) are signalled through the cache generation, on
+# which agent.state_cache.drop_caches_if_outdated clears all snapshots.
+PERSISTED_CONVERSATIONS_MAX = int(os.getenv("PERSISTED_CONVERSATIONS_MAX", "256"))
+
+_persisted_tasks: Dict[str, Dict[str, Any]] = {}
+_persisted_actions: Dict[str, Dict[str, Any]] = {}
+_persisted_task_actions: Dict[str, Set[str]] = {}
+_persisted_action_documents: Dict[str, Set[str]] = {}
+_persisted_conversation_tasks: "OrderedDict[str, Set[str]]" = OrderedDict()
+_persisted_lock = threading.RLock()
+
+_persistence_metrics = {"saves": 0, "rows_written": 0, "rows_skipped": 0, "step_rows_written": 0}
+
+def save_task(task: Task) -> int:
+    """Persist only the dirty rows of a task and its actions in a single transaction
+
+    Returns:
+        Number of rows written
+    """
+    with _persisted_lock:
+        if task.uuid not in _persisted_tasks:
+            _remember_tasks(_build_tasks(TaskModel.select().where(TaskModel.uuid == task.uuid)))
+
+        task_row = _task_row(task)
+        task_dirty = _persisted_tasks.get(task.uuid) != task_row
+
+        dirty_action_rows = []
+        document_rows = []
+        link_rows = []
+        action_documents = {}
+        stale_links = []
         for action in task.actions:
-            if action.uuid in existing_actions:
-                # Update existing actionw
-                action_model = existing_actions[action.uuid]
-                action_model.name = action.name
-                action_model.tool_uuid = action.tool_uuid
-                action_model.tool_action = action.tool_action
-                action_model.input_payload = action.input_payload
-                action_model.step = action.step
-                action_model.status = action.status
-                action_model.save()
-                
-                # Remove from existing_actions dict to track which ones to delete
-                del existing_actions[action.uuid]
-            else:
-                # Create new action
-                action_model = TaskActionModel.create(
-                    uuid=action.uuid,
-                    task=task_model,
-                    name=action.name,
-                    tool_uuid=action.tool_uuid,
-                    tool_action=action.tool_action,
-                    input_payload=action.input_payload,
-                    step=action.step,
-                    status=action.status
-                )
-            
-            # Handle output documents
-            if action.output_documents:
-                # Get existing document associations
-                existing_docs = {
-                    doc.document.uuid: doc for doc in 
-                    TaskActionDocumentModel.select().where(TaskActionDocumentModel.task_action == action_model)
-                }
-                
-                # Track which documents we've processed
-                processed_docs = set()
-                
-                for document in action.output_documents:
-                    doc_uuid = str(document.uuid)
-                    processed_docs.add(doc_uuid)
-                    
-                    if doc_uuid not in existing_docs:
-                        # Prepare metadata by converting enums to strings
-                        metadata = document.metadata.copy()
-                        if metadata.get('type'):
-                            metadata['type'] = metadata['type'].value if hasattr(metadata['type'], 'value') else str(metadata['type'])
-                        
-                        # Create new document if it doesn't exist
-                        doc_model, _ = DocumentModel.get_or_create(
-                            uuid=doc_uuid,
-                            defaults={
-                                'conversation_uuid': task.conversation_uuid,
-                                'text': document.text,
-                                'metadata': metadata  # Use the processed metadata
-                            }
-                        )
-                        
-                        # Create the association
-                        TaskActionDocumentModel.create(
-                            task_action=action_model,
-                            document=doc_model
-                        )
-                
-                # Remove document associations that are no longer present
-                for old_doc_uuid in existing_docs:
-                    if old_doc_uuid not in processed_docs:
-                        existing_docs[old_doc_uuid].delete_instance()
-
-        # Delete actions that no longer exist
-        for old_action in existing_actions.values():
-            old_action.delete_instance()
+            action_row = _action_row(action)
+            if _persisted_actions.get(action.uuid) != action_row:
+                dirty_action_rows.append(action_row)
+
+            document_uuids = {str(document.uuid) for document in action.output_documents}
+            persisted_document_uuids = _persisted_action_documents.get(action.uuid, set())
+            action_documents[action.uuid] = document_uuids
+            for document in action.output_documents:
+                if str(document.uuid) not in persisted_document_uuids:
+                    document_rows.append(_document_row(document, task.conversation_uuid))
+                    link_rows.append({'task_action': action.uuid, 'document': str(document.uuid)})
+            stale_links.extend(
+                (action.uuid, document_uuid) for document_uuid in persisted_document_uuids - document_uuids
+            )
+
+        action_uuids = {action.uuid for action in task.actions}
+        removed_action_uuids = _persisted_task_actions.get(task.uuid, set()) - action_uuids
+
+        with db.atomic():
+            if task_dirty:
+                (TaskModel
+                 .insert(**task_row, updated_at=datetime.utcnow())
+                 .on_conflict(
+                     conflict_target=[TaskModel.uuid],
+                     preserve=[TaskModel.name, TaskModel.description, TaskModel.status, TaskModel.updated_at])
+                 .execute())
+            if dirty_action_rows:
+                now = datetime.utcnow()
+                (TaskActionModel
+                 .insert_many([{**row, 'updated_at': now} for row in dirty_action_rows])
+                 .on_conflict(
+                     conflict_target=[TaskActionModel.uuid],
+                     preserve=[TaskActionModel.name, TaskActionModel.tool_uuid, TaskActionModel.tool_action,
+                               TaskActionModel.input_payload, TaskActionModel.step, TaskActionModel.status,
+                               TaskActionModel.updated_at])
+                 .execute())
+            if document_rows:
+                texts = [row.pop('text') for row in document_rows]
+                for row, content_hash in zip(document_rows, store_blobs(texts)):
+                    row['content_hash'] = content_hash
+                DocumentModel.insert_many(document_rows).on_conflict_ignore().execute()
+                index_documents([
+                    (row['uuid'], row['metadata'].get('name', ''), text) for row, text in zip(document_rows, texts)
+                ])
+                add_document_chunks([
+                    (row['uuid'], row['conversation_uuid'], text) for row, text in zip(document_rows, texts)
+                ])
+                TaskActionDocumentModel.insert_many(link_rows).on_conflict_ignore().execute()
+            for action_uuid, document_uuid in stale_links:
+                TaskActionDocumentModel.delete().where(
+                    (TaskActionDocumentModel.task_action == action_uuid) &
+                    (TaskActionDocumentModel.document == document_uuid)
+                ).execute()
+            if removed_action_uuids:
+                TaskActionDocumentModel.delete().where(
+                    TaskActionDocumentModel.task_action.in_(list(removed_action_uuids))
+                ).execute()
+                TaskActionModel.delete().where(TaskActionModel.uuid.in_(list(removed_action_uuids))).execute()
+
+        rows_written = (int(task_dirty) + len(dirty_action_rows) + len(document_rows) + len(link_rows)
+                        + len(stale_links) + len(removed_action_uuids))
+        _persistence_metrics["saves"] += 1
+        _persistence_metrics["rows_written"] += rows_written
+        _persistence_metrics["step_rows_written"] += rows_written
+        _persistence_metrics["rows_skipped"] += (1 - int(task_dirty)) + len(task.actions) - len(dirty_action_rows)
+
+        _persisted_tasks[task.uuid] = task_row
+        for row in dirty_action_rows:
+            _persisted_actions[row['uuid']] = row
+        for action_uuid in removed_action_uuids:
+            _persisted_actions.pop(action_uuid, None)
+            _persisted_action_documents.pop(action_uuid, None)
+        _persisted_task_actions[task.uuid] = action_uuids
+        _persisted_action_documents.update(action_documents)
+        _track_conversation_tasks(task.conversation_uuid, [task.uuid])
+
+        return rows_written
+
+def get_persistence_metrics() -> Dict[str, int]:
+    """Cumulative counters of task persistence in this process"""
+    with _persisted_lock:
+        return dict(_persistence_metrics)
+
+def take_step_rows_written() -> int:
+    """Rows written by save_task since the previous call; used to report writes per agent step"""
+    with _persisted_lock:
+        rows_written = _persistence_metrics["step_rows_written"]
+        _persistence_metrics["step_rows_written"] = 0
+        return rows_written
+
+def clear_persisted_rows() -> None:
+    """Drop all snapshots, e.g. after a rollback or a delete made by another process; the next save
+    of each task reloads it from the database"""
+    with _persisted_lock:
+        _persisted_tasks.clear()
+        _persisted_actions.clear()
+        _persisted_task_actions.clear()
+        _persisted_action_documents.clear()
+        _persisted_conversation_tasks.clear()
+
+register_rollback_handler(clear_persisted_rows)
+
+def forget_persisted_conversation(conversation_uuid: str) -> None:
+    """Drop the snapshots of a conversation's tasks, e.g. when its cached state is dropped"""
+    with _persisted_lock:
+        _forget_tasks(_persisted_conversation_tasks.pop(conversation_uuid, set()))
+
+def _forget_tasks(task_uuids) -> None:
+    for task_uuid in list(task_uuids):
+        _persisted_tasks.pop(task_uuid, None)
+        for action_uuid in _persisted_task_actions.pop(task_uuid, set()):
+            _persisted_actions.pop(action_uuid, None)
+            _persisted_action_documents.pop(action_uuid, None)
+
+def _track_conversation_tasks(conversation_uuid: str, task_uuids: List[str]) -> None:
+    """Mark a conversation's snapshots as most recently used, evicting the least recently used conversations"""
+    _persisted_conversation_tasks.setdefault(conversation_uuid, set()).update(task_uuids)
+    _persisted_conversation_tasks.move_to_end(conversation_uuid)
+    while len(_persisted_conversation_tasks) > PERSISTED_CONVERSATIONS_MAX:
+        _, evicted_task_uuids = _persisted_conversation_tasks.popitem(last=False)
+        _forget_tasks(evicted_task_uuids)
+
+def _remember_tasks(tasks: List[Task]) -> None:
+    """Record tasks as they are stored in the database, so later saves can skip clean rows"""
+    with _persisted_lock:
+        for task in tasks:
+            _persisted_tasks[task.uuid] = _task_row(task)
+            _persisted_task_actions[task.uuid] = {action.uuid for action in task.actions}
+            for action in task.actions:
+                _persisted_actions[action.uuid] = _action_row(action)
+                _persisted_action_documents[action.uuid] = {str(document.uuid) for document in action.output_documents}
+            _track_conversation_tasks(task.conversation_uuid, [task.uuid])
+
+def _task_row(task: Task) -> Dict[str, Any]:
+    return {
+        'uuid': task.uuid,
+        'conversation_uuid': task.conversation_uuid,
+        'name': task.name,
+        'description': task.description,
+        'status': task.status
+    }
+
+def _action_row(action: TaskAction) -> Dict[str, Any]:
+    return {
+        'uuid': action.uuid,
+        'task': action.task_uuid,
+        'name': action.name,
+        'tool_uuid': action.tool_uuid,
+        'tool_action': action.tool_action,
+        'input_payload': action.input_payload,
+        'step': action.step,
+        'status': action.status
+    }
+
+def _document_row(document: Document, conversation_uuid: Optional[str]) -> Dict[str, Any]:
+    # Prepare metadata by converting enums to strings
+    metadata = document.metadata.copy()
+    if metadata.get('type'):
+        metadata['type'] = metadata['type'].value if hasattr(metadata['type'], 'value') else str(metadata['type'])
+
+    return {
+        'uuid': str(document.uuid),
+        'conversation_uuid': conversation_uuid,
+        'text': document.text,
+        'metadata': metadata
+    }
 
 def load_tasks(conversation_uuid: str) -> List[Task]:
-    """Load all tasks for a conversation"""
+    """Load all tasks for a conversation with a fixed number of queries"""
     with connection():
-        tasks = []
-        task_models = TaskModel.select().where(TaskModel.conversation_uuid == conversation_uuid)
-        
-        for task_model in task_models:
-            # Load actions for this task
-            actions = []
-            action_models = (TaskActionModel
-                           .select()
-                           .where(TaskActionModel.task == task_model)
-                           .order_by(TaskActionModel.step))
-            
-            for action_model in action_models:
-                # Load documents for this action
-                documents = []
-                doc_models = (TaskActionDocumentModel
-                            .select()
-                            .join(DocumentModel)
-                            .where(TaskActionDocumentModel.task_action == action_model))
-                
-                for doc_model in doc_models:
-                    documents.append(Document(
-                        uuid=doc_model.document.uuid,
-                        conversation_uuid=doc_model.document.conversation_uuid,
-                        text=doc_model.document.text,
-                        metadata=doc_model.document.metadata
-                    ))
-                
-                actions.append(TaskAction(
-                    uuid=action_model.uuid,
-                    name=action_model.name,
-                    task_uuid=task_model.uuid,
-                    tool_uuid=action_model.tool_uuid,
-                    tool_action=action_model.tool_action,
-                    input_payload=action_model.input_payload,
-                    output_documents=documents,
-                    step=action_model.step,
-                    status=action_model.status
-                ))
-            
-            tasks.append(Task(
-                uuid=task_model.uuid,
-                name=task_model.name,
-                description=task_model.description,
-                status=task_model.status,
-                actions=actions
-            ))
-            
+        task_query = (TaskModel
+                      .select()
+                      .where(TaskModel.conversation_uuid == conversation_uuid)
+                      .order_by(TaskModel.created_at))
+        tasks = _build_tasks(task_query)
+        _remember_tasks(tasks)
         return tasks
 
+def _build_tasks(task_query) -> List[Task]:
+    """Eagerly load actions and documents of the selected tasks: one query per table, regardless of row counts"""
+    action_query = TaskActionModel.select().order_by(TaskActionModel.step)
+    # Document texts are left out and fetched on first access
+    document_link_query = (TaskActionDocumentModel
+                           .select(TaskActionDocumentModel, DocumentModel.uuid,
+                                   DocumentModel.conversation_uuid, DocumentModel.metadata)
+                           .join(DocumentModel))
+
+    tasks = []
+    for task_model in prefetch(task_query, action_query, document_link_query):
+        actions = [
+            TaskAction(
+                uuid=action_model.uuid,
+                name=action_model.name,
+                task_uuid=task_model.uuid,
+                tool_uuid=action_model.tool_uuid,
+                tool_action=action_model.tool_action,
+                input_payload=action_model.input_payload,
+                output_documents=[
+                    to_lazy_document(link.document.uuid, link.document.conversation_uuid, link.document.metadata)
+                    for link in action_model.output_documents
+                ],
+                step=action_model.step,
+                status=action_model.status
+            ) for action_model in task_model.actions
+        ]
+
+        tasks.append(Task(
+            uuid=task_model.uuid,
+            name=task_model.name,
+            description=task_model.description,
+            status=task_model.status,
+            actions=actions,
+            conversation_uuid=task_model.conversation_uuid
+        ))
+
+    return tasks
+
 def find_task_by_uuid(task_uuid: str) -> Optional[Task]:
-    """Find a specific task by UUID"""
+    """Find a specific task by UUID, with its actions and documents"""
+    tasks = find_tasks_by_uuids([task_uuid])
+    return tasks[0] if tasks else None
+
+def find_tasks_by_uuids(task_uuids: List[str]) -> List[Task]:
+    """Find tasks by UUID through primary-key lookups; unknown UUIDs are skipped, order follows the input"""
+    if not task_uuids:
+        return []
+
     with connection():
-        try:
-            task_model = TaskModel.get(TaskModel.uuid == task_uuid)
-            return load_tasks(task_model.conversation_uuid)[0]
-        except TaskModel.DoesNotExist:
-            return None
+        tasks = _build_tasks(TaskModel.select().where(TaskModel.uuid.in_(list(task_uuids))))
+        _remember_tasks(tasks)
+
+    tasks_by_uuid = {task.uuid: task for task in tasks}
+    return [tasks_by_uuid[task_uuid] for task_uuid in task_uuids if task_uuid in tasks_by_uuid]
 
 def update_task_status(task_uuid: str, status: str) -> None:
     """Update just the status of a task"""
     with connection():
         TaskModel.update(status=status).where(TaskModel.uuid == task_uuid).execute()
+    with _persisted_lock:
+        if task_uuid in _persisted_tasks:
+            _persisted_tasks[task_uuid] = {**_persisted_tasks[task_uuid], 'status': status}
 
 def update_task_action(task_uuid: str, action_uuid: str, updates: Dict[str, Any]) -> None:
     """Update specific fields of a task action"""
     with connection():
         TaskActionModel.update(updates).where(
             (TaskActionModel.uuid == action_uuid) & 
-            (TaskActionModel.task.uuid == task_uuid)
+            (TaskActionModel.task == task_uuid)
         ).execute()
+    with _persisted_lock:
+        _persisted_actions.pop(action_uuid, None)
@@ -0,0 +1,431 @@
+"""Local vector index over document chunks for semantic retrieval
+
+New documents are split into chunks in the transaction that saves them (see save_document and
+save_task). A background thread embeds pending chunks, caching every embedding in the embeddings
+table by chunk content hash and model, and appends the L2-normalized float32 vectors to a flat file
+next to the database. Queries memory-map that file as an (rows, dimensions) matrix and rank rows by
+cosine similarity: brute force within a conversation, and through an inverted file (IVF) of k-means
+partitions for global queries once the index holds IVF_MIN_ROWS vectors.
+
+The answer phase ranks conversation document chunks with these hits next to BM25 (see
+agent.context). VECTOR_INDEX=0 turns indexing and those queries off, e.g. without embeddings access.
+
+Backfill documents stored before the index existed, or rewrite the file from the embedding cache
+after deletions, from the repository root:
+    python -m db.vectors backfill|rebuild
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from logger.logger import log_exception, log_info
+from models.search import ChunkHit
+from utils.document import hash_content
+from utils.text import split_to_spans
+from . import db
+from .document import load_document_text
+from .models import DocumentChunkModel, DocumentModel, EmbeddingModel
+
+VECTOR_INDEX_ENABLED = os.getenv("VECTOR_INDEX", "1") == "1"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+CHUNK_CHARS = 1500
+EMBEDDING_BATCH_SIZE = 64
+INDEXER_POLL_SECONDS = 5
+INDEXER_MAX_BACKOFF_SECONDS = 300
+IVF_MIN_ROWS = int(os.getenv("VECTOR_IVF_MIN_ROWS", "20000"))
+IVF_PROBES = 8
+
+_indexer_thread: Optional[threading.Thread] = None
+_indexer_lock = threading.Lock()
+_indexer_wakeup = threading.Event()
+# Serializes appends to the vector file with rebuilds replacing it
+_vector_file_lock = threading.Lock()
+_vector_index: Optional["_VectorIndex"] = None
+_vector_index_lock = threading.Lock()
+
+
+def add_document_chunks(documents: List[Tuple[str, str, str]]) -> None:
+    """
+    Queue new documents for embedding; documents that already have chunks are skipped
+
+    Must run after the document rows were inserted, in the same transaction.
+
+    Args:
+        documents: (document uuid, conversation uuid, text) tuples
+    """
+    if not VECTOR_INDEX_ENABLED or not documents:
+        return
+
+    chunked = {row.document_id for row in DocumentChunkModel
+               .select(DocumentChunkModel.document)
+               .where(DocumentChunkModel.document.in_([document_uuid for document_uuid, _, _ in documents]))}
+    rows = []
+    for document_uuid, conversation_uuid, text in documents:
+        if document_uuid in chunked:
+            continue
+        chunked.add(document_uuid)
+        rows.extend({
+            'document': document_uuid,
+            'conversation_uuid': conversation_uuid or '',
+            'chunk_index': chunk_index,
+            'start': start,
+            'end': end,
+            'content_hash': hash_content(text[start:end]),
+        } for chunk_index, (start, end) in enumerate(split_to_spans(text, CHUNK_CHARS)))
+
+    if rows:
+        DocumentChunkModel.insert_many(rows).execute()
+        _ensure_indexer_started()
+        _indexer_wakeup.set()
+
+
+def get_embeddings(texts: Dict[str, str]) -> Dict[str, np.ndarray]:
+    """
+    Embed texts, reading cached vectors and requesting only the missing ones
+
+    Args:
+        texts: Text by content hash
+
+    Returns:
+        L2-normalized float32 vector by content hash
+    """
+    vectors = {
+        row.content_hash: np.frombuffer(row.vector, dtype=np.float32)
+        for row in EmbeddingModel
+        .select(EmbeddingModel.content_hash, EmbeddingModel.vector)
+        .where(EmbeddingModel.content_hash.in_(list(texts)) & (EmbeddingModel.model == EMBEDDING_MODEL))
+    }
+
+    missing = [content_hash for content_hash in texts if content_hash not in vectors]
+    if missing:
+        from llm.open_ai import embeddings
+
+        for start in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+            batch = missing[start:start + EMBEDDING_BATCH_SIZE]
+            rows = []
+            for content_hash, embedding in zip(batch, embeddings([texts[h] for h in batch], EMBEDDING_MODEL)):
+                vector = np.asarray(embedding, dtype=np.float32)
+                vector /= np.linalg.norm(vector) or 1.0
+                vectors[content_hash] = vector
+                rows.append({'content_hash': content_hash, 'model': EMBEDDING_MODEL, 'vector': vector.tobytes()})
+            EmbeddingModel.insert_many(rows).on_conflict_ignore().execute()
+
+    return vectors
+
+
+def embed_pending_chunks(limit: int = EMBEDDING_BATCH_SIZE) -> int:
+    """
+    Embed the oldest chunks that are not in the vector index yet and append them to it
+
+    Returns:
+        Number of chunks added to the index
+    """
+    pending = list(DocumentChunkModel
+                   .select()
+                   .where(DocumentChunkModel.vector_row.is_null())
+                   .order_by(DocumentChunkModel.id)
+                   .limit(limit))
+    if not pending:
+        return 0
+
+    texts = {}
+    chunks_by_document = defaultdict(list)
+    for chunk in pending:
+        chunks_by_document[chunk.document_id].append(chunk)
+    for document_uuid, chunks in chunks_by_document.items():
+        text = load_document_text(document_uuid)
+        for chunk in chunks:
+            texts[chunk.content_hash] = text[chunk.start:chunk.end]
+    vectors = get_embeddings(texts)
+
+    with _vector_file_lock:
+        first_row = _append_vectors(np.stack([vectors[chunk.content_hash] for chunk in pending]))
+        with db.atomic():
+            for offset, chunk in enumerate(pending):
+                (DocumentChunkModel
+                 .update(vector_row=first_row + offset)
+                 .where(DocumentChunkModel.id == chunk.id)
+                 .execute())
+    return len(pending)
+
+
+def search_chunks(query: str, conversation_uuid: Optional[str] = None, k: int = 5) -> List[ChunkHit]:
+    """
+    Find the document chunks most similar in meaning to a query
+
+    Args:
+        query: Free-text query
+        conversation_uuid: Only search this conversation's documents, None searches all
+        k: Maximum number of chunks
+
+    Returns:
+        Chunks ordered by cosine similarity, best first
+    """
+    content_hash = hash_content(query)
+    return search_vectors(get_embeddings({content_hash: query})[content_hash], conversation_uuid, k)
+
+
+def search_vectors(query_vector: np.ndarray, conversation_uuid: Optional[str] = None, k: int = 5) -> List[ChunkHit]:
+    """
+    Rank indexed chunks by cosine similarity to an embedding
+
+    Args:
+        query_vector: L2-normalized query embedding
+        conversation_uuid: Only search this conversation's documents, None searches all
+        k: Maximum number of chunks
+
+    Returns:
+        Chunks ordered by cosine similarity, best first
+    """
+    global _vector_index
+    with _vector_index_lock:
+        path = _vector_file_path(len(query_vector))
+        if _vector_index is None or _vector_index.path != path:
+            _vector_index = _VectorIndex(path, len(query_vector))
+        # Over-fetch: rows of deleted documents stay in the file until the next rebuild
+        rows, scores = _vector_index.search(query_vector, conversation_uuid, k * 2)
+
+    if not len(rows):
+        return []
+    chunks = {chunk.vector_row: chunk for chunk in DocumentChunkModel
+              .select(DocumentChunkModel, DocumentModel.uuid, DocumentModel.metadata)
+              .join(DocumentModel)
+              .where(DocumentChunkModel.vector_row.in_(rows.tolist()))}
+
+    hits = []
+    texts = {}
+    for row, score in zip(rows.tolist(), scores.tolist()):
+        chunk = chunks.get(row)
+        if chunk is None:
+            continue
+        if chunk.document_id not in texts:
+            texts[chunk.document_id] = load_document_text(chunk.document_id)
+        hits.append(ChunkHit(
+            document_uuid=chunk.document_id,
+            conversation_uuid=chunk.conversation_uuid,
+            name=chunk.document.metadata.get('name', ''),
+            chunk_index=chunk.chunk_index,
+            start=chunk.start,
+            end=chunk.end,
+            text=texts[chunk.document_id][chunk.start:chunk.end],
+            score=score
+        ))
+        if len(hits) == k:
+            break
+    return hits
+
+
+def backfill_document_chunks() -> int:
+    """Chunk every stored document that is not in the index yet; returns the number of documents queued"""
+    queued = 0
+    last_uuid = ""
+    while True:
+        batch = list(DocumentModel
+                     .select(DocumentModel.uuid, DocumentModel.conversation_uuid)
+                     .where(DocumentModel.uuid > last_uuid)
+                     .order_by(DocumentModel.uuid)
+                     .limit(200))
+        if not batch:
+            return queued
+        with db.atomic():
+            add_document_chunks([
+                (document.uuid, document.conversation_uuid, load_document_text(document.uuid)) for document in batch
+            ])
+        queued += len(batch)
+        last_uuid = batch[-1].uuid
+
+
+def rebuild_vector_file() -> int:
+    """
+    Rewrite the vector file with only the chunks that still exist, using cached embeddings
+
+    Chunks without a cached embedding for the current model go back to the embedding queue.
+
+    Returns:
+        Number of rows in the new file
+    """
+    global _vector_index
+    with _vector_file_lock:
+        rows = []
+        assignments = []
+        chunks = list(DocumentChunkModel.select(DocumentChunkModel.id, DocumentChunkModel.content_hash).order_by(DocumentChunkModel.id))
+        for start in range(0, len(chunks), 500):
+            batch = chunks[start:start + 500]
+            cached = {
+                row.content_hash: row.vector for row in EmbeddingModel
+                .select(EmbeddingModel.content_hash, EmbeddingModel.vector)
+                .where(EmbeddingModel.content_hash.in_([chunk.content_hash for chunk in batch]) &
+                       (EmbeddingModel.model == EMBEDDING_MODEL))
+            }
+            for chunk in batch:
+                vector = cached.get(chunk.content_hash)
+                assignments.append((chunk.id, len(rows) if vector else None))
+                if vector:
+                    rows.append(np.frombuffer(vector, dtype=np.float32))
+        if not rows:
+            return 0
+
+        path = _vector_file_path(len(rows[0]))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(file_descriptor, 'wb') as vector_file:
+            vector_file.write(np.stack(rows).tobytes())
+            vector_file.flush()
+            os.fsync(vector_file.fileno())
+
+        with db.atomic():
+            for chunk_id, vector_row in assignments:
+                DocumentChunkModel.update(vector_row=vector_row).where(DocumentChunkModel.id == chunk_id).execute()
+            os.replace(temporary_path, path)
+
+    with _vector_index_lock:
+        _vector_index = None
+    _indexer_wakeup.set()
+    return len(rows)
+
+
+class _VectorIndex:
+    """Memory-mapped vector file plus the row lists needed to search it, refreshed as the file grows"""
+
+    def __init__(self, path: str, dimensions: int):
+        self.path = path
+        self.dimensions = dimensions
+        self.file_id = None
+        self.matrix = np.empty((0, dimensions), dtype=np.float32)
+        self.conversation_rows: Dict[str, List[int]] = defaultdict(list)
+        self.last_assigned_row = -1
+        self.inverted_file: Optional[_InvertedFile] = None
+
+    def search(self, query_vector: np.ndarray, conversation_uuid: Optional[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        self._refresh()
+        if conversation_uuid:
+            rows = np.asarray(self.conversation_rows.get(conversation_uuid, []), dtype=np.int64)
+        elif self.inverted_file is not None:
+            rows = self.inverted_file.candidates(query_vector, IVF_PROBES)
+        else:
+            rows = None
+
+        if rows is None:
+            rows = np.arange(len(self.matrix))
+            scores = self.matrix @ query_vector
+        else:
+            rows = rows[rows < len(self.matrix)]
+            scores = self.matrix[rows] @ query_vector
+        if not len(rows):
+            return rows, scores
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
+
+    def _refresh(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        stat = os.stat(self.path)
+        if self.file_id != stat.st_ino:
+            # The file was rebuilt: start over
+            self.__init__(self.path, self.dimensions)
+            self.file_id = stat.st_ino
+
+        rows = stat.st_size // (4 * self.dimensions)
+        if rows > len(self.matrix):
+            previous_rows = len(self.matrix)
+            self.matrix = np.memmap(self.path, dtype=np.float32, mode='r', shape=(rows, self.dimensions))
+            if rows >= IVF_MIN_ROWS and (self.inverted_file is None or rows > 2 * self.inverted_file.trained_rows):
+                self.inverted_file = _InvertedFile(self.matrix)
+            elif self.inverted_file is not None:
+                self.inverted_file.add(self.matrix[previous_rows:], previous_rows)
+
+        for chunk in (DocumentChunkModel
+                      .select(DocumentChunkModel.vector_row, DocumentChunkModel.conversation_uuid)
+                      .where(DocumentChunkModel.vector_row > self.last_assigned_row)
+                      .order_by(DocumentChunkModel.vector_row)):
+            self.conversation_rows[chunk.conversation_uuid].append(chunk.vector_row)
+            self.last_assigned_row = chunk.vector_row
+
+
+class _InvertedFile:
+    """k-means partitions of the vectors; a query only scans the partitions nearest to it"""
+
+    def __init__(self, matrix: np.ndarray, iterations: int = 10):
+        lists = max(1, int(np.sqrt(len(matrix))))
+        generator = np.random.default_rng(0)
+        sample = np.asarray(matrix[np.sort(generator.choice(len(matrix), min(len(matrix), lists * 40), replace=False))])
+        centroids = sample[generator.choice(len(sample), lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for list_index in range(lists):
+                members = sample[assignment == list_index]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[list_index] = centroid / (np.linalg.norm(centroid) or 1.0)
+
+        self.centroids = centroids
+        self.lists: List[List[int]] = [[] for _ in range(lists)]
+        self.trained_rows = len(matrix)
+        self.add(matrix, 0)
+
+    def add(self, vectors: np.ndarray, first_row: int) -> None:
+        for start in range(0, len(vectors), 10000):
+            assignment = np.argmax(np.asarray(vectors[start:start + 10000]) @ self.centroids.T, axis=1)
+            for list_index in np.unique(assignment):
+                self.lists[list_index].extend((first_row + start + np.flatnonzero(assignment == list_index)).tolist())
+
+    def candidates(self, query_vector: np.ndarray, probes: int) -> np.ndarray:
+        nearest = np.argsort(-(self.centroids @ query_vector))[:probes]
+        return np.concatenate([np.asarray(self.lists[list_index], dtype=np.int64) for list_index in nearest])
+
+
+def _vector_file_path(dimensions: int) -> str:
+    return os.path.join(f"{db.database}.vectors", f"{EMBEDDING_MODEL}-{dimensions}.f32")
+
+
+def _append_vectors(vectors: np.ndarray) -> int:
+    """Append rows to the vector file and return the row number of the first one"""
+    path = _vector_file_path(vectors.shape[1])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as vector_file:
+        first_row = vector_file.tell() // (4 * vectors.shape[1])
+        vector_file.write(vectors.astype(np.float32).tobytes())
+        vector_file.flush()
+        os.fsync(vector_file.fileno())
+    return first_row
+
+
+def _ensure_indexer_started() -> None:
+    global _indexer_thread
+    with _indexer_lock:
+        if _indexer_thread is None:
+            _indexer_thread = threading.Thread(target=_run_indexer, name="vector-indexer", daemon=True)
+            _indexer_thread.start()
+
+
+def _run_indexer() -> None:
+    backoff_seconds = INDEXER_POLL_SECONDS
+    while True:
+        _indexer_wakeup.wait(INDEXER_POLL_SECONDS)
+        _indexer_wakeup.clear()
+        try:
+            while embedded := embed_pending_chunks():
+                log_info(f"🧭 Added {embedded} chunk(s) to the vector index")
+            backoff_seconds = INDEXER_POLL_SECONDS
+        except Exception as e:
+            log_exception(f"Embedding document chunks failed, retrying in {backoff_seconds} s", e)
+            time.sleep(backoff_seconds)
+            backoff_seconds = min(backoff_seconds * 2, INDEXER_MAX_BACKOFF_SECONDS)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "backfill"
+    if command == "rebuild":
+        print(f"Vector file rebuilt with {rebuild_vector_file()} rows")
+    else:
+        print(f"Queued {backfill_document_chunks()} documents for embedding")
+        while embed_pending_chunks():
+            pass
+        print("All chunks embedded")
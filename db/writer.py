@@ -0,0 +1,177 @@
+"""Single writer thread applying repository writes in submission order
+
+Durability: a write is acknowledged as soon as it is enqueued, and the queue lives only in memory.
+The writer commits whatever is queued right away (up to MAX_BATCH_SIZE jobs per transaction), and
+flush_writes runs when a run starts (so the inbound user message is on disk before the agent works
+on it), before every tool call, at the end of a run and at interpreter exit. A hard crash (SIGKILL,
+OOM kill, power loss) therefore loses at most the writes of the agent step in progress. Committed
+transactions are durable across application crashes (WAL with synchronous=NORMAL).
+
+A job that fails when retried on its own, e.g. on a lock timeout, is retried WRITE_RETRIES times
+with exponential backoff, in place so later writes cannot overtake it. If it still fails, its
+conversation's cached state is invalidated and the error is kept until raise_failed_writes reports
+it to the run of that conversation.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from logger.logger import log_exception, log_info
+from . import db
+
+MAX_BATCH_SIZE = 100
+WRITE_RETRIES = int(os.getenv("WRITE_RETRIES", "3"))
+WRITE_RETRY_SECONDS = float(os.getenv("WRITE_RETRY_SECONDS", "0.5"))  # doubled after every attempt
+
+
+@dataclass
+class _WriteJob:
+    conversation_uuid: str
+    write: Callable[..., Any]
+    args: Tuple[Any, ...]
+
+
+@dataclass
+class _Barrier:
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+_write_queue: "queue.Queue[_WriteJob | _Barrier]" = queue.Queue()
+_writer_thread: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+_rollback_handlers: List[Callable[[], None]] = []
+_failed_writes: Dict[str, List[str]] = {}  # conversation uuid -> errors of dropped jobs
+_failed_writes_lock = threading.Lock()
+
+
+def enqueue_write(conversation_uuid: str, write: Callable[..., Any], *args: Any) -> None:
+    """
+    Schedule a database write on the single writer thread and return immediately
+
+    Writes are applied in submission order, so writes of one conversation never overtake each other.
+
+    Args:
+        conversation_uuid: Conversation the write belongs to, used for logging
+        write: Repository function performing the write, e.g. save_message
+        args: Arguments passed to the repository function
+    """
+    _ensure_writer_started()
+    _write_queue.put(_WriteJob(conversation_uuid, write, args))
+
+
+def flush_writes(timeout: Optional[float] = None) -> bool:
+    """
+    Block until every write enqueued before this call is committed
+
+    Args:
+        timeout: Maximum number of seconds to wait, None waits forever
+
+    Returns:
+        True if all earlier writes were applied, False on timeout
+    """
+    if _writer_thread is None:
+        return True
+    barrier = _Barrier()
+    _write_queue.put(barrier)
+    return barrier.done.wait(timeout)
+
+
+def raise_failed_writes(conversation_uuid: str) -> None:
+    """
+    Raise if writes of a conversation were dropped since the previous call
+
+    Call it after flush_writes so every earlier write of the conversation has been attempted.
+
+    Args:
+        conversation_uuid: Conversation UUID
+
+    Raises:
+        RuntimeError: With the errors of the dropped writes
+    """
+    with _failed_writes_lock:
+        errors = _failed_writes.pop(conversation_uuid, None)
+    if errors:
+        raise RuntimeError(f"{len(errors)} write(s) for conversation {conversation_uuid} failed: {'; '.join(errors)}")
+
+
+def register_rollback_handler(handler: Callable[[], None]) -> None:
+    """
+    Register a callback run when a batch transaction is rolled back
+
+    Repositories that cache what they believe is persisted use it to drop that cache,
+    since writes reported as done inside the batch were undone.
+    """
+    _rollback_handlers.append(handler)
+
+
+def _ensure_writer_started() -> None:
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is not None:
+            return
+        _writer_thread = threading.Thread(target=_run_writer, name="db-writer", daemon=True)
+        _writer_thread.start()
+        # Pending writes are drained before the interpreter exits
+        atexit.register(flush_writes)
+
+
+def _run_writer() -> None:
+    while True:
+        batch: List[_WriteJob | _Barrier] = [_write_queue.get()]
+        while len(batch) < MAX_BATCH_SIZE:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        pending_jobs: List[_WriteJob] = []
+        for item in batch:
+            if isinstance(item, _Barrier):
+                _apply_batch(pending_jobs)
+                pending_jobs = []
+                item.done.set()
+            else:
+                pending_jobs.append(item)
+        _apply_batch(pending_jobs)
+
+
+def _apply_batch(jobs: List[_WriteJob]) -> None:
+    """Apply jobs in one transaction; if it fails, retry each job in its own transaction"""
+    from agent.state_cache import invalidate_cached_state
+
+    if not jobs:
+        return
+    try:
+        with db.atomic():
+            for job in jobs:
+                job.write(*job.args)
+        return
+    except Exception as e:
+        log_info(f"Batched write of {len(jobs)} job(s) failed, retrying one by one: {str(e)}")
+        for handler in _rollback_handlers:
+            handler()
+
+    for job in jobs:
+        retry_seconds = WRITE_RETRY_SECONDS
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                with db.atomic():
+                    job.write(*job.args)
+                break
+            except Exception as e:
+                for handler in _rollback_handlers:
+                    handler()
+                if attempt < WRITE_RETRIES:
+                    log_info(f"{job.write.__name__} write failed, retrying in {retry_seconds} s: {str(e)}")
+                    time.sleep(retry_seconds)
+                    retry_seconds *= 2
+                    continue
+                # The state cache already holds the change; drop it so it cannot diverge from the database
+                invalidate_cached_state(job.conversation_uuid)
+                log_exception(f"Dropped {job.write.__name__} write for conversation {job.conversation_uuid}", e)
+                with _failed_writes_lock:
+                    _failed_writes.setdefault(job.conversation_uuid, []).append(f"{job.write.__name__}: {str(e)}")
@@ -3,7 +3,8 @@ from datetime import datetime
 from typing import List
 
 from models.document import Document
-from agent.state import Task, Thoughts
+from models.message import Message
+from agent.state import AgentState, Task, Thoughts
 
 
 def format_tools(tools: List[Dict]) -> str:
@@ -61,6 +62,46 @@ def format_documents(documents: List[Document]) -> str:
     return "\n".join(doc_descriptions)
 
 
+def format_messages(messages: List[Message]) -> str:
+    """
+    Formats conversation messages into an XML-like string representation.
+
+    Args:
+        messages: List of Message objects
+
+    Returns:
+        str: Formatted string with one tag per message
+    """
+    return "\n".join(
+        f"<message role='{message.role}' created_at='{message.created_at.isoformat()}'>{message.content}</message>"
+        for message in messages
+    )
+
+
+def format_conversation_memory(state: AgentState) -> List[Dict]:
+    """
+    Builds the chat messages sent to the model: the rolling summary of older turns
+    followed by the messages kept verbatim in the memory window.
+
+    Args:
+        state: Current agent state
+
+    Returns:
+        List of chat completion messages
+    """
+    memory = []
+    if state.conversation_summary:
+        memory.append({
+            "role": "system",
+            "content": f"<conversation_summary>\n{state.conversation_summary.summary}\n</conversation_summary>"
+        })
+    memory.extend(
+        {"role": message.role, "content": message.content}
+        for message in state.recent_messages
+    )
+    return memory
+
+
 def format_thoughts(thoughts: Thoughts) -> str:
     """
     Formats Thoughts into an XML-like string representation.
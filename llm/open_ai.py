@@ -1,12 +1,13 @@
 import os
 from typing import List, Dict, Optional
 
-import openai
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, OpenAI
 
 load_dotenv()
 openai_client = AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"])
+# Blocking client for background threads that run outside the event loop
+openai_sync_client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
 
 
 async def completion(
@@ -23,5 +24,10 @@ async def completion(
 
 
 def embedding(text, model="text-embedding-3-large"):
-    response = openai.Embedding.create(input=text, model=model)
-    return response["data"][0]["embedding"]
\ No newline at end of file
+    return embeddings([text], model)[0]
+
+
+def embeddings(texts: List[str], model: str = "text-embedding-3-small") -> List[List[float]]:
+    """Embed a batch of texts in one blocking request, in input order"""
+    response = openai_sync_client.embeddings.create(input=texts, model=model)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
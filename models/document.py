@@ -1,8 +1,10 @@
 from dataclasses import dataclass
 from enum import Enum
-from typing import TypedDict, List
+from typing import Callable, Optional, TypedDict, List
 from uuid import UUID
 
+from pydantic import ConfigDict
+
 class DocumentType(Enum):
     """Type of document content"""
     IMAGE = "image"
@@ -22,6 +24,7 @@ class DocumentMetadata(TypedDict, total=False):
     description: str   # A brief description of the document's content
     images: List[str]  # List of image URLs found in the document
     urls: List[str]    # List of URLs found in the document
+    content_hash: str  # sha256 of the document text, used to share identical bodies
 
 @dataclass
 class Document:
@@ -29,4 +32,46 @@ class Document:
     uuid: UUID
     conversation_uuid: str
     text: str
-    metadata: DocumentMetadata
\ No newline at end of file
+    metadata: DocumentMetadata
+
+    # Accept instances as they are when nested in pydantic models, so lazy text is not read during validation
+    __pydantic_config__ = ConfigDict(revalidate_instances='never')
+
+    @property
+    def restored_text(self) -> str:
+        """Text with {$imgN}/{$urlN} placeholders replaced by the original URLs, computed once per text"""
+        from utils.document import restore_text
+
+        text = self.text
+        cached = self.__dict__.get('_restored')
+        if cached is None or cached[0] is not text:
+            cached = (text, restore_text(text, self.metadata.get('images', []), self.metadata.get('urls', [])))
+            self.__dict__['_restored'] = cached
+        return cached[1]
+
+
+class LazyDocument(Document):
+    """A document whose text is fetched only on first access and then kept"""
+
+    def __init__(
+            self,
+            uuid: UUID,
+            conversation_uuid: str,
+            metadata: DocumentMetadata,
+            load_text: Callable[[], str]
+    ):
+        self.uuid = uuid
+        self.conversation_uuid = conversation_uuid
+        self.metadata = metadata
+        self._text: Optional[str] = None
+        self._load_text = load_text
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self._load_text()
+        return self._text
+
+    @text.setter
+    def text(self, value: str) -> None:
+        self._text = value
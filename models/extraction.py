@@ -0,0 +1,85 @@
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+
+class ExtractedDate(BaseModel):
+    """
+    A date or deadline mentioned in a document
+
+    Attributes:
+        date: Date in YYYY-MM-DD format
+        time: Time of day in HH:MM format, if given
+        description: What happens on that date
+    """
+    date: str = Field(..., description="Date in YYYY-MM-DD format")
+    time: Optional[str] = Field(None, description="Time of day in HH:MM format")
+    description: str = Field("", description="What happens on that date")
+
+
+class ExtractedAmount(BaseModel):
+    """
+    A monetary amount such as a payment, invoice total or expense
+
+    Attributes:
+        amount: Absolute value of the amount
+        currency: ISO 4217 currency code
+        direction: Whether the money is spent or received
+        payee: Who is paid or who pays
+        date: Date of the payment in YYYY-MM-DD format
+        description: What the amount is for
+    """
+    amount: float = Field(..., description="Absolute value of the amount")
+    currency: str = Field("", description="ISO 4217 currency code")
+    direction: Literal["outflow", "inflow"] = Field("outflow", description="Spent or received")
+    payee: str = Field("", description="Who is paid or who pays")
+    date: Optional[str] = Field(None, description="Date of the payment in YYYY-MM-DD format")
+    description: str = Field("", description="What the amount is for")
+
+
+class ActionItem(BaseModel):
+    """
+    Something the reader is asked or expected to do
+
+    Attributes:
+        title: Short imperative task title
+        description: Additional context for the task
+        due_date: Deadline in YYYY-MM-DD format
+        priority: 4 (highest) to 1 (lowest)
+    """
+    title: str = Field(..., description="Short imperative task title")
+    description: str = Field("", description="Additional context")
+    due_date: Optional[str] = Field(None, description="Deadline in YYYY-MM-DD format")
+    priority: int = Field(1, ge=1, le=4, description="4 (highest) to 1 (lowest)")
+
+
+class Contact(BaseModel):
+    """
+    A person or organization with their contact details
+
+    Attributes:
+        name: Full name
+        email: Email address
+        phone: Phone number
+        organization: Company or organization
+    """
+    name: str = Field("", description="Full name")
+    email: Optional[str] = Field(None, description="Email address")
+    phone: Optional[str] = Field(None, description="Phone number")
+    organization: Optional[str] = Field(None, description="Company or organization")
+
+
+class Extraction(BaseModel):
+    """
+    Structured fields extracted from one chunk of a document, or merged across chunks
+
+    Attributes:
+        dates: Dates and deadlines
+        amounts: Monetary amounts
+        action_items: Tasks for the reader
+        contacts: People and organizations
+    """
+    dates: List[ExtractedDate] = Field(default_factory=list, description="Dates and deadlines")
+    amounts: List[ExtractedAmount] = Field(default_factory=list, description="Monetary amounts")
+    action_items: List[ActionItem] = Field(default_factory=list, description="Tasks for the reader")
+    contacts: List[Contact] = Field(default_factory=list, description="People and organizations")
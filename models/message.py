@@ -20,3 +20,17 @@ class Message(BaseModel):
     content: str = Field(..., description="Message content")
     role: Literal["user", "assistant"] = Field(..., description="Role of the message sender")
     created_at: datetime = Field(default_factory=datetime.utcnow, description="Message creation timestamp")
+
+
+class ConversationSummary(BaseModel):
+    """
+    Rolling summary of the conversation turns that fell out of the verbatim window
+
+    Attributes:
+        conversation_uuid: UUID of the summarized conversation
+        summary: Incrementally updated summary of older messages
+        summarized_until: Timestamp of the newest message folded into the summary
+    """
+    conversation_uuid: str = Field(..., description="UUID of the conversation")
+    summary: str = Field(..., description="Summary of older messages")
+    summarized_until: datetime = Field(..., description="Timestamp of the newest summarized message")
@@ -0,0 +1,47 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+
+class SearchHit(BaseModel):
+    """
+    A ranked full-text match in a stored document or message
+
+    Attributes:
+        source: Whether the match is a document or a message
+        uuid: UUID of the matching document or message
+        conversation_uuid: UUID of the conversation it belongs to
+        name: Document name, or the message role
+        snippet: Excerpt around the matched terms, matches wrapped in ** **
+        score: BM25 relevance, higher is better
+    """
+    source: Literal["document", "message"] = Field(..., description="Kind of the matching row")
+    uuid: str = Field(..., description="UUID of the matching document or message")
+    conversation_uuid: str = Field(..., description="UUID of the conversation")
+    name: str = Field(..., description="Document name or message role")
+    snippet: str = Field(..., description="Excerpt around the matched terms")
+    score: float = Field(..., description="BM25 relevance, higher is better")
+
+
+class ChunkHit(BaseModel):
+    """
+    A document chunk ranked by semantic similarity to a query
+
+    Attributes:
+        document_uuid: UUID of the document the chunk belongs to
+        conversation_uuid: UUID of the conversation the document belongs to
+        name: Document name
+        chunk_index: Position of the chunk in the document
+        start: Character offset of the chunk in the document text
+        end: Character offset just past the chunk
+        text: Chunk text
+        score: Cosine similarity to the query
+    """
+    document_uuid: str = Field(..., description="UUID of the document")
+    conversation_uuid: str = Field(..., description="UUID of the conversation")
+    name: str = Field(..., description="Document name")
+    chunk_index: int = Field(..., description="Position of the chunk in the document")
+    start: int = Field(..., description="Start offset in the document text")
+    end: int = Field(..., description="End offset in the document text")
+    text: str = Field(..., description="Chunk text")
+    score: float = Field(..., description="Cosine similarity, higher is better")
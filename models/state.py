@@ -5,6 +5,7 @@ from typing import List, Dict, Any, Optional
 from pydantic import ConfigDict, BaseModel
 
 from models.document import Document
+from models.message import ConversationSummary, Message
 
 
 class AgentPhase(str, Enum):
@@ -55,3 +56,13 @@ class Task(BaseModel):
     conversation_uuid: Optional[str] = None
 
     model_config = ConfigDict(frozen=True)
+
+
+class ConversationSnapshot(BaseModel):
+    """Persistent part of a conversation's state as captured at the end of a run."""
+    conversation_uuid: str
+    messages: List[Message]
+    conversation_summary: Optional[ConversationSummary] = None
+    tasks: List[Task]
+
+    model_config = ConfigDict(frozen=True)
@@ -72,6 +72,55 @@ def get_tools():
                         "document_uuids": ["550e8400-e29b-41d4-a716-446655440000"]
                     }
                     """
+                },
+                "extract": {
+                    "description": "Extracts dates, amounts, action items and contacts from one or more documents into JSON, including ready-made payloads for todoist add_tasks and ynab add_transactions",
+                    "instructions": """
+                    {
+                        "document_uuids": ["list of document UUIDs to process"],
+                        "fields": ["dates", "amounts", "action_items", "contacts"],
+                        "instructions": "optional guidance on what to extract"
+                    }
+                    
+                    Field details:
+                    - document_uuids: Required, list of document UUIDs to process
+                    - fields: Optional, default all four. Which kinds of information to keep
+                    - instructions: Optional. Extra guidance, e.g. "only items assigned to me"
+                    
+                    Example:
+                    {
+                        "document_uuids": ["550e8400-e29b-41d4-a716-446655440000"],
+                        "fields": ["action_items"]
+                    }
+                    
+                    Returns:
+                    JSON with the merged, deduplicated fields and a "payloads" object; its "todoist.add_tasks" and "ynab.add_transactions" entries can be used as the input of those actions as they are.
+                    """
+                },
+                "search": {
+                    "description": "Searches previously stored documents (scraped pages, attachments, summaries) and messages by keywords and returns ranked snippets with their document UUIDs, so earlier content can be reused without fetching it again",
+                    "instructions": """
+                    {
+                        "query": "keywords to look for",
+                        "conversation_only": false,
+                        "include_messages": true,
+                        "limit": 5
+                    }
+                    
+                    Field details:
+                    - query: Required. Keywords describing the content to find; documents matching more of them rank higher
+                    - conversation_only: Optional, default false. Only search the current conversation
+                    - include_messages: Optional, default true. Also search earlier chat messages
+                    - limit: Optional, default 5. Maximum number of results
+                    
+                    Example:
+                    {
+                        "query": "quarterly budget cloud hosting costs"
+                    }
+                    
+                    Returns:
+                    Ranked snippets; pass the listed document UUIDs to other actions (e.g. summarize) to use the full documents.
+                    """
                 }
             }
         },
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from pydantic import ValidationError
+
+from llm.tracing import create_event, create_generation, end_generation
+from llm import open_ai
+from llm.prompts import get_prompt
+from logger.logger import log_info
+from models.document import Document, DocumentType
+from models.extraction import ActionItem, Contact, ExtractedAmount, ExtractedDate, Extraction
+from utils import DEFAULT_MODEL
+from utils.document import create_document
+from utils.text import iter_chunks
+from db.document import find_documents_by_uuids
+
+EXTRACT_CHUNK_TOKENS = 2000
+EXTRACT_CHUNK_OVERLAP_TOKENS = 100
+# Completions in flight at once per extract action
+EXTRACT_CONCURRENCY = int(os.getenv("EXTRACT_CONCURRENCY", "4"))
+
+FIELD_MODELS = {
+    "dates": ExtractedDate,
+    "amounts": ExtractedAmount,
+    "action_items": ActionItem,
+    "contacts": Contact,
+}
+
+# Used until a tool_document_extract prompt is published in Langfuse
+EXTRACT_PROMPT_FALLBACK = """Extract structured information from the document excerpt the user sends.
+Respond with a JSON object with these keys, each a list (empty when nothing is found):
+- "dates": {"date": "YYYY-MM-DD", "time": "HH:MM" or null, "description": what happens}
+- "amounts": {"amount": positive number, "currency": ISO code, "direction": "outflow" or "inflow", "payee": who is paid or pays, "date": "YYYY-MM-DD" or null, "description": what it is for}
+- "action_items": {"title": short imperative task, "description": context, "due_date": "YYYY-MM-DD" or null, "priority": 1-4 with 4 the most urgent}
+- "contacts": {"name": full name, "email": address or null, "phone": number or null, "organization": company or null}
+Only include information stated in the excerpt. Resolve relative dates against {{now}}.
+{{instructions}}"""
+
+
+async def _extract(params: Dict, span) -> List[Document]:
+    """Extract dates, amounts, action items and contacts from one or more documents
+
+    Every document is split into token-bounded chunks that are processed concurrently; the results
+    are merged and deduplicated across chunks and documents. The result also carries ready-made
+    payloads for todoist.add_tasks and ynab.add_transactions.
+
+    Args:
+        params: Parameters including document UUIDs, optional fields to keep and extra instructions
+        span: Tracing span
+
+    Returns:
+        Document: JSON with the merged fields and the action payloads
+    """
+    try:
+        started = time.perf_counter()
+
+        document_uuids = params.get("document_uuids", [])
+        if not document_uuids:
+            create_event(span, "extract", input=params, output="No document UUIDs provided")
+            raise ValueError("document_uuids is required")
+
+        fields = params.get("fields") or list(FIELD_MODELS)
+        unknown_fields = set(fields) - set(FIELD_MODELS)
+        if unknown_fields:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown_fields))}")
+
+        uuids = [str(UUID(str(doc_uuid))) for doc_uuid in document_uuids]
+        found = find_documents_by_uuids(uuids)
+        missing = [uuid for uuid in uuids if uuid not in found]
+        if missing:
+            raise ValueError(f"Document not found: {', '.join(missing)}")
+        documents = [found[uuid] for uuid in uuids]
+
+        prompt = get_prompt(name="tool_document_extract", fallback=EXTRACT_PROMPT_FALLBACK)
+        system_prompt = prompt.compile(
+            now=params.get("now", ""),
+            instructions=params.get("instructions", "")
+        )
+        model = prompt.config.get("model", DEFAULT_MODEL)
+
+        chunks = [
+            chunk
+            for document in documents
+            for chunk in iter_chunks(document.restored_text, EXTRACT_CHUNK_TOKENS, EXTRACT_CHUNK_OVERLAP_TOKENS)
+        ]
+        semaphore = asyncio.Semaphore(EXTRACT_CONCURRENCY)
+        results = await asyncio.gather(
+            *(_extract_chunk(span, system_prompt, model, chunk, semaphore) for chunk in chunks),
+            return_exceptions=True
+        )
+
+        extractions = [result for result in results if isinstance(result, Extraction)]
+        errors = [str(result) for result in results if isinstance(result, Exception)]
+        if chunks and not extractions:
+            raise ValueError(f"Extraction failed for every chunk: {errors[0]}")
+
+        merged = merge_extractions(extractions)
+        for field in set(FIELD_MODELS) - set(fields):
+            setattr(merged, field, [])
+
+        result = {
+            **merged.model_dump(),
+            "payloads": {
+                "todoist.add_tasks": to_todoist_payload(merged.action_items),
+                "ynab.add_transactions": to_ynab_payload(merged.amounts),
+            },
+        }
+        if errors:
+            result["failed_chunks"] = len(errors)
+
+        duration_ms = (time.perf_counter() - started) * 1000
+        counts = {field: len(getattr(merged, field)) for field in fields}
+        create_event(
+            span,
+            "extract",
+            input=params,
+            output=counts,
+            metadata={"chunks": len(chunks), "failed_chunks": len(errors), "duration_ms": duration_ms}
+        )
+        log_info(
+            f"🔎 Extracted {', '.join(f'{count} {field}' for field, count in counts.items())} "
+            f"from {len(documents)} document(s) in {len(chunks)} chunk(s), {duration_ms:.0f} ms"
+        )
+
+        return [create_document(
+            text=json.dumps(result, indent=2, ensure_ascii=False),
+            metadata_override={
+                "conversation_uuid": params.get("conversation_uuid", ""),
+                "source": "document_processor",
+                "mime_type": "application/json",
+                "name": "ExtractionResult",
+                "description": f"Structured fields extracted from documents with uuids: "
+                               f"{', '.join(str(doc.uuid) for doc in documents)}",
+                "type": DocumentType.TEXT,
+            }
+        )]
+
+    except Exception as error:
+        create_event(span, "extract", level="ERROR", input=params, output={"error": str(error)})
+        raise
+
+
+async def _extract_chunk(span, system_prompt: str, model: str, chunk: str, semaphore: asyncio.Semaphore) -> Extraction:
+    """Extract fields from one chunk; items that do not validate are dropped individually"""
+    async with semaphore:
+        generation = create_generation(span, "extract_chunk", model, chunk)
+        completion = await open_ai.completion(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": chunk}
+            ],
+            model=model,
+            json_mode=True
+        )
+        end_generation(generation, completion)
+
+    data = json.loads(completion)
+    extraction = Extraction()
+    for field, item_model in FIELD_MODELS.items():
+        for item in data.get(field) or []:
+            try:
+                getattr(extraction, field).append(item_model.model_validate(item))
+            except ValidationError:
+                continue
+    return extraction
+
+
+def merge_extractions(extractions: List[Extraction]) -> Extraction:
+    """
+    Merge per-chunk extractions, dropping duplicates from overlapping chunks and repeated mentions
+
+    Dates and amounts are duplicates when all their identifying values match. Action items with the
+    same title are combined, keeping the earliest due date and highest priority. Contacts sharing
+    an email address, phone number or name are combined into one with the details of both.
+
+    Args:
+        extractions: Extractions in document order
+
+    Returns:
+        One extraction, items in order of first appearance
+    """
+    merged = Extraction()
+
+    seen_dates = set()
+    seen_amounts = set()
+    action_items: Dict[str, ActionItem] = {}
+    contacts: List[Contact] = []
+    contact_index: Dict[Tuple[str, str], int] = {}
+
+    for extraction in extractions:
+        for date in extraction.dates:
+            key = (date.date, date.time, _normalize(date.description))
+            if key not in seen_dates:
+                seen_dates.add(key)
+                merged.dates.append(date)
+
+        for amount in extraction.amounts:
+            key = (round(amount.amount, 2), amount.currency.upper(), amount.direction, _normalize(amount.payee), amount.date)
+            if key not in seen_amounts:
+                seen_amounts.add(key)
+                merged.amounts.append(amount)
+
+        for item in extraction.action_items:
+            key = _normalize(item.title)
+            existing = action_items.get(key)
+            if existing is None:
+                action_items[key] = item
+                continue
+            due_dates = [due for due in (existing.due_date, item.due_date) if due]
+            action_items[key] = existing.model_copy(update={
+                "description": max(existing.description, item.description, key=len),
+                "due_date": min(due_dates) if due_dates else None,
+                "priority": max(existing.priority, item.priority),
+            })
+
+        for contact in extraction.contacts:
+            keys = _contact_keys(contact)
+            if not keys:
+                continue
+            position = next((contact_index[key] for key in keys if key in contact_index), None)
+            if position is None:
+                position = len(contacts)
+                contacts.append(contact)
+            else:
+                existing = contacts[position]
+                contacts[position] = existing.model_copy(update={
+                    field: getattr(existing, field) or getattr(contact, field)
+                    for field in ("name", "email", "phone", "organization")
+                })
+            for key in _contact_keys(contacts[position]):
+                contact_index.setdefault(key, position)
+
+    merged.action_items = list(action_items.values())
+    merged.contacts = contacts
+    return merged
+
+
+def to_todoist_payload(action_items: List[ActionItem]) -> Optional[Dict[str, Any]]:
+    """Parameters for todoist.add_tasks creating one task per action item, None without items"""
+    if not action_items:
+        return None
+    tasks = []
+    for item in action_items:
+        task = {"title": item.title, "priority": item.priority}
+        if item.description:
+            task["description"] = item.description
+        if item.due_date:
+            task["dueDate"] = item.due_date
+        tasks.append(task)
+    return {"tasks": tasks}
+
+
+def to_ynab_payload(amounts: List[ExtractedAmount]) -> Optional[Dict[str, Any]]:
+    """Parameters for ynab.add_transactions, one transaction per amount in its query, None without amounts"""
+    if not amounts:
+        return None
+    transactions = []
+    for amount in amounts:
+        outflow = amount.direction == "outflow"
+        parts = [f"{'spent' if outflow else 'received'} {amount.amount:g}{f' {amount.currency}' if amount.currency else ''}"]
+        if amount.payee:
+            parts.append(f"{'at' if outflow else 'from'} {amount.payee}")
+        if amount.date:
+            parts.append(f"on {amount.date}")
+        if amount.description:
+            parts.append(f"for {amount.description}")
+        transactions.append(" ".join(parts))
+    return {"query": "; ".join(transactions)}
+
+
+def _normalize(value: Optional[str]) -> str:
+    return re.sub(r"\W+", " ", value or "").strip().lower()
+
+
+def _contact_keys(contact: Contact) -> List[Tuple[str, str]]:
+    keys = []
+    if contact.email:
+        keys.append(("email", contact.email.strip().lower()))
+    if phone := re.sub(r"\D", "", contact.phone or ""):
+        keys.append(("phone", phone))
+    if name := _normalize(contact.name):
+        keys.append(("name", name))
+    return keys
@@ -0,0 +1,86 @@
+import asyncio
+from typing import Dict, List, Tuple
+
+from llm.tracing import create_event
+from models.document import Document, DocumentType
+from models.search import SearchHit
+from utils.document import create_document
+from db.search import search_documents, search_messages
+
+# Reciprocal rank fusion constant: damps the weight of the top ranks of each list
+RRF_K = 60
+
+
+async def _search(params: Dict, span) -> List[Document]:
+    """Find earlier documents and messages matching a query in the full-text index
+
+    Args:
+        params: Parameters including the query and optional scope and limit
+        span: Tracing span
+
+    Returns:
+        Document: Ranked snippets, with the UUIDs of the matching documents
+    """
+    try:
+        query = params.get("query", "")
+        if not query.strip():
+            create_event(span, "search", input=params, output="No query provided")
+            raise ValueError("query is required")
+
+        limit = int(params.get("limit", 5))
+        conversation_uuid = params.get("conversation_uuid") if params.get("conversation_only") else None
+
+        hits: List[SearchHit] = await asyncio.to_thread(search_documents, query, conversation_uuid, limit)
+        if params.get("include_messages", True):
+            message_hits = await asyncio.to_thread(search_messages, query, conversation_uuid, limit)
+            hits = fuse_rankings([hits, message_hits])[:limit]
+
+        if hits:
+            text = "\n\n".join(
+                f"{rank}. [{hit.source}] {hit.name} (uuid: {hit.uuid})\n{hit.snippet}"
+                for rank, hit in enumerate(hits, start=1)
+            )
+        else:
+            text = f"No stored documents or messages match: {query}"
+
+        create_event(span, "search", input=params, output=[hit.model_dump() for hit in hits])
+
+        document_uuids = [hit.uuid for hit in hits if hit.source == "document"]
+        return [create_document(
+            text=text,
+            metadata_override={
+                "conversation_uuid": params.get("conversation_uuid", ""),
+                "source": "document_processor",
+                "name": "SearchResult",
+                "description": f"Stored content matching '{query}', documents: {', '.join(document_uuids) or 'none'}",
+                "type": DocumentType.TEXT,
+                "source_documents": document_uuids
+            }
+        )]
+
+    except Exception as error:
+        create_event(span, "search", level="ERROR", input=params, output={"error": str(error)})
+        raise
+
+
+def fuse_rankings(rankings: List[List[SearchHit]]) -> List[SearchHit]:
+    """
+    Merge ranked hit lists by reciprocal rank fusion
+
+    BM25 scores of different FTS tables depend on their own corpus statistics and column weights,
+    so they are not compared; each hit scores 1 / (RRF_K + rank) in every list it appears in.
+
+    Args:
+        rankings: Hit lists, each ordered best first
+
+    Returns:
+        All distinct hits, best fused rank first; ties keep the order of the lists
+    """
+    fused: Dict[Tuple[str, str], float] = {}
+    hits: Dict[Tuple[str, str], SearchHit] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            key = (hit.source, hit.uuid)
+            fused[key] = fused.get(key, 0.0) + 1.0 / (RRF_K + rank)
+            hits.setdefault(key, hit)
+    return [hits[key] for key in sorted(fused, key=lambda key: fused[key], reverse=True)]
@@ -1,26 +1,51 @@
 import asyncio
+import os
+import time
 from typing import Dict, List
 from uuid import UUID
 
 from llm.tracing import create_event, create_generation, end_generation
 from llm import open_ai
 from llm.prompts import get_prompt
+from logger.logger import log_info
 from models.document import Document, DocumentType
-from utils.document import create_document, restore_placeholders
-from db.document import find_document_by_uuid
+from utils.document import create_document, hash_content
+from utils.text import estimate_tokens, iter_chunks
+from db.document import find_documents_by_uuids
+from db.summaries import cache_summary, find_cached_summary, summary_cache_key
+from db.writer import enqueue_write
+
+# Inputs up to this size are summarized in one completion, larger ones chunk by chunk
+SINGLE_PASS_TOKENS = int(os.getenv("SUMMARIZE_SINGLE_PASS_TOKENS", "12000"))
+MAP_CHUNK_TOKENS = 3000
+MAP_CHUNK_OVERLAP_TOKENS = 150
+# Partial summaries are combined in groups of at most this size until one final pass fits
+REDUCE_INPUT_TOKENS = 8000
+# Completions in flight at once per summarize action
+SUMMARIZE_CONCURRENCY = int(os.getenv("SUMMARIZE_CONCURRENCY", "4"))
+
+DOCUMENT_SEPARATOR = "\n\n---\n\n"
 
 
 async def _summarize(params: Dict, span) -> List[Document]:
     """Summarize one or more documents and create a new document from their contents
-    
+
+    Small inputs are summarized in a single completion. Larger ones are split into token-bounded
+    chunks that are summarized concurrently (map), and the partial summaries are then combined in
+    groups until one final summary remains (reduce). Summaries are cached by the content hashes of
+    their sources and the prompt version; a repeated request returns the existing summary document.
+
     Args:
         params: Parameters including document UUIDs
         span: Tracing span
-        
+
     Returns:
         Document: The created document
     """
     try:
+        started = time.perf_counter()
+        timings = {}
+
         # Extract parameters
         document_uuids = params.get("document_uuids", [])
         if not document_uuids:
@@ -30,53 +55,77 @@ async def _summarize(params: Dict, span) -> List[Document]:
         documents = []
         sources = []
 
-        # Fetch and restore documents
-        for doc_uuid in document_uuids:
-            try:
-                uuid = UUID(doc_uuid) if isinstance(doc_uuid, str) else doc_uuid
-                document = find_document_by_uuid(uuid)
-                if document:
-                    restored_doc = restore_placeholders(document)
-                    documents.append(restored_doc)
-                    sources.append(str(uuid))
-                else:
-                    raise ValueError(f"Document not found: {doc_uuid}")
-            except Exception as e:
-                raise
+        # Fetch all documents in one lookup
+        uuids = [str(UUID(str(doc_uuid))) for doc_uuid in document_uuids]
+        found = find_documents_by_uuids(uuids)
+        for uuid in uuids:
+            if uuid not in found:
+                raise ValueError(f"Document not found: {uuid}")
+            documents.append(found[uuid])
+            sources.append(uuid)
 
         if not documents:
             raise ValueError("No documents found from provided UUIDs")
 
-        # Merge all document contents
-        merged_content = "\n\n---\n\n".join(doc.text for doc in documents)
+        contents = [doc.restored_text for doc in documents]
         source_desc = ", ".join(sources)
+        input_tokens = sum(estimate_tokens(content) for content in contents)
+        timings["fetch_ms"] = _elapsed_ms(started)
 
         # Get prompt configuration
         prompt = get_prompt(name="tool_document_summarize")
         system_prompt = prompt.compile()
         model = prompt.config.get("model", "gpt-4")
 
-        # Run single summarization on merged content
-        generation = create_generation(
+        cache_key = summary_cache_key([hash_content(content) for content in contents], prompt.version)
+        if cached := find_cached_summary(cache_key):
+            create_event(span, "summarize_cache_hit", input=params, output={"document_uuid": str(cached.uuid)})
+            log_info(f"📝 Reusing cached summary {cached.uuid} of {len(documents)} document(s)")
+            return [cached]
+
+        semaphore = asyncio.Semaphore(SUMMARIZE_CONCURRENCY)
+
+        if input_tokens <= SINGLE_PASS_TOKENS:
+            mode = "single"
+            stage_started = time.perf_counter()
+            summary = await _complete(
+                span, "summarize_content", system_prompt, model, DOCUMENT_SEPARATOR.join(contents), semaphore
+            )
+            timings["summarize_ms"] = _elapsed_ms(stage_started)
+            chunk_count, reduce_levels = 1, 0
+        else:
+            mode = "map_reduce"
+            stage_started = time.perf_counter()
+            chunks = [
+                f"Document {index + 1} of {len(contents)}, part {part + 1}:\n\n{chunk}"
+                for index, content in enumerate(contents)
+                for part, chunk in enumerate(iter_chunks(content, MAP_CHUNK_TOKENS, MAP_CHUNK_OVERLAP_TOKENS))
+            ]
+            partial_summaries = await asyncio.gather(*(
+                _complete(span, "summarize_chunk", system_prompt, model, chunk, semaphore) for chunk in chunks
+            ))
+            timings["map_ms"] = _elapsed_ms(stage_started)
+
+            stage_started = time.perf_counter()
+            summary, reduce_levels = await _reduce(span, system_prompt, model, list(partial_summaries), semaphore)
+            timings["reduce_ms"] = _elapsed_ms(stage_started)
+            chunk_count = len(chunks)
+
+        timings["total_ms"] = _elapsed_ms(started)
+        create_event(
             span,
-            "summarize_content",
-            model,
-            merged_content
+            "summarize_timings",
+            output=timings,
+            metadata={"mode": mode, "input_tokens": input_tokens, "chunks": chunk_count, "reduce_levels": reduce_levels}
         )
-        
-        completion = await open_ai.completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": merged_content}
-            ],
-            model=model
+        log_info(
+            f"📝 Summarized {len(documents)} document(s), ~{input_tokens} tokens, {mode} over {chunk_count} chunk(s) "
+            f"in {timings['total_ms']:.0f} ms ({', '.join(f'{stage} {ms:.0f}' for stage, ms in timings.items())})"
         )
-        
-        end_generation(generation, completion)
 
         # Create single summary document
-        return [create_document(
-            text=completion,
+        summary_document = create_document(
+            text=summary,
             metadata_override={
                 "conversation_uuid": params.get("conversation_uuid", ""),
                 "source": "document_processor",
@@ -85,8 +134,67 @@ async def _summarize(params: Dict, span) -> List[Document]:
                 "type": DocumentType.DOCUMENT,
                 "source_documents": sources
             }
-        )]
+        )
+        enqueue_write(params.get("conversation_uuid", ""), cache_summary, cache_key, str(summary_document.uuid))
+        return [summary_document]
 
     except Exception as error:
         create_event(span, "summarize", level="ERROR", input=params, output={"error": str(error)})
         raise
+
+
+async def _reduce(span, system_prompt: str, model: str, summaries: List[str], semaphore: asyncio.Semaphore):
+    """Combine partial summaries level by level until a single completion can summarize them all
+
+    Returns:
+        Final summary and the number of intermediate levels that were needed
+    """
+    levels = 0
+    while len(summaries) > 1 and estimate_tokens(DOCUMENT_SEPARATOR.join(summaries)) > REDUCE_INPUT_TOKENS:
+        groups = _group_by_tokens(summaries, REDUCE_INPUT_TOKENS)
+        summaries = list(await asyncio.gather(*(
+            _complete(span, f"summarize_reduce_{levels + 1}", system_prompt, model, DOCUMENT_SEPARATOR.join(group), semaphore)
+            for group in groups
+        )))
+        levels += 1
+
+    summary = await _complete(
+        span, "summarize_final", system_prompt, model, DOCUMENT_SEPARATOR.join(summaries), semaphore
+    )
+    return summary, levels
+
+
+def _group_by_tokens(summaries: List[str], max_tokens: int) -> List[List[str]]:
+    """Consecutive groups within max_tokens; every group holds at least two summaries so each level shrinks"""
+    groups = []
+    group, group_tokens = [], 0
+    for summary in summaries:
+        tokens = estimate_tokens(summary)
+        if len(group) >= 2 and group_tokens + tokens > max_tokens:
+            groups.append(group)
+            group, group_tokens = [], 0
+        group.append(summary)
+        group_tokens += tokens
+    if len(group) == 1 and groups:
+        groups[-1].append(group[0])
+    elif group:
+        groups.append(group)
+    return groups
+
+
+async def _complete(span, name: str, system_prompt: str, model: str, content: str, semaphore: asyncio.Semaphore) -> str:
+    async with semaphore:
+        generation = create_generation(span, name, model, content)
+        completion = await open_ai.completion(
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": content}
+            ],
+            model=model
+        )
+        end_generation(generation, completion)
+        return completion
+
+
+def _elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
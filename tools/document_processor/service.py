@@ -1,6 +1,8 @@
 from typing import Dict, List
 
 from models.document import Document
+from tools.document_processor.internal._extract import _extract
+from tools.document_processor.internal._search import _search
 from tools.document_processor.internal._summarize import _summarize
 from utils.document import create_error_document
 
@@ -20,6 +22,12 @@ async def execute_document_processor(action: str, params: Dict, span) -> List[Do
         if action == "summarize":
             docs = await _summarize(params, span)
             return docs
+        elif action == "extract":
+            docs = await _extract(params, span)
+            return docs
+        elif action == "search":
+            docs = await _search(params, span)
+            return docs
         else:
             return [create_error_document(
                 Exception(f"Unknown action: {action}"),
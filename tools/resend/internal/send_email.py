@@ -10,7 +10,7 @@ from llm.prompts import get_prompt
 from llm.tracing import create_generation, end_generation
 from models.document import Document, DocumentType
 from utils.document import create_document, create_error_document, restore_placeholders
-from db.document import find_document_by_uuid
+from db.document import find_documents_by_uuids
 from llm.format import format_documents, format_facts
 
 
@@ -22,10 +22,11 @@ async def _send_email(params: Dict, span) -> Document:
         query = params["query"]
         document_uuids = params["documents"]
 
-        # Load and process documents
+        # Load all documents in one lookup and restore their URLs
+        found = find_documents_by_uuids(UUID(uuid_str) for uuid_str in document_uuids)
         documents: List[Document] = []
         for uuid_str in document_uuids:
-            doc = find_document_by_uuid(UUID(uuid_str))
+            doc = found.get(str(UUID(uuid_str)))
             if doc:
                 doc = restore_placeholders(doc)
                 documents.append(doc)
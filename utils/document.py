@@ -1,5 +1,6 @@
+import hashlib
 import re
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from uuid import UUID, uuid4
 
 from models.document import Document, DocumentMetadata, DocumentType
@@ -60,6 +61,8 @@ def create_document(text: str, metadata_override: Dict[str, Any] = {}) -> Docume
         document_metadata["urls"] = extracted["urls"]
         extracted_text = extracted["content"]
 
+    document_metadata["content_hash"] = hash_content(extracted_text)
+
     return Document(
         uuid=metadata_override.get("uuid", uuid4()),
         conversation_uuid=metadata_override.get("conversation_uuid", ""),
@@ -68,83 +71,98 @@ def create_document(text: str, metadata_override: Dict[str, Any] = {}) -> Docume
     )
 
 
+def hash_content(text: str) -> str:
+    """Returns the content address of a document body: sha256 hex digest of its utf-8 bytes"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
 def restore_placeholders(doc: Document) -> Document:
-    """Restores original URLs and images from placeholders in the document text"""
-    content = doc.text
-    metadata = doc.metadata
+    """Returns a copy of the document with original URLs and images restored from placeholders
 
-    urls = metadata.get("urls", [])
-    images = metadata.get("images", [])
+    The restored text comes from the document's cached restored view; metadata is kept as is and
+    the text is not scanned for URLs again.
+    """
+    return Document(
+        uuid=doc.uuid,
+        conversation_uuid=doc.conversation_uuid,
+        text=doc.restored_text,
+        metadata={**doc.metadata}
+    )
 
-    # Restore image placeholders
-    for i, image_url in enumerate(images):
-        content = content.replace(f"{{$img{i}}}", image_url)
 
-    # Restore URL placeholders
-    for i, url in enumerate(urls):
-        content = content.replace(f"{{$url{i}}}", url)
+_PLACEHOLDER_PATTERN = re.compile(r"\{\$(img|url)(\d+)\}")
 
-    return create_document(
-        content,
-        {
-            "uuid": doc.uuid,
-            "conversation_uuid": doc.conversation_uuid,
-            **metadata
-        }
-    )
+
+def restore_text(text: str, images: List[str], urls: List[str]) -> str:
+    """Replaces {$imgN} and {$urlN} placeholders with the original URLs in a single pass"""
+    if not images and not urls:
+        return text
+
+    def replace(match):
+        references = images if match.group(1) == "img" else urls
+        index = int(match.group(2))
+        return references[index] if index < len(references) else match.group(0)
+
+    return _PLACEHOLDER_PATTERN.sub(replace, text)
+
+
+# Markdown images, markdown links and bare URLs, matched in one left-to-right scan. Every match
+# starts with a character from a small set, which lets the regex engine skip ahead with a fast
+# character-class search; lookbehinds then tell the alternatives apart by that first character.
+# Link text may hold one image, e.g. a badge `[![alt](image)](target)`, whose URL is extracted as
+# well; a bare URL ends where an image starts.
+_LINK_TEXT = r'[^\]!]*(?:!(?!\[)[^\]!]*)*'
+_BARE_URL_TAIL = r'(?:[^\s<>"!]|!(?!\[))[^\s<>"!]*(?:!(?!\[)[^\s<>"!]*)*'
+_MARKDOWN_REFERENCE_PATTERN = re.compile(
+    r'[!\[hw](?:'
+    r'(?<=!)\[(?P<image_alt>[^\]]*)\]\((?P<image_url>[^)]+)\)'
+    rf'|(?<=\[)(?!\])(?P<link_text>{_LINK_TEXT})'
+    rf'(?:!\[(?P<linked_alt>[^\]]*)\]\((?P<linked_image>[^)]+)\)(?P<link_text_after>{_LINK_TEXT}))?'
+    r'\]\((?P<link_url>[^)]+)\)'
+    rf'|(?<!\]\([hw])(?<=h)(?P<bare_http>ttps?://{_BARE_URL_TAIL})(?!\))'
+    rf'|(?<!\]\([hw])(?<=w)(?P<bare_www>ww\.{_BARE_URL_TAIL})(?!\))'
+    r')'
+)
 
 
 def extract_images_and_urls(text: str) -> Dict[str, Any]:
-    """Extracts image URLs and regular URLs from markdown text content"""
-    urls = []
+    """Extracts image URLs and regular URLs from markdown text content
+
+    The text is scanned once. Images are numbered in order of appearance; link targets are numbered
+    before bare URLs, so `{$urlN}` placeholders keep the numbering of the earlier multi-pass version.
+    """
     images = []
-    url_index = 0
-    image_index = 0
-    content = text
-
-    def replace_images(match):
-        nonlocal image_index
-        alt_text, url = match.groups()
-        images.append(url)
-        placeholder = f"![{alt_text}]({{$img{image_index}}})"
-        image_index += 1
-        return placeholder
-
-    def replace_urls(match):
-        nonlocal url_index
-        link_text, url = match.groups()
-        if not url.startswith('{{$img'):
-            urls.append(url)
-            placeholder = f"[{link_text}]({{$url{url_index}}})"
-            url_index += 1
-            return placeholder
-        return match.group(0)
-
-    # Replace markdown images first
-    content = re.sub(r'!\[([^\]]*)\]\(([^)]+)\)', replace_images, content)
-
-    # Then replace markdown links
-    content = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', replace_urls, content)
-
-    # Handle bare URLs
-    def replace_bare_urls(match):
-        nonlocal url_index
-        url = match.group(0)
-        if not url.startswith('{{$'):
-            urls.append(url)
-            placeholder = f"{{$url{url_index}}}"
-            url_index += 1
-            return placeholder
-        return url
-
-    content = re.sub(
-        r'(?<!\]\()(https?://[^\s<>"]+|www\.[^\s<>"]+)(?!\))',
-        replace_bare_urls,
-        content
-    )
+    link_urls = []
+    bare_urls = []
+    pieces = []
+    bare_url_pieces = []  # positions in pieces filled once the number of links is known
+    position = 0
+
+    for match in _MARKDOWN_REFERENCE_PATTERN.finditer(text):
+        pieces.append(text[position:match.start()])
+        position = match.end()
+        kind = match.lastgroup
+        if kind == 'image_url':
+            pieces.append(f"![{match.group('image_alt')}]({{$img{len(images)}}})")
+            images.append(match.group('image_url'))
+        elif kind == 'link_url':
+            link_text = match.group('link_text')
+            if match.group('linked_image') is not None:
+                link_text += f"![{match.group('linked_alt')}]({{$img{len(images)}}}){match.group('link_text_after')}"
+                images.append(match.group('linked_image'))
+            pieces.append(f"[{link_text}]({{$url{len(link_urls)}}})")
+            link_urls.append(match.group('link_url'))
+        else:
+            bare_url_pieces.append(len(pieces))
+            pieces.append("")
+            bare_urls.append(match.group(0))
+    pieces.append(text[position:])
+
+    for bare_index, piece_index in enumerate(bare_url_pieces):
+        pieces[piece_index] = f"{{$url{len(link_urls) + bare_index}}}"
 
     return {
-        "content": content,
-        "urls": urls,
+        "content": "".join(pieces),
+        "urls": link_urls + bare_urls,
         "images": images
     }
@@ -4,6 +4,7 @@ from typing import Dict, Any, List
 
 import requests
 
+from agent.state_cache import invalidate_cached_state
 from db.document import save_document
 from db.models import ConversationDocumentModel
 from logger.logger import log_info, log_error
@@ -49,11 +50,12 @@ def _process_attachments(files: List[Dict[str, Any]], conversation_uuid) -> None
                 }
             )
             # Save document and create conversation-document relationship
-            save_document(doc.__dict__)
+            save_document(doc)
             ConversationDocumentModel.create(
                 conversation_uuid=conversation_uuid,
                 document_id=doc.uuid
             )
+            invalidate_cached_state(conversation_uuid)
             log_info(f"Created document and conversation relationship for: {file.get('title', '')}")
 
         except Exception as e:
@@ -11,14 +11,19 @@ def add_documents(state: AgentState, documents: List[Document]) -> AgentState:
 def complete_task(state: AgentState, task_uuid: str) -> AgentState:
     """Mark a task as complete with persistence"""
     from db.tasks import update_task_status
+    from db.writer import enqueue_write
+    from agent.state_cache import cache_state
 
     task = state.find_task(task_uuid)
     if task:
         updated_task = task.model_copy(update={"status": "done"})
-        new_state = state.update_current_task(updated_task)
+        new_state = state.update_current_task(updated_task).copy(
+            tasks=[updated_task if existing.uuid == task_uuid else existing for existing in state.tasks]
+        )
 
-        # Persist to database
-        update_task_status(task_uuid, "done")
+        # Persist to database on the writer thread
+        enqueue_write(state.conversation_uuid, update_task_status, task_uuid, "done")
+        cache_state(new_state)
 
         return new_state
     return state
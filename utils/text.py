@@ -1,36 +1,226 @@
-from typing import List
+import codecs
+import mmap
+import re
+from typing import IO, Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+
+def iter_chunks(
+        source: Union[str, bytes, memoryview, mmap.mmap, IO, Iterable[str]],
+        max_tokens: int = 800,
+        overlap_tokens: int = 80,
+        count_tokens: Optional[Callable[[str], int]] = None
+) -> Iterator[str]:
+    """Stream markdown text as chunks of at most max_tokens tokens.
+
+    Chunks are cut at markdown boundaries where possible: before headings and list items and after
+    blank lines, never inside a paragraph unless it alone exceeds the budget, and never inside a word
+    unless it alone does (a data: URL, minified JSON). A chunk starting at a
+    heading is preferred once the current one is half full. A code fence that has to be split is
+    closed at the end of the chunk and reopened at the start of the next. Each chunk after a cut
+    repeats up to overlap_tokens tokens of trailing lines from the previous one.
+
+    Only the current chunk is held in memory, so the input can be a large file, a memory-mapped
+    blob (bytes are decoded as utf-8) or an iterator of text pieces such as db.blobs.iter_blob_text.
+
+    Args:
+        source: Text, utf-8 bytes, a file object or an iterable of text pieces
+        max_tokens: Token budget per chunk
+        overlap_tokens: Tokens of context repeated from the end of the previous chunk
+        count_tokens: Token counter, defaults to estimate_tokens
+
+    Yields:
+        Chunks of the text, each ending with its original line breaks
+    """
+    if overlap_tokens * 2 > max_tokens:
+        raise ValueError("overlap_tokens must be at most half of max_tokens")
+    count_tokens = count_tokens or estimate_tokens
+
+    lines: List[str] = []
+    counts: List[int] = []
+    carried = 0  # leading lines repeated from the previous chunk
+    boundary = 0  # lines[:boundary] can be emitted without cutting a markdown block
+    fence_opener = None  # opening line of the code fence being read
+
+    def cut(position: int) -> Iterator[str]:
+        """Emit lines[:position] and keep the rest, preceded by the overlap, as the next chunk"""
+        nonlocal lines, counts, carried, boundary
+        chunk = lines[:position]
+        if not "".join(chunk).strip():
+            # Blank lines alone are not a chunk: they stay at the start of the next one
+            boundary = 0
+            return
+        split_fence = fence_opener is not None and position == len(lines)
+        yield "".join(chunk) + (_closing_fence(fence_opener) if split_fence else "")
+
+        overlap, overlap_counts = [], []
+        budget = overlap_tokens
+        for line, count in zip(reversed(chunk), reversed(counts[:position])):
+            if count > budget or _FENCE_PATTERN.match(line):
+                break
+            overlap.insert(0, line)
+            overlap_counts.insert(0, count)
+            budget -= count
+        while overlap and not overlap[0].strip():
+            del overlap[0], overlap_counts[0]
+        if split_fence:
+            overlap.insert(0, fence_opener)
+            overlap_counts.insert(0, count_tokens(fence_opener))
+
+        lines = overlap + lines[position:]
+        counts = overlap_counts + counts[position:]
+        carried = len(overlap)
+        boundary = 0
+
+    for line in _iter_lines(source):
+        stripped = line.strip()
+        is_fence = bool(_FENCE_PATTERN.match(line))
+        if fence_opener is None and lines and (
+                is_fence or _HEADING_PATTERN.match(line) or _LIST_ITEM_PATTERN.match(line)):
+            boundary = len(lines)
+            # Start sections in a fresh chunk once the current one is reasonably full
+            if _HEADING_PATTERN.match(line) and sum(counts) * 2 >= max_tokens:
+                yield from cut(boundary)
+
+        count = count_tokens(line)
+        # A chunk cut inside a code fence is closed by an extra fence line
+        closing_count = count_tokens(_closing_fence(fence_opener)) if fence_opener is not None and not is_fence else 0
+        only_blank_lines = len(lines) > carried and not any(previous.strip() for previous in lines[carried:])
+        if count + closing_count > max_tokens or (
+                only_blank_lines and sum(counts[carried:]) + count + closing_count > max_tokens):
+            # A single line over budget, or one that does not fit after the blank lines before it:
+            # emit it, with those blank lines, in pieces without overlap
+            blank_lines = "".join(lines[carried:]) if only_blank_lines else ""
+            if len(lines) > carried and not only_blank_lines:
+                yield from cut(len(lines))
+            lines, counts, carried, boundary = [], [], 0, 0
+            yield from _split_line(blank_lines + line, max_tokens, count_tokens)
+            continue
+
+        while sum(counts) + count + closing_count > max_tokens:
+            if not any(previous.strip() for previous in lines[carried:]):
+                # Only repeated context and blank lines left: drop the context rather than emit it again
+                lines, counts, carried, boundary = lines[carried:], counts[carried:], 0, 0
+                break
+            yield from cut(boundary if boundary > carried else len(lines))
+
+        lines.append(line)
+        counts.append(count)
+        if is_fence:
+            fence_opener = line if fence_opener is None else None
+        if fence_opener is None and (not stripped or is_fence):
+            boundary = len(lines)
+
+    if any(previous.strip() for previous in lines[carried:]):
+        yield "".join(lines)
+
+
+_HEADING_PATTERN = re.compile(r"\s{0,3}#{1,6}\s")
+_LIST_ITEM_PATTERN = re.compile(r"\s*(?:[-*+]|\d+[.)])\s")
+_FENCE_PATTERN = re.compile(r"\s*(`{3,}|~{3,})")
+READ_SIZE = 64 * 1024
+
+
+def _iter_lines(source: Union[str, bytes, memoryview, mmap.mmap, IO, Iterable[str]]) -> Iterator[str]:
+    """Lines of the source including their line breaks, reading it piece by piece"""
+    if isinstance(source, str):
+        pieces = iter([source])
+    elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        pieces = _decode(source[start:start + READ_SIZE] for start in range(0, len(source), READ_SIZE))
+    elif hasattr(source, "read"):
+        pieces = _decode(iter(lambda: source.read(READ_SIZE), source.read(0)))
+    else:
+        pieces = source
+
+    pending = ""
+    for piece in pieces:
+        text = pending + piece if pending else piece
+        start = 0
+        while (end := text.find("\n", start)) != -1:
+            yield text[start:end + 1]
+            start = end + 1
+        pending = text[start:]
+    if pending:
+        yield pending
+
+
+def _closing_fence(opener: str) -> str:
+    match = _FENCE_PATTERN.match(opener)
+    return f"{match.group(0)}\n"
+
+
+def _decode(pieces: Iterable[Union[str, bytes]]) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for piece in pieces:
+        yield piece if isinstance(piece, str) else decoder.decode(piece)
+    yield decoder.decode(b"", final=True)
+
+
+def _split_line(line: str, max_tokens: int, count_tokens: Callable[[str], int]) -> Iterator[str]:
+    """Pieces of at most max_tokens tokens, cut between words; a word over budget on its own, such as
+    a data: URL or minified JSON, is cut into the longest fitting runs of characters"""
+    piece = ""
+    for word in re.findall(r"\S+\s*|\s+", line):
+        if piece and count_tokens(piece + word) > max_tokens:
+            yield piece
+            piece = ""
+        while not piece and count_tokens(word) > max_tokens:
+            length = _fitting_length(word, max_tokens, count_tokens)
+            yield word[:length]
+            word = word[length:]
+        piece += word
+    if piece:
+        yield piece
+
+
+def _fitting_length(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> int:
+    """Length of the longest prefix of text within max_tokens tokens, at least one character"""
+    low, high = 1, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def split_to_spans(text: str, chunk_size: int = 1500) -> List[Tuple[int, int]]:
+    """Split text into [start, end) character spans of at most about chunk_size characters.
+
+    Spans end after a paragraph break where possible, otherwise after a line break or whitespace,
+    so chunks can be read back from the stored text by slicing instead of being stored again.
 
-def split_to_chunks(text: str, chunk_size: int = 3000) -> List[str]:
-    """Split text into chunks of approximately chunk_size characters.
-    
     Args:
         text: The text to split
-        chunk_size: Target size for each chunk in characters
-        
+        chunk_size: Target maximum size for each span in characters
+
     Returns:
-        List of text chunks, split on whitespace to avoid breaking words
+        Consecutive spans covering all non-whitespace content of the text
     """
-    chunks = []
-    current_chunk = []
-    current_size = 0
-    
-    # Split on whitespace to avoid breaking words
-    words = text.split()
-    
-    for word in words:
-        word_size = len(word) + 1  # Add 1 for the space
-        
-        if current_size + word_size > chunk_size and current_chunk:
-            # Join current chunk and add to results
-            chunks.append(' '.join(current_chunk))
-            current_chunk = []
-            current_size = 0
-            
-        current_chunk.append(word)
-        current_size += word_size
-        
-    # Add the last chunk if there is one
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
-        
-    return chunks
+    spans = []
+    start = 0
+    length = len(text)
+    while start < length:
+        while start < length and text[start].isspace():
+            start += 1
+        if start >= length:
+            break
+
+        end = min(start + chunk_size, length)
+        if end < length:
+            window = text[start:end]
+            for separator in ("\n\n", "\n", " "):
+                cut = window.rfind(separator)
+                if cut > chunk_size // 2:
+                    end = start + cut + len(separator)
+                    break
+
+        spans.append((start, end))
+        start = end
+
+    return spans
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the number of model tokens in text (about four characters per token for English)"""
+    return (len(text) + 3) // 4